@@ -0,0 +1,156 @@
+#!/usr/bin/python
+import time
+import socket
+import struct
+import binascii
+import argparse
+import tempfile
+import shutil
+import resource
+import numpy as np
+from scannerUdpBackend import UdpScanProt, UdpScannerServer
+from scannerQueue import ScanQueue
+
+DFLT_BOARD_STEPS=[1, 2, 4, 8, 16, 32]
+DFLT_SWEEP_RATE=10.0
+DFLT_STEP_TIME=10.0
+DFLT_PORT=19930
+DFLT_RSSI_VALUES=730
+#Time to wait after the last packet for the backend to process the data still in flight
+DRAIN_TIME=2.0
+
+class SimulatedBoard():
+	'''
+	Simulated scanner board with its own MAC address and source IP address.
+	The backend identifies each board by its source IP, so every board binds
+	its socket to a different address of the loopback network 127.0.0.0/8,
+	which doesn't need root privileges as spoofing the source IP does
+	'''
+	
+	def __init__(self, boardIndex, dstAddr, amtRssiValues, scanOpt=UdpScanProt.defaultOpt):
+		'''
+		:param boardIndex: Index of the board, used to derive its MAC and IP addresses
+		:param dstAddr: Tuple (IP, port) where the backend listens
+		:param amtRssiValues: Amount of RSSI values of every sweep
+		:param scanOpt: UdpScanProt.Opt namedtuple sent with every sweep
+		'''
+		macHex="0e%010x" % (boardIndex+1)
+		#Same notation used by the backend to identify the board
+		self.macAddr=":".join(macHex[i:i+2] for i in range(0, len(macHex), 2))
+		self.ipAddr="127.0.%d.%d" % ((boardIndex+1)/254, (boardIndex+1)%254+1)
+		self.dstAddr=dstAddr
+		self.sock=socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+		self.sock.bind((self.ipAddr, 0))
+		
+		#The packet is built once and sent again for every sweep
+		pkgLen=struct.calcsize(UdpScanProt.headerFormat)+struct.calcsize(UdpScanProt.optFormat)+amtRssiValues
+		protHeader=UdpScanProt.Header(protId=UdpScanProt.protId, protLen=pkgLen,
+									macAddr=binascii.unhexlify(macHex))
+		self.packet=bytearray(struct.pack(UdpScanProt.headerFormat, *protHeader)+
+							struct.pack(UdpScanProt.optFormat, *scanOpt))
+		#Random RSSI values between -110 and -90 dBm, in the offset notation of the board
+		rssiDbm=np.random.randint(-110, -90, amtRssiValues)
+		self.packet.extend(((rssiDbm+UdpScanProt.rssiOffset)*2).astype(np.int8).tostring())
+	
+	def send_sweep(self):
+		'''
+		Send the next sweep of the board
+		'''
+		self.sock.sendto(self.packet, self.dstAddr)
+	
+	def close(self):
+		self.sock.close()
+
+def raise_fd_limit(amtBoards):
+	'''
+	Raise the soft limit of open files if it's too low to open a socket per board
+	'''
+	softLimit, hardLimit=resource.getrlimit(resource.RLIMIT_NOFILE)
+	needed=amtBoards+64
+	if softLimit!=resource.RLIM_INFINITY and softLimit<needed:
+		if hardLimit!=resource.RLIM_INFINITY:
+			needed=min(needed, hardLimit)
+		resource.setrlimit(resource.RLIMIT_NOFILE, (needed, hardLimit))
+
+def run_step(amtBoards, sweepRate, stepTime, port, amtRssiValues, rcvBufSize, queuePolicy='block', writerProcess=False):
+	'''
+	Run the backend against amtBoards simulated boards sending sweepRate sweeps/s each
+	during stepTime seconds, and return a dictionary with the results. A sweep is stored once
+	its row is committed to the HDF5 file, and its latency is measured from its reception to
+	the commit by the pipeline statistics of the backend, approximated by their histogram buckets
+	'''
+	tmpDir=tempfile.mkdtemp(prefix="scannerBench")
+	server=UdpScannerServer(guiActive=True, rcvBufSize=rcvBufSize, listenPort=port, stageTiming=True,
+						h5Dir=tmpDir, queuePolicy=queuePolicy, writerProcess=writerProcess)
+	boardList=[]
+	try:
+		boardList=[SimulatedBoard(n, ("127.0.0.1", port), amtRssiValues) for n in range(amtBoards)]
+		#Give the server thread time to bind its socket
+		time.sleep(0.5)
+		
+		#Send the sweeps round-robin, spacing them evenly in time
+		sendInterval=1.0/(sweepRate*amtBoards)
+		startTime=time.time()
+		nextSend=startTime
+		sweepsSent=0
+		while nextSend-startTime<stepTime:
+			delay=nextSend-time.time()
+			if delay>0:
+				time.sleep(delay)
+			boardList[sweepsSent%amtBoards].send_sweep()
+			sweepsSent+=1
+			nextSend=startTime+sweepsSent*sendInterval
+		sendTime=time.time()-startTime
+		
+		time.sleep(DRAIN_TIME)
+		stats=server.stats()
+	finally:
+		server.close_backend()
+		server.join()
+		while server.h5Thread.isAlive():
+			time.sleep(0.1)
+		for board in boardList:
+			board.close()
+		shutil.rmtree(tmpDir, ignore_errors=True)
+	
+	recvStats, writeStats, queueStats=stats['recv'], stats['write'], stats['queue']
+	totalStage=stats['pipeline']['stages']['total']
+	latencyP50, latencyP90, latencyP99=[totalStage[name]*1000.0 if totalStage[name]!=None else float('nan')
+										for name in ('p50', 'p90', 'p99')]
+	sweepsStored=writeStats['rowsWritten']
+	
+	return {'boards':amtBoards,
+			'sweepsSent':sweepsSent,
+			'offeredRate':sweepsSent/sendTime,
+			'sweepsStored':sweepsStored,
+			'storedRate':sweepsStored/sendTime,
+			'datagramsLost':sweepsSent-recvStats['datagramsReceived'],
+			'kernelDrops':recvStats['kernelDrops'],
+			'queueDropped':queueStats['dropped']+queueStats['coalesced'],
+			'latencyP50':latencyP50,
+			'latencyP90':latencyP90,
+			'latencyP99':latencyP99,
+			'rowsPerSec':writeStats['rowsPerSec']}
+
+if __name__=='__main__':
+	parser = argparse.ArgumentParser(description="End-to-end ingest benchmark of the scanner backend, \
+runs several simulated boards against a local UDP server and reports its throughput as the amount of boards grows")
+	parser.add_argument("-b", "--boards", help="Amount of boards of each step of the benchmark", type=int, nargs='+', default=DFLT_BOARD_STEPS, metavar="N")
+	parser.add_argument("-r", "--sweepRate", help="Sweeps per second sent by each board", type=float, default=DFLT_SWEEP_RATE, metavar="rate")
+	parser.add_argument("-t", "--stepTime", help="Duration of each step in seconds", type=float, default=DFLT_STEP_TIME, metavar="secs")
+	parser.add_argument("-p", "--port", help="UDP port used by the server under test", type=int, default=DFLT_PORT, metavar="port")
+	parser.add_argument("-n", "--rssiValues", help="Amount of RSSI values of each sweep", type=int, default=DFLT_RSSI_VALUES, metavar="N")
+	parser.add_argument("-B", "--rcvBuf", help="SO_RCVBUF requested for the server socket in bytes", type=int, metavar="bytes")
+	parser.add_argument("-P", "--queuePolicy", help="Policy of the scan queue when the H5 backend falls behind", choices=ScanQueue.policies, default='block')
+	parser.add_argument("-w", "--writerProcess", help="Run the H5 backend in a separate process", action="store_true")
+	args=parser.parse_args()
+	
+	raise_fd_limit(max(args.boards))
+	print "%6s %10s %10s %10s %8s %8s %8s %9s %9s %9s %10s" % ("boards", "offered/s", "stored/s", "stored",
+		"lost", "kDrops", "qDrops", "p50(ms)", "p90(ms)", "p99(ms)", "h5 rows/s")
+	for amtBoards in args.boards:
+		res=run_step(amtBoards, args.sweepRate, args.stepTime, args.port, args.rssiValues, args.rcvBuf, args.queuePolicy,
+						args.writerProcess)
+		print "%6d %10.1f %10.1f %10d %8d %8s %8d %9.2f %9.2f %9.2f %10.1f" % (res['boards'], res['offeredRate'],
+			res['storedRate'], res['sweepsStored'], res['datagramsLost'], res['kernelDrops'], res['queueDropped'],
+			res['latencyP50'], res['latencyP90'], res['latencyP99'], res['rowsPerSec'])
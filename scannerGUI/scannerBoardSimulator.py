@@ -7,6 +7,8 @@ import struct
 import binascii
 import argparse
 import os
+import multiprocessing
+import numpy as np
 from scannerUdpBackend import UdpScanProt
 
 DFLT_SRC_IP = "127.0.0.1"
@@ -21,6 +23,129 @@ MAX_RES=812
 DFLT_RES=203
 DFLT_PKT_DELAY=0.1
 DFLT_RAND_DELAY=5
+#Amount of precomputed random payloads cycled by the high-rate generator
+PAYLOAD_POOL_SIZE=256
+#Maximum amount of packets sent in a burst by the token bucket
+DFLT_BURST=32
+
+class PacketTemplate():
+	'''
+	Scanner packet precomputed as a NumPy byte array. The header and the scan
+	options are packed only once, each call to next_packet() only copies
+	the next payload of a pool of random RSSI values into the template
+	'''
+	
+	def __init__(self, macAddr, scanOpt, amtRssiValues, poolSize=PAYLOAD_POOL_SIZE):
+		'''
+		:param macAddr: MAC address of the board as a hex string, with or without colons
+		:param scanOpt: UdpScanProt.Opt namedtuple sent in every packet
+		:param amtRssiValues: Amount of RSSI values of every packet
+		:param poolSize: Amount of different payloads generated in advance
+		'''
+		pkgLen=struct.calcsize(UdpScanProt.headerFormat)+struct.calcsize(UdpScanProt.optFormat)+amtRssiValues
+		protHeader = UdpScanProt.Header(protId=UdpScanProt.protId, protLen=pkgLen,
+								macAddr=binascii.unhexlify(macAddr.replace(":","")))
+		prefix=struct.pack(UdpScanProt.headerFormat, *protHeader)+struct.pack(UdpScanProt.optFormat, *scanOpt)
+		self.packet=np.empty(pkgLen, np.uint8)
+		self.packet[:len(prefix)]=np.frombuffer(prefix, np.uint8)
+		self.payload=self.packet[len(prefix):]
+		#Random RSSI values between -110 and -90 dBm in the byte with offset notation
+		rssiValuesDbm=np.random.randint(-110, -90, (poolSize, amtRssiValues))
+		self.payloadPool=((rssiValuesDbm+UdpScanProt.rssiOffset)*2).astype(np.int8).view(np.uint8)
+		self.poolIndex=0
+	
+	def next_packet(self):
+		'''
+		Fill the template with the next payload of the pool and return it,
+		the returned array is overwritten by the next call
+		'''
+		self.payload[:]=self.payloadPool[self.poolIndex]
+		self.poolIndex=(self.poolIndex+1)%len(self.payloadPool)
+		return self.packet
+
+class TokenBucket():
+	'''
+	Token bucket scheduler that paces the packets to an exact average rate.
+	The tokens are refilled from the elapsed time, so the oversleeping of
+	time.sleep() is compensated by the following bursts instead of lowering the rate
+	'''
+	
+	def __init__(self, rate, burst=DFLT_BURST):
+		'''
+		:param rate: Target rate in packets per second
+		:param burst: Maximum amount of tokens accumulated by the bucket
+		'''
+		self.rate=float(rate)
+		self.burst=max(1, burst)
+		self.tokens=0.0
+		self.lastRefill=time.time()
+	
+	def take(self):
+		'''
+		Wait until there's at least one token and return the amount of packets
+		that can be sent right now, removing their tokens from the bucket
+		'''
+		while True:
+			now=time.time()
+			self.tokens=min(self.burst, self.tokens+(now-self.lastRefill)*self.rate)
+			self.lastRefill=now
+			if self.tokens>=1:
+				amtPackets=int(self.tokens)
+				self.tokens-=amtPackets
+				return amtPackets
+			time.sleep((1-self.tokens)/self.rate)
+
+def generator_worker(workerArgs):
+	'''
+	Send packets of a single simulated board at a fixed rate from its own process
+	:param workerArgs: Tuple (macAddr, scanOpt, amtRssiValues, dstIP, rate, packetLimit),
+	scanOpt as a plain tuple in the order of UdpScanProt.Opt and packetLimit None to send until interrupted
+	Return a tuple with the amount of packets sent and the time spent
+	'''
+	macAddr, scanOpt, amtRssiValues, dstIP, rate, packetLimit=workerArgs
+	genSock=socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+	template=PacketTemplate(macAddr, scanOpt, amtRssiValues)
+	bucket=TokenBucket(rate)
+	pktSent=0
+	startTime=time.time()
+	try:
+		while packetLimit==None or pktSent<packetLimit:
+			amtPackets=bucket.take()
+			if packetLimit!=None:
+				amtPackets=min(amtPackets, packetLimit-pktSent)
+			for _ in xrange(amtPackets):
+				genSock.sendto(template.next_packet(), (dstIP, DST_PORT))
+			pktSent+=amtPackets
+	except KeyboardInterrupt:
+		pass
+	finally:
+		genSock.close()
+	return pktSent, time.time()-startTime
+
+def run_generator(srcMAC, scanOpt, amtRssiValues, dstIP, rate, amtProcesses, packetLimit):
+	'''
+	High-rate generator mode, spreads the target rate over a pool of processes,
+	each one of them simulating a board with a consecutive MAC address
+	'''
+	macBase=int(srcMAC.replace(":",""), 16)
+	workerArgsList=[]
+	for n in range(amtProcesses):
+		macAddr="%012x" % (macBase+n)
+		workerLimit=None
+		if packetLimit!=None:
+			workerLimit=packetLimit/amtProcesses+(1 if n<packetLimit%amtProcesses else 0)
+		#The options are passed as a plain tuple because UdpScanProt.Opt can't be pickled
+		workerArgsList.append((macAddr, tuple(scanOpt), amtRssiValues, dstIP, float(rate)/amtProcesses, workerLimit))
+	pool=multiprocessing.Pool(amtProcesses)
+	try:
+		#map_async with a timeout keeps the main process responsive to Ctrl+C
+		resultList=pool.map_async(generator_worker, workerArgsList).get(1e9)
+	finally:
+		pool.close()
+		pool.join()
+	pktSent=sum(sent for sent, _ in resultList)
+	elapsed=max(spent for _, spent in resultList)
+	print "Sent", pktSent, "packets in", round(elapsed, 2), "s:", round(pktSent/elapsed if elapsed>0 else 0.0, 1), "packets/s"
 
 #Parse command-line options
 parser = argparse.ArgumentParser(description="Simple simulator of a white space detector board, \
@@ -34,6 +159,8 @@ parser.add_argument("-s", "--srcIP", help="Source IP address of the UDP frequenc
 parser.add_argument("-m", "--srcMAC", help="Source MAC address of the UDP frequency scanning packets", default=DFLT_SRC_MAC, metavar="srcMAC")
 parser.add_argument("-w", "--packetWait", help="Delay between UDP packets in ms", type=int, default=DFLT_PKT_DELAY, metavar="delay")
 parser.add_argument("-n", "--packetLimit", help="Number of packets to send", type=int, metavar='pktLim')
+parser.add_argument("-p", "--packetRate", help="High-rate generator mode, send precomputed packets paced to this rate in packets/s", type=float, metavar="rate")
+parser.add_argument("-j", "--processes", help="Amount of processes of the high-rate generator, each one simulates a board with consecutive MAC addresses", type=int, default=1, metavar="N")
 args=parser.parse_args()
 
 #Check syntax of parameters
@@ -64,7 +191,21 @@ if args.freqResolution:
 	freqResolution=args.freqResolution
 	if freqResolution<MIN_RES or freqResolution>MAX_RES:
 		parser.error("Syntax error in the freqResolution parameter, acceptable range: ["+str(MIN_RES)+"-"+str(MAX_RES)+"] Khz")
-		
+
+if args.packetRate!=None:
+	if args.packetRate<=0:
+		parser.error("Syntax error in the packetRate parameter, it must be positive")
+	if args.processes<1:
+		parser.error("Syntax error in the processes parameter, at least one process is needed")
+	if args.srcIP!=DFLT_SRC_IP or args.randRange:
+		parser.error("The high-rate generator mode doesn't support spoofing the source IP or randomizing the frequency range")
+	genScanOpt=UdpScanProt.defaultOpt._replace(freqStartMhz=int(startFreq), freqStartKhz=int(round((startFreq%1)*1000)),
+											freqStopMhz=int(stopFreq), freqStopKhz=int(round((stopFreq%1)*1000)),
+											freqRes=int(args.freqResolution))
+	amtRssiValues=int((stopFreq-startFreq)/(genScanOpt.freqRes/1000.0))
+	run_generator(args.srcMAC, genScanOpt, amtRssiValues, args.dstIP, args.packetRate, args.processes, args.packetLimit)
+	raise SystemExit
+
 if args.randRange:
 	randTimer=time.time()
 
@@ -0,0 +1,153 @@
+#!/usr/bin/python
+import os
+import time
+import argparse
+import tempfile
+import shutil
+import numpy as np
+import tables as tb
+from scannerH5Backend import H5ScannerThread, blosc_codecs
+
+DFLT_CODECS=["none:0", "zlib:1", "zlib:5", "lzo:1", "bzip2:1", "blosc:1", "blosc:5", "blosc:lz4:1", "blosc:lz4:5", "blosc:zstd:1"]
+DFLT_SWEEPS=20000
+DFLT_RSSI_VALUES=730
+#Rows appended per write, the same as the default batches of the H5 backend
+DFLT_BATCH_ROWS=64
+DFLT_READ_ROWS=64
+DFLT_READS=200
+
+def synthetic_spectra(amtSweeps, amtRssiValues, seed=0):
+	'''
+	Return an uint8 array with amtSweeps sweeps of raw RSSI codes that look like the
+	band seen by a board: a noisy floor around -100 dBm, a few persistent carriers
+	and some channels that switch on and off between sweeps
+	'''
+	rng=np.random.RandomState(seed)
+	floor=-100.0+3.0*np.sin(np.linspace(0, 6*np.pi, amtRssiValues))
+	sweeps=floor+rng.normal(0, 1.5, (amtSweeps, amtRssiValues))
+	for _ in range(8):
+		carrierStart=rng.randint(0, amtRssiValues)
+		carrierWidth=rng.randint(2, 20)
+		sweeps[:, carrierStart:carrierStart+carrierWidth]+=rng.uniform(30, 60)
+	for _ in range(4):
+		burstStart=rng.randint(0, amtRssiValues)
+		burstWidth=rng.randint(5, 40)
+		burstOn=rng.rand(amtSweeps)<0.3
+		sweeps[burstOn, burstStart:burstStart+burstWidth]+=rng.uniform(20, 50)
+	#Inverse of the conversion of the backend, dBm=(int8(code)-147)/2
+	return np.clip(np.rint(sweeps*2+147), -128, 127).astype(np.int8).view(np.uint8)
+
+def recorded_spectra(h5FilePath):
+	'''
+	Return the raw RSSI codes of the longest session table of a scan file
+	'''
+	h5File=tb.openFile(h5FilePath, mode="r")
+	try:
+		tableList=[table for table in h5File.walkNodes("/", classname='Table') if 'rssiCodes' in table.colnames]
+		if len(tableList)==0:
+			raise ValueError("No session tables with raw RSSI codes in "+h5FilePath)
+		table=max(tableList, key=lambda table: table.nrows)
+		return table.col('rssiCodes')
+	finally:
+		h5File.close()
+
+def parse_codec(codec):
+	'''
+	Split a codec given as complib:level, like blosc:lz4:5, into (complib, level)
+	'''
+	complib, _, level=codec.rpartition(":")
+	return complib, int(level)
+
+def run_codec(rssiCodes, complib, complevel, shuffle, chunkBytes, batchRows, readRows, amtReads, tmpDir):
+	'''
+	Write the sweeps into a session table with the given filters, read them back
+	and return a dictionary with the results
+	'''
+	amtSweeps, amtRssiValues=rssiCodes.shape
+	h5FilePath=os.path.join(tmpDir, "codec.h5")
+	if complevel>0:
+		filters=tb.Filters(complevel=complevel, complib=complib, shuffle=shuffle)
+	else:
+		filters=tb.Filters(complevel=0)
+
+	#Rows with the same layout as the ones written by the H5 backend
+	desc=H5ScannerThread.scan_table_desc(amtRssiValues)
+	rows=np.zeros(amtSweeps, dtype=tb.Description(desc)._v_dtype)
+	rows['timestamp']=time.time()+np.arange(amtSweeps)*0.1
+	rows['macAddr']="0e:00:00:00:00:01"
+	rows['ipAddr']="127.0.0.1"
+	rows['isAlive']=True
+	rows['rssiCodes']=rssiCodes
+
+	startTime=time.time()
+	h5File=tb.openFile(h5FilePath, mode="w", filters=filters)
+	table=h5File.createTable("/", "session1", desc, expectedrows=amtSweeps,
+							chunkshape=H5ScannerThread.session_chunkshape(amtRssiValues, chunkBytes))
+	for batchStart in range(0, amtSweeps, batchRows):
+		table.append(rows[batchStart:batchStart+batchRows])
+		table.flush()
+	chunkRows=table.chunkshape[0]
+	h5File.close()
+	writeTime=time.time()-startTime
+	fileSize=os.path.getsize(h5FilePath)
+
+	#Latency of reading the sweeps of a random time window
+	rng=np.random.RandomState(1)
+	readLatencyList=[]
+	h5File=tb.openFile(h5FilePath, mode="r")
+	try:
+		table=h5File.root.session1
+		for readStart in rng.randint(0, max(1, amtSweeps-readRows), amtReads):
+			startTime=time.time()
+			table.read(start=readStart, stop=readStart+readRows, field='rssiCodes')
+			readLatencyList.append(time.time()-startTime)
+		startTime=time.time()
+		table.read(field='rssiCodes')
+		fullReadTime=time.time()-startTime
+	finally:
+		h5File.close()
+	os.remove(h5FilePath)
+
+	rawBytes=rows.nbytes
+	return {'codec':complib+":"+str(complevel),
+			'chunkRows':chunkRows,
+			'writeMBs':rawBytes/writeTime/1e6,
+			'ratio':float(rawBytes)/fileSize,
+			'fileMB':fileSize/1e6,
+			'readP50':np.percentile(readLatencyList, 50)*1000.0,
+			'readP99':np.percentile(readLatencyList, 99)*1000.0,
+			'fullReadMBs':amtSweeps*amtRssiValues/fullReadTime/1e6}
+
+if __name__=='__main__':
+	parser = argparse.ArgumentParser(description="Benchmark of the compression settings of the scan tables, \
+measures write throughput, read latency and compression ratio of each codec on representative spectra")
+	parser.add_argument("-c", "--codecs", help="Codecs to test as complib:level", nargs='+', default=DFLT_CODECS, metavar="codec")
+	parser.add_argument("-i", "--input", help="Scan file whose longest session is used instead of synthetic spectra", metavar="h5File")
+	parser.add_argument("-s", "--sweeps", help="Amount of synthetic sweeps", type=int, default=DFLT_SWEEPS, metavar="N")
+	parser.add_argument("-n", "--rssiValues", help="Amount of RSSI values of each synthetic sweep", type=int, default=DFLT_RSSI_VALUES, metavar="N")
+	parser.add_argument("-k", "--chunkBytes", help="Target chunk size in bytes, 0 to let PyTables choose it", type=int, default=64*1024, metavar="bytes")
+	parser.add_argument("-S", "--noShuffle", help="Disable the shuffle filter", action="store_true")
+	parser.add_argument("-r", "--readRows", help="Consecutive sweeps read by each latency probe", type=int, default=DFLT_READ_ROWS, metavar="N")
+	args=parser.parse_args()
+
+	if args.input:
+		rssiCodes=recorded_spectra(args.input)
+	else:
+		rssiCodes=synthetic_spectra(args.sweeps, args.rssiValues)
+	print "Spectra:", rssiCodes.shape[0], "sweeps of", rssiCodes.shape[1], "RSSI values"
+	tmpDir=tempfile.mkdtemp(prefix="scannerCodec")
+	try:
+		print "%-14s %6s %9s %7s %8s %10s %10s %11s" % ("codec", "chunk", "write MB/s", "ratio", "file MB",
+			"read p50ms", "read p99ms", "scan MB/s")
+		for codec in args.codecs:
+			complib, complevel=parse_codec(codec)
+			if complevel>0 and (tb.whichLibVersion(complib.split(":")[0])==None or
+								(complib.startswith("blosc:") and complib[len("blosc:"):] not in blosc_codecs())):
+				print "%-14s not available" % codec
+				continue
+			res=run_codec(rssiCodes, complib, complevel, not args.noShuffle, args.chunkBytes or None,
+						DFLT_BATCH_ROWS, args.readRows, DFLT_READS, tmpDir)
+			print "%-14s %6d %9.1f %7.2f %8.2f %10.3f %10.3f %11.1f" % (res['codec'], res['chunkRows'], res['writeMBs'],
+				res['ratio'], res['fileMB'], res['readP50'], res['readP99'], res['fullReadMBs'])
+	finally:
+		shutil.rmtree(tmpDir, ignore_errors=True)
@@ -0,0 +1,238 @@
+#!/usr/bin/python
+
+import collections
+import threading
+import numpy as np
+
+#Frequency grid shared by all the boards, in MHz, covering the tuning range of the boards
+DFLT_GRID_START=779.0
+DFLT_GRID_STOP=928.0
+DFLT_GRID_RES=0.2
+
+#Fused spectrum of all the boards, the arrays have one value per frequency of the grid.
+#count is the amount of boards that cover each frequency, the statistics are NaN where it's 0
+FusedSpectrum=collections.namedtuple('FusedSpectrum', 'gridFreqs rssiMax rssiAvg rssiMin count')
+
+class GridMap():
+    '''
+    Mapping of the RSSI values of a sweep to a contiguous range of the frequencies of the grid.
+    A sweep coarser than the grid is linearly interpolated at every frequency of the grid it covers.
+    A sweep finer than the grid is mapped by taking the maximum of the values that
+    fall in each frequency of the grid, so narrow carriers aren't lost
+    '''
+    
+    def __init__(self, freqStart, freqRes, amtRssiValues, gridFreqs):
+        '''
+        Constructor
+        :param freqStart: Start frequency of the sweep in MHz
+        :param freqRes: Frequency resolution of the sweep in KHz
+        :param amtRssiValues: Amount of RSSI values of each sweep
+        :param gridFreqs: Frequencies of the grid in MHz, evenly spaced
+        '''
+        freqStep=freqRes/1000.0
+        gridRes=gridFreqs[1]-gridFreqs[0]
+        freqValues=freqStart+np.arange(amtRssiValues)*freqStep
+        self.interpolate=amtRssiValues>1 and freqStep>=gridRes
+        if self.interpolate:
+            self.gridStart=int(np.searchsorted(gridFreqs, freqValues[0], side='left'))
+            self.gridStop=int(np.searchsorted(gridFreqs, freqValues[-1], side='right'))
+            position=(gridFreqs[self.gridStart:self.gridStop]-freqStart)/freqStep
+            self.leftIndex=np.minimum(np.floor(position).astype(np.intp), amtRssiValues-2)
+            self.weight=(position-self.leftIndex).astype(np.float32)
+        else:
+            #Frequency of the grid nearest to each value, the values out of the grid are left out
+            gridIndex=np.rint((freqValues-gridFreqs[0])/gridRes).astype(np.intp)
+            inGrid=np.flatnonzero((gridIndex>=0)&(gridIndex<len(gridFreqs)))
+            self.firstValue=inGrid[0] if len(inGrid)>0 else 0
+            self.stopValue=inGrid[-1]+1 if len(inGrid)>0 else 0
+            gridIndex=gridIndex[self.firstValue:self.stopValue]
+            self.gridStart=int(gridIndex[0]) if len(gridIndex)>0 else 0
+            self.gridStop=int(gridIndex[-1])+1 if len(gridIndex)>0 else 0
+            #First value of each frequency of the grid, every frequency of the range gets at least one
+            #value because the sweep is finer than the grid
+            self.reduceStarts=np.searchsorted(gridIndex, np.arange(self.gridStart, self.gridStop))
+    
+    def resample(self, rssiData):
+        '''
+        Return the values of a sweep at the frequencies of the grid in [gridStart, gridStop)
+        :param rssiData: Sweep in dBm
+        '''
+        if self.gridStop<=self.gridStart:
+            return np.empty(0, dtype=np.float32)
+        if self.interpolate:
+            leftValues=rssiData[self.leftIndex]
+            return leftValues+self.weight*(rssiData[self.leftIndex+1]-leftValues)
+        return np.maximum.reduceat(rssiData[self.firstValue:self.stopValue], self.reduceStarts)
+    
+class SpectrumFusion():
+    '''
+    Fusion of the latest sweep of every board into a single spectrum over a common frequency grid.
+    The latest sweep of each board is kept resampled in a row of a matrix. When a new sweep
+    arrives only its frequencies are updated: the average is kept as a running sum and count,
+    and the maximum and minimum remember which board holds them, so they only have to be
+    searched again over all the boards where that board's value moved away from them
+    '''
+    
+    def __init__(self, gridStart=DFLT_GRID_START, gridStop=DFLT_GRID_STOP, gridRes=DFLT_GRID_RES, maxBoards=64):
+        '''
+        Constructor
+        :param gridStart: First frequency of the grid in MHz
+        :param gridStop: Last frequency of the grid in MHz
+        :param gridRes: Spacing of the frequencies of the grid in MHz
+        :param maxBoards: Initial amount of rows of the matrix of sweeps, it grows as needed
+        '''
+        self.gridFreqs=gridStart+np.arange(int(round((gridStop-gridStart)/gridRes))+1)*gridRes
+        amtGrid=len(self.gridFreqs)
+        #Grid maps of every frequency setting seen, shared by the boards with the same setting
+        self.gridMapDict={}
+        #Latest sweep of each board resampled to the grid, NaN where it doesn't cover the grid
+        self.boardSweeps=np.empty((maxBoards, amtGrid), dtype=np.float32)
+        self.boardSweeps.fill(np.nan)
+        #Row and grid map of each board, indexed by MAC address, and rows not in use
+        self.boardDict={}
+        self.freeRows=range(maxBoards-1, -1, -1)
+        #Running statistics of each frequency of the grid
+        self.rssiSum=np.zeros(amtGrid, dtype=np.float64)
+        self.count=np.zeros(amtGrid, dtype=np.int32)
+        self.rssiMax=np.empty(amtGrid, dtype=np.float32)
+        self.rssiMax.fill(np.nan)
+        self.rssiMin=np.empty(amtGrid, dtype=np.float32)
+        self.rssiMin.fill(np.nan)
+        #Row of the board with the maximum and the minimum, -1 if no board covers the frequency
+        self.maxRow=np.empty(amtGrid, dtype=np.intp)
+        self.maxRow.fill(-1)
+        self.minRow=np.empty(amtGrid, dtype=np.intp)
+        self.minRow.fill(-1)
+        self.lock=threading.Lock()
+    
+    def get_grid_map(self, scanOpt, amtRssiValues):
+        '''
+        Return the GridMap of a sweep, created once for each frequency setting
+        :param scanOpt: UdpScanProt.Opt namedtuple with the scan options
+        :param amtRssiValues: Amount of RSSI values of each sweep
+        '''
+        mapKey=(scanOpt.freqStartMhz, scanOpt.freqStartKhz, scanOpt.freqRes, amtRssiValues)
+        gridMap=self.gridMapDict.get(mapKey)
+        if gridMap==None:
+            freqStart=scanOpt.freqStartMhz+scanOpt.freqStartKhz/1000.0
+            gridMap=GridMap(freqStart, scanOpt.freqRes, amtRssiValues, self.gridFreqs)
+            self.gridMapDict[mapKey]=gridMap
+        return gridMap
+    
+    def board_row(self, macAddr):
+        '''
+        Return the row of the matrix of sweeps of a board, assigning a free one
+        to a new board and doubling the matrix if there are none
+        '''
+        row=self.boardDict.get(macAddr, (None, None))[0]
+        if row!=None:
+            return row
+        if len(self.freeRows)==0:
+            amtRows=len(self.boardSweeps)
+            newRows=np.empty((amtRows, self.boardSweeps.shape[1]), dtype=np.float32)
+            newRows.fill(np.nan)
+            self.boardSweeps=np.vstack((self.boardSweeps, newRows))
+            self.freeRows=range(2*amtRows-1, amtRows-1, -1)
+        return self.freeRows.pop()
+    
+    def update(self, scanResults):
+        '''
+        Replace the sweep of a board in the fused spectrum, meant to be added as a scan consumer of
+        the UDP backend. The board is removed from the fused spectrum if it timed out
+        :param scanResults: ScanResults namedtuple, with rssiData set to None if the board timed out
+        '''
+        with self.lock:
+            if scanResults.rssiData is None:
+                self.remove_board(scanResults.macAddr)
+                return
+            gridMap=self.get_grid_map(scanResults.recvOpt, len(scanResults.rssiData))
+            row=self.board_row(scanResults.macAddr)
+            oldMap=self.boardDict.get(scanResults.macAddr, (None, None))[1]
+            if oldMap!=None and oldMap is not gridMap:
+                #The board changed its frequency setting, its previous range is cleared first
+                self.clear_range(row, oldMap.gridStart, oldMap.gridStop)
+            self.boardDict[scanResults.macAddr]=(row, gridMap)
+            self.set_range(row, gridMap.gridStart, gridMap.gridStop, gridMap.resample(scanResults.rssiData))
+    
+    def remove_board(self, macAddr):
+        '''
+        Remove the sweep of a board from the fused spectrum, must be called with the lock held
+        '''
+        row, gridMap=self.boardDict.pop(macAddr, (None, None))
+        if row==None:
+            return
+        self.clear_range(row, gridMap.gridStart, gridMap.gridStop)
+        self.freeRows.append(row)
+    
+    def set_range(self, row, gridStart, gridStop, newValues):
+        '''
+        Store the resampled sweep of a board and update the statistics of its frequencies
+        '''
+        gridRange=slice(gridStart, gridStop)
+        oldValues=self.boardSweeps[row, gridRange]
+        wasCovered=~np.isnan(oldValues)
+        self.rssiSum[gridRange]+=newValues-np.where(wasCovered, oldValues, 0)
+        self.count[gridRange]+=~wasCovered
+        self.boardSweeps[row, gridRange]=newValues
+        
+        #The statistics are NaN where no board covered the frequency, those are replaced by the new values
+        with np.errstate(invalid='ignore'):
+            rssiMax=self.rssiMax[gridRange]
+            maxRow=self.maxRow[gridRange]
+            #The maximum of a frequency held by this board has to be searched again if its value fell
+            staleMax=(maxRow==row)&(newValues<rssiMax)
+            newMax=(newValues>=rssiMax)|(maxRow==-1)
+            rssiMax[newMax]=newValues[newMax]
+            maxRow[newMax]=row
+            rssiMin=self.rssiMin[gridRange]
+            minRow=self.minRow[gridRange]
+            staleMin=(minRow==row)&(newValues>rssiMin)
+            newMin=(newValues<=rssiMin)|(minRow==-1)
+            rssiMin[newMin]=newValues[newMin]
+            minRow[newMin]=row
+        self.refresh_extremes(gridStart+np.flatnonzero(staleMax), gridStart+np.flatnonzero(staleMin))
+    
+    def clear_range(self, row, gridStart, gridStop):
+        '''
+        Remove the resampled sweep of a board and update the statistics of its frequencies
+        '''
+        gridRange=slice(gridStart, gridStop)
+        self.rssiSum[gridRange]-=self.boardSweeps[row, gridRange]
+        self.count[gridRange]-=1
+        self.boardSweeps[row, gridRange]=np.nan
+        staleMax=gridStart+np.flatnonzero(self.maxRow[gridRange]==row)
+        staleMin=gridStart+np.flatnonzero(self.minRow[gridRange]==row)
+        self.refresh_extremes(staleMax, staleMin)
+    
+    def refresh_extremes(self, staleMax, staleMin):
+        '''
+        Search again the maximum and the minimum of some frequencies over all the boards
+        :param staleMax: Indexes of the grid whose maximum has to be searched again
+        :param staleMin: Indexes of the grid whose minimum has to be searched again
+        '''
+        if len(staleMax)>0:
+            columns=self.boardSweeps[:, staleMax]
+            columns[np.isnan(columns)]=-np.inf
+            rows=columns.argmax(axis=0)
+            values=columns[rows, np.arange(len(staleMax))]
+            uncovered=np.isneginf(values)
+            self.rssiMax[staleMax]=np.where(uncovered, np.nan, values)
+            self.maxRow[staleMax]=np.where(uncovered, -1, rows)
+        if len(staleMin)>0:
+            columns=self.boardSweeps[:, staleMin]
+            columns[np.isnan(columns)]=np.inf
+            rows=columns.argmin(axis=0)
+            values=columns[rows, np.arange(len(staleMin))]
+            uncovered=np.isposinf(values)
+            self.rssiMin[staleMin]=np.where(uncovered, np.nan, values)
+            self.minRow[staleMin]=np.where(uncovered, -1, rows)
+    
+    def snapshot(self):
+        '''
+        Return a FusedSpectrum with a copy of the current fused spectrum
+        '''
+        with self.lock:
+            count=self.count.copy()
+            with np.errstate(invalid='ignore', divide='ignore'):
+                rssiAvg=np.where(count>0, self.rssiSum/count, np.nan).astype(np.float32)
+            return FusedSpectrum(self.gridFreqs, self.rssiMax.copy(), rssiAvg, self.rssiMin.copy(), count)
@@ -4,7 +4,6 @@ import os
 import sys
 import signal
 import subprocess
-import tables
 import wx
 import wx.lib.agw.aui as aui
 import wx.lib.agw.floatspin as FS
@@ -12,6 +11,7 @@ import wx.lib.agw.ultimatelistctrl as ULC
 import wx.lib.customtreectrl as CT
 import datetime
 from scannerUdpBackend import UdpScannerServer, UdpScannerClient, UdpScanProt
+from scannerWaterfall import WaterfallBuffer, WaterfallRing
 
 # Use wx with matplotlib with the WXAgg backend. 
 import matplotlib
@@ -22,11 +22,37 @@ from matplotlib.backends.backend_wxagg import \
     NavigationToolbar2WxAgg as NavigationToolbar
 import numpy as np
 
+def minmax_envelope(xData, yData, nPixels):
+    '''
+    Reduce a line to the min/max envelope of its values in each pixel column,
+    so drawing it costs the same no matter how long the line is.
+    Return a tuple (xData, yData) with at most 2*nPixels points
+    :param xData: Array with the x values, sorted
+    :param yData: Array with the y values
+    :param nPixels: Width in pixels of the area where the line is drawn
+    '''
+    nValues=len(yData)
+    if nValues<=2*nPixels:
+        return xData, yData
+    bucketLen=-(-nValues//nPixels)
+    nBuckets=-(-nValues//bucketLen)
+    #Pad the last bucket repeating the last value, which doesn't change its min or max
+    paddedData=np.empty(nBuckets*bucketLen, yData.dtype)
+    paddedData[:nValues]=yData
+    paddedData[nValues:]=yData[-1]
+    buckets=paddedData.reshape(nBuckets, bucketLen)
+    envelopeY=np.empty((nBuckets, 2), yData.dtype)
+    buckets.min(axis=1, out=envelopeY[:,0])
+    buckets.max(axis=1, out=envelopeY[:,1])
+    #Both points of a bucket are drawn at its first x value
+    envelopeX=np.repeat(xData[::bucketLen], 2)
+    return envelopeX, envelopeY.ravel()
+
 class ScanPlotPanel(wx.Panel):
     """
     Resizable panel to represent the scan data of a single board
     """
-    def __init__(self, parent):
+    def __init__(self, parent, useBlit=True):
         wx.Panel.__init__(self, parent, id=wx.ID_ANY)
         
         #Initialize the plot options with dummy values
@@ -40,6 +66,18 @@ class ScanPlotPanel(wx.Panel):
         self.rssiIndex=0
         #IP of the current scanner node associated with this plot
         self.ipAddr=""
+        #Key of the window statistics of the live data that are plotted,
+        #see scannerWindowStats.SpectrumWindows, None for those of the whole session
+        self.statsWindow=None
+        
+        #If useBlit is True the static parts of the figure are cached in the background
+        #and only the lines and the title are redrawn when the data changes
+        self.useBlit=useBlit
+        self.background=None
+        #Frequency axis and bounds of the cached background
+        self.freqValues=None
+        self.freqBounds=None
+        self.yBounds=None
         
         self.init_plot()
         self.draw_plot()
@@ -91,6 +129,11 @@ class ScanPlotPanel(wx.Panel):
         
         self.axes.legend(('Max', 'Avg', 'Min'), 'lower right', shadow=False, fontsize='small', frameon=True)
         
+        #The animated artists are left out of canvas.draw() and drawn over the cached background
+        self.animatedArtists=[self.plot_maxData, self.plot_avgData, self.plot_minData, self.axes.title]
+        for artist in self.animatedArtists:
+            artist.set_animated(self.useBlit)
+        
 #        self.toolbar=NavigationToolbar(self.canvas)
 #        self.toolbar.Realize()
 
@@ -99,8 +142,9 @@ class ScanPlotPanel(wx.Panel):
         Redraws the plot
         """
         
-        ymin = round(self.minData.min()) - 1
-        ymax = round(self.maxData.max()) + 1
+        #The fused spectrum is NaN where no board covers the frequency
+        ymin = round(np.nanmin(self.minData)) - 1
+        ymax = round(np.nanmax(self.maxData)) + 1
 
 #        if self.cb_yAutoRange.IsChecked():
 #            ymin = round(min(self.minData)) - 1
@@ -109,44 +153,82 @@ class ScanPlotPanel(wx.Panel):
 #            ymin = self.yRange_control.yMin
 #            ymax = self.yRange_control.yMax
 
-        self.axes.set_ybound(lower=ymin, upper=ymax)
-        
-        
 #        if self.cb_grid.IsChecked():
 #            self.axes.grid(True, color='gray')
 #        else:
 #            self.axes.grid(False)
 
-        freqValues=np.linspace(self.freqStart, self.freqStop, len(self.minData))
-        
-        self.axes.set_xbound(lower=self.freqStart, upper=self.freqStop)
-        
-        self.plot_maxData.set_xdata(freqValues)
-        self.plot_maxData.set_ydata(self.maxData)
-        
-        self.plot_avgData.set_xdata(freqValues)
-        self.plot_avgData.set_ydata(self.avgData)
-        
-        self.plot_minData.set_xdata(freqValues)
-        self.plot_minData.set_ydata(self.minData)
-        
-        self.canvas.draw()
+        #A full redraw is only needed when the axes change
+        if (ymin, ymax)!=self.yBounds:
+            self.yBounds=(ymin, ymax)
+            self.background=None
+        if self.freqValues is None or len(self.freqValues)!=len(self.minData) \
+            or (self.freqStart, self.freqStop)!=self.freqBounds:
+            self.freqValues=np.linspace(self.freqStart, self.freqStop, len(self.minData))
+            self.freqBounds=(self.freqStart, self.freqStop)
+            self.background=None
+        
+        #Reduce the lines to the resolution of the screen
+        nPixels=max(1, int(self.axes.bbox.width))
+        self.plot_maxData.set_data(*minmax_envelope(self.freqValues, self.maxData, nPixels))
+        self.plot_avgData.set_data(*minmax_envelope(self.freqValues, self.avgData, nPixels))
+        self.plot_minData.set_data(*minmax_envelope(self.freqValues, self.minData, nPixels))
+        
+        if not self.useBlit or self.background==None:
+            self.axes.set_ybound(lower=ymin, upper=ymax)
+            self.axes.set_xbound(lower=self.freqStart, upper=self.freqStop)
+            self.canvas.draw()
+            if not self.useBlit:
+                return
+            self.background=self.canvas.copy_from_bbox(self.fig.bbox)
+        else:
+            self.canvas.restore_region(self.background)
+        for artist in self.animatedArtists:
+            self.fig.draw_artist(artist)
+        self.canvas.blit(self.fig.bbox)
+        
+    def update_plot(self, liveData):
+        '''
+        Update the plot with the latest state of a board
+        :param liveData: LiveScanData namedtuple published by the backend,
+        see the scannerLiveData code for details on the fields
+        '''
+        scanOpt=liveData.recvOpt
+        windowStats=None
+        if self.statsWindow!=None and liveData.windowStats!=None:
+            windowStats=liveData.windowStats.get(self.statsWindow)
+        if windowStats!=None:
+            #The exponential average has no min or max, it's drawn alone
+            self.avgData=windowStats.rssiAvg
+            self.maxData=windowStats.rssiMax if windowStats.rssiMax is not None else windowStats.rssiAvg
+            self.minData=windowStats.rssiMin if windowStats.rssiMin is not None else windowStats.rssiAvg
+        else:
+            self.maxData=liveData.rssiMax
+            self.avgData=liveData.rssiAvg
+            self.minData=liveData.rssiMin
+        self.freqStart=scanOpt.freqStartMhz+scanOpt.freqStartKhz/1000.0
+        self.freqStop=scanOpt.freqStopMhz+scanOpt.freqStopKhz/1000.0
+        self.freqRes=scanOpt.freqRes
+        self.axes.set_title("Scan results from the detector with the MAC "+liveData.macAddr+" as of "+
+                    datetime.datetime.fromtimestamp(liveData.timestamp).strftime('%c'), size='medium')
+        self.redrawNeeded=True
         
-    def update_plot(self, h5table):
-        '''
-        Update the plot with the information contained in
-        the h5table passed as a parameter
-        :param h5table: HDF5 data table identifier, see the H5Backend code
-        for details on the table fields
-        '''
-        self.maxData=h5table.cols.rssiMax[len(h5table)-1]
-        self.avgData=h5table.cols.rssiAvg[len(h5table)-1]
-        self.minData=h5table.cols.rssiMin[len(h5table)-1]
-        self.freqStart=h5table.cols.freqStart[0]
-        self.freqStop=h5table.cols.freqStop[0]
-        self.freqRes=h5table.cols.freqRes[0]
-        self.axes.set_title("Scan results from the detector with the MAC "+h5table.cols.macAddr[0]+" as of "+
-                    datetime.datetime.fromtimestamp(h5table.cols.timestamp[len(h5table)-1]).strftime('%c'), size='medium')
+    def update_fused(self, fusedSpectrum):
+        '''
+        Update the plot with the fused spectrum of all the boards,
+        the frequencies that no board covers are left blank
+        :param fusedSpectrum: FusedSpectrum namedtuple, see the scannerFusion code for details on the fields
+        '''
+        if fusedSpectrum.count.max()==0:
+            #No board reported yet, the plot is kept as it is
+            return
+        self.maxData=fusedSpectrum.rssiMax
+        self.avgData=fusedSpectrum.rssiAvg
+        self.minData=fusedSpectrum.rssiMin
+        self.freqStart=fusedSpectrum.gridFreqs[0]
+        self.freqStop=fusedSpectrum.gridFreqs[-1]
+        self.axes.set_title("Fused spectrum of "+str(int(fusedSpectrum.count.max()))+" boards as of "+
+                    datetime.datetime.now().strftime('%c'), size='medium')
         self.redrawNeeded=True
         
     def on_redraw_timer(self, evt):
@@ -172,6 +254,10 @@ class ScanPlotPanel(wx.Panel):
         '''
         pixels = tuple(size)
         #print "Resizing image to ", pixels
+        #The cached background doesn't match the new size and
+        #the canvas redraws itself without the animated artists
+        self.background=None
+        self.redrawNeeded=True
         self.SetSize(pixels)
         self.canvas.SetSize(pixels)
         self.fig.set_size_inches(float(pixels[0])/self.fig.get_dpi(),
@@ -182,8 +268,120 @@ class ScanPlotPanel(wx.Panel):
         Call the print_figure method of the FigureCanvas to store the image in a PNG file
         :param path: Full path of the file where the plot will be saved
         '''
+        #Animated artists are not drawn when printing the figure
+        for artist in self.animatedArtists:
+            artist.set_animated(False)
         self.canvas.print_figure(path, dpi=self.fig.get_dpi())
+        for artist in self.animatedArtists:
+            artist.set_animated(self.useBlit)
+        self.background=None
             
+class WaterfallPanel(wx.Panel):
+    """
+    Resizable panel with the waterfall of the latest sweeps of a single board,
+    the newest sweep at the top. The image is a view of a WaterfallRing, so every
+    redraw copies only the sweeps received since the previous one and blits the image
+    """
+    def __init__(self, parent, waterfallBuffer, rssiRange=(-110, -40)):
+        wx.Panel.__init__(self, parent, id=wx.ID_ANY)
+        
+        #Buffer fed by the backend with the sweeps of every board
+        self.waterfallBuffer=waterfallBuffer
+        #Board shown, scan options and sequence number of its last sweep read
+        self.macAddr=None
+        self.scanOpt=None
+        self.lastSeq=0
+        #Sweeps shown, written by this panel only
+        self.ring=WaterfallRing(waterfallBuffer.maxRows, 1)
+        self.background=None
+        
+        self.init_plot(rssiRange)
+        self.Bind(wx.EVT_SIZE, self.on_resize)
+        self.redrawTimer=wx.Timer(self)
+        self.Bind(wx.EVT_TIMER, self.on_redraw_timer, self.redrawTimer)
+        self.redrawTimer.Start(200)
+        
+    def init_plot(self, rssiRange):
+        self.fig = Figure(None, None)
+        self.fig.subplots_adjust(left=0.075, bottom=0.15, right=0.925)
+        self.canvas = FigureCanvas(self, -1, self.fig)
+        
+        rgbtuple=wx.NamedColour("white")
+        clr = [c/255. for c in rgbtuple]
+        self.fig.set_facecolor(clr)
+        self.fig.set_edgecolor(clr)
+        self.canvas.SetBackgroundColour(wx.Colour(*rgbtuple))
+        
+        self.axes = self.fig.add_subplot(111)
+        self.axes.tick_params(axis='both', labelsize='small')
+        self.axes.set_ylabel("Sweeps ago", size='medium', labelpad=10)
+        self.axes.set_xlabel("Frequency(MHz)", size='medium', labelpad=10)
+        #The oldest sweep is the first row of the view, drawn at the bottom
+        self.image=self.axes.imshow(self.ring.view(), aspect='auto', origin='lower', interpolation='nearest',
+                                    vmin=rssiRange[0], vmax=rssiRange[1], extent=(779, 928, -self.ring.maxRows, 0))
+        self.fig.colorbar(self.image, ax=self.axes, pad=0.01).set_label("RSSI(dBm)", size='small')
+        self.image.set_animated(True)
+        
+    def set_board(self, macAddr):
+        '''
+        Change the board shown, its waterfall is read again from the start
+        :param macAddr: MAC address of the board
+        '''
+        if macAddr!=self.macAddr:
+            self.macAddr=macAddr
+            self.scanOpt=None
+            self.lastSeq=0
+        
+    def draw_plot(self):
+        '''
+        Add the sweeps received since the last redraw and draw the image
+        '''
+        newData=self.waterfallBuffer.read_new(self.macAddr, self.lastSeq, self.scanOpt)
+        if newData==None:
+            return
+        scanOpt, newRows, self.lastSeq=newData
+        if len(newRows)==0 and self.background!=None:
+            return
+        if scanOpt!=self.scanOpt or self.ring.rows.shape[1]!=newRows.shape[1]:
+            #New board or scan options, the image starts again with the new frequency axis
+            self.scanOpt=scanOpt
+            self.ring=WaterfallRing(self.waterfallBuffer.maxRows, newRows.shape[1])
+            self.image.set_extent((scanOpt.freqStartMhz+scanOpt.freqStartKhz/1000.0,
+                                   scanOpt.freqStopMhz+scanOpt.freqStopKhz/1000.0, -self.ring.maxRows, 0))
+            self.axes.set_title("Waterfall of the detector with the MAC "+self.macAddr, size='medium')
+            self.background=None
+        for rssiData in newRows:
+            self.ring.append(rssiData)
+        self.image.set_data(self.ring.view())
+        
+        if self.background==None:
+            self.canvas.draw()
+            self.background=self.canvas.copy_from_bbox(self.axes.bbox)
+        else:
+            self.canvas.restore_region(self.background)
+        self.axes.draw_artist(self.image)
+        self.canvas.blit(self.axes.bbox)
+        
+    def on_redraw_timer(self, evt):
+        '''
+        Function triggered by the redraw timer
+        :param evt: wx.EVT_TIMER
+        '''
+        if self.macAddr!=None:
+            self.draw_plot()
+            
+    def on_resize(self, evt):
+        '''
+        Function triggered by a resizing event
+        :param evt: wx.EVT_SIZE
+        '''
+        pixels = tuple(evt.GetSize())
+        self.background=None
+        self.SetSize(pixels)
+        self.canvas.SetSize(pixels)
+        self.fig.set_size_inches(float(pixels[0])/self.fig.get_dpi(),
+                                 float(pixels[1])/self.fig.get_dpi())
+        
 class ScannerGUI(wx.Frame):
     def __init__(self, parent):
         wx.Frame.__init__(self,
@@ -200,6 +398,9 @@ class ScannerGUI(wx.Frame):
         self.create_boardList()
         self.create_settingsTree()
         self.scanPlot = ScanPlotPanel(self)
+        #Waterfall fed with every sweep by the backend, not only with the live updates
+        self.waterfallBuffer=WaterfallBuffer()
+        self.waterfallPlot=WaterfallPanel(self, self.waterfallBuffer)
         
         self.mgr=aui.AuiManager(self)
         
@@ -209,6 +410,8 @@ class ScannerGUI(wx.Frame):
                          MinimizeButton(True).MaximizeButton(True).CloseButton(False))
         self.mgr.AddPane(self.scanPlot, aui.AuiPaneInfo().Center().Caption("Scan plot").
                          MinimizeButton(True).MaximizeButton(True).CloseButton(False))
+        self.mgr.AddPane(self.waterfallPlot, aui.AuiPaneInfo().Bottom().Caption("Waterfall").BestSize((-1, 300)).
+                         MinimizeButton(True).MaximizeButton(True).CloseButton(False))
         self.mgr.AddPane(self.toolbar, aui.AuiPaneInfo().Top().ToolbarPane())
         self.Maximize()
         
@@ -218,7 +421,7 @@ class ScannerGUI(wx.Frame):
         
         #IP of the board currently displayed on the FigureCanvas
         self.macPlottedBoard=None
-        #Flag to force a replot even if there's no new data in the HDF5 file
+        #Flag to force a replot even if there's no new data from the backend
         self.replotRequested=False
         #Timestamp of the last data plotted in the FigureCanvas
         self.plottedDataTimestamp=None
@@ -227,8 +430,16 @@ class ScannerGUI(wx.Frame):
         signal.signal(signal.SIGINT, self.on_sigint)
         #Start the UDP backend
         self.udpScanServer=UdpScannerServer(guiActive=True)
-        #Get the HDF5 file lock identifier
-        self.h5FileLock=self.udpScanServer.h5FileLock
+        self.udpScanServer.add_scan_consumer(self.waterfallBuffer.update)
+        #Get the channel where the backend publishes the latest data of each board
+        self.liveChannel=self.udpScanServer.liveChannel
+        #Get the engine that publishes the channels that become free or occupied
+        self.occupancyEngine=self.udpScanServer.occupancyEngine
+        #Get the fused spectrum of all the boards, plotted instead of the selected board if enabled
+        self.spectrumFusion=self.udpScanServer.spectrumFusion
+        self.plotFused=False
+        #Only the window statistics enabled in the backend are listed, labelled with their length
+        self.set_statsWindow_choices(self.udpScanServer.windowOptions)
         
         #Bool that controls whether or not the user changed the scan settings
         self.scanOptChanged=False
@@ -243,10 +454,10 @@ class ScannerGUI(wx.Frame):
         self.sendScanOptTimer.Start(1000)
         
         
-        #Create the timer for checking the HDF5 scan data
-        self.h5Timer=wx.Timer(self)
-        self.Bind(wx.EVT_TIMER, self.on_pollh5_timer, self.h5Timer)
-        self.h5Timer.Start(250)
+        #Create the timer for reading the live data of the boards
+        self.liveTimer=wx.Timer(self)
+        self.Bind(wx.EVT_TIMER, self.on_live_timer, self.liveTimer)
+        self.liveTimer.Start(250)
         
     def create_menu(self):
         self.menubar=wx.MenuBar()
@@ -262,6 +473,11 @@ class ScannerGUI(wx.Frame):
         self.Bind(wx.EVT_MENU, self.on_save, saveItem)
         
         self.menubar.Append(filemenu,"&File")
+        
+        viewmenu=wx.Menu()
+        self.fusedItem=viewmenu.AppendCheckItem(wx.ID_ANY, 'Fused spectrum', 'Plot the spectrum of all the boards together')
+        self.Bind(wx.EVT_MENU, self.on_fused_view, self.fusedItem)
+        self.menubar.Append(viewmenu,"&View")
         self.SetMenuBar(self.menubar)
         
     def create_toolbar(self):
@@ -364,6 +580,32 @@ class ScannerGUI(wx.Frame):
         
         #Create the plot options branch of the TreeCtrl
         #TODO: Add graphic options here!!!!
+        #The choices are filled once the backend is started, see set_statsWindow_choices
+        self.statsWindowBox = wx.ComboBox(self.settingsTree, -1, choices=[], style=wx.CB_READONLY, size=(110,-1))
+        statsWindowItem = self.settingsTree.AppendItem(plotOptItem, "Statistics", wnd=self.statsWindowBox)
+        self.Bind(wx.EVT_COMBOBOX, self.on_statsWindow_change, self.statsWindowBox)
+        
+    def set_statsWindow_choices(self, windowOptions):
+        '''
+        Fill the choices of the statistics shown in the plot with the windows provided by the backend
+        :param windowOptions: Dictionary with the windowSweeps, windowTime and ewmaHalfLife of the backend,
+        see SpectrumWindows, the ones set to None are disabled
+        '''
+        choiceList=[('Session', None)]
+        windowSweeps=windowOptions.get('windowSweeps')
+        if windowSweeps:
+            choiceList.append(("Last %d sweeps" % windowSweeps, 'sweeps'))
+        windowTime=windowOptions.get('windowTime')
+        if windowTime:
+            if windowTime>=60 and windowTime%60==0:
+                choiceList.append(("Last %d min" % (windowTime//60), 'time'))
+            else:
+                choiceList.append(("Last %g s" % windowTime, 'time'))
+        if windowOptions.get('ewmaHalfLife'):
+            choiceList.append(('Exponential', 'ewma'))
+        self.statsWindowDict=dict(choiceList)
+        self.statsWindowBox.SetItems([label for label, windowName in choiceList])
+        self.statsWindowBox.SetValue('Session')
         
     def on_sendScanOpt_timer(self, event):
         '''
@@ -408,91 +650,94 @@ class ScannerGUI(wx.Frame):
                 #Start a thread to send the options
                 UdpScannerClient(self.udpScanServer.sock, boardIpList, self.sendScanOpt)
         
-    def on_pollh5_timer(self, event):
+    def on_live_timer(self, event):
         '''
-        Function triggered whenever the H5 poll timer expires that checks
-        the HDF5 scan data file if it's been modified since the last access
+        Function triggered whenever the live data timer expires that reads
+        the boards updated by the backend since the last call
         :param event: wx.Timer event
         '''
-        with self.h5FileLock:
-            #Check if the file exists before attempting to read it
-            if not os.path.isfile("data/newScanData.h5"):
-                return
+        for liveData in self.liveChannel.poll():
+            self.process_live_data(liveData)
+        self.process_channel_changes(self.occupancyEngine.poll())
+        if self.plotFused:
+            #The fused spectrum replaces any update of the selected board
+            self.scanPlot.update_fused(self.spectrumFusion.snapshot())
+            return
+        if self.replotRequested:
+            self.replotRequested=False
+            liveData=self.liveChannel.get(self.macPlottedBoard)
+            if liveData!=None:
+                self.plottedDataTimestamp=liveData.timestamp
+                self.scanPlot.update_plot(liveData)
             
-            if not hasattr(self, 'h5LastModified') \
-            or self.h5LastAccessed<os.stat("data/newScanData.h5").st_mtime \
-            or self.replotRequested:
-                if self.replotRequested:
-                    self.replotRequested=False
-                self.h5FileLastAccessed=os.stat("data/newScanData.h5").st_mtime
-                self.process_h5_data()
-            
-    def process_h5_data(self):
-        '''
-        Checks the HDF5 scan data file and updates the GUI accordingly.
-        '''
-        h5File=tables.openFile("data/newScanData.h5", mode="r+", title="Scan data file")
-        #Iterate through the node list and update the boardList pane
-        for node in h5File.root.scannerNodes:
-            #Make sure that the node has data
-            if len(node)<=0:
-                continue
-            #Update the node if it's already in the list
-            #and otherwise create it(FindItem returns -1 in case of failure)
-            boardIndex=self.boardList.FindItem(start=-1, str=node.cols.macAddr[0], partial=False)
-            if boardIndex==-1:
-                macIndex=self.boardList.InsertStringItem(sys.maxint, label=node.cols.macAddr[0])
-                statIndex=self.boardList.SetStringItem(macIndex, col=1, label=node.cols.ipAddr[0])
-                if node.cols.isAlive[0]:
-                    statIndex=self.boardList.SetStringItem(macIndex, col=2, label="Active")
-                    self.boardList.SetItemTextColour(statIndex, wx.NamedColour("forest green"))
-                else:
-                    statIndex=self.boardList.SetStringItem(macIndex, col=2, label="Inactive")
-                    self.boardList.SetItemTextColour(statIndex, wx.NamedColour("indian red"))
-                self.boardList.SetStringItem(macIndex, col=3, label=datetime.datetime.fromtimestamp(node.cols.timestamp[0]).strftime('%c'))
-                self.flash_status_message("Detected a new board with the MAC "+node.cols.macAddr[0])
+    def process_live_data(self, liveData):
+        '''
+        Updates the GUI with the latest state of a board
+        :param liveData: LiveScanData namedtuple published by the backend
+        '''
+        #Update the node if it's already in the list
+        #and otherwise create it(FindItem returns -1 in case of failure)
+        joinDate=datetime.datetime.fromtimestamp(liveData.joinTime).strftime('%c')
+        boardIndex=self.boardList.FindItem(start=-1, str=liveData.macAddr, partial=False)
+        if boardIndex==-1:
+            macIndex=self.boardList.InsertStringItem(sys.maxint, label=liveData.macAddr)
+            statIndex=self.boardList.SetStringItem(macIndex, col=1, label=liveData.ipAddr)
+            if liveData.isAlive:
+                statIndex=self.boardList.SetStringItem(macIndex, col=2, label="Active")
+                self.boardList.SetItemTextColour(statIndex, wx.NamedColour("forest green"))
             else:
-                statItem=self.boardList.GetItem(boardIndex, col=2)
-                joinItem=self.boardList.GetItem(boardIndex, col=3)
-                if node.cols.isAlive[0] and statItem.GetText()!="Active":
-                    statItem.SetText("Active")
-                    self.boardList.SetItem(statItem)
-                    self.boardList.SetItemTextColour(boardIndex, wx.NamedColour("forest green"))
-                    joinItem.SetText(datetime.datetime.fromtimestamp(node.cols.timestamp[0]).strftime('%c'))
-                    self.boardList.SetItem(joinItem)
-                    self.flash_status_message("The board with the MAC "+node.cols.macAddr[0]+" became active")
-                elif not node.cols.isAlive[0] and statItem.GetText()!="Inactive":
-                    statItem.SetText("Inactive")
-                    self.boardList.SetItem(statItem)
-                    self.boardList.SetItemTextColour(boardIndex, wx.NamedColour("indian red"))
-                    self.flash_status_message("The board with the MAC "+node.cols.macAddr[0]+" became inactive")
-                    
-            #Get the scan options of the node with the most recent timestamp
-            if node.cols.isAlive[0] and node.cols.timestamp[len(node)-1]>self.recvScanOptTimestamp:
-                self.recvScanOpt=UdpScanProt.Opt(freqStartMhz=int(node.cols.freqStart[0]), \
-                                                 freqStartKhz=int((node.cols.freqStart[0]-int(node.cols.freqStart[0]))*1000), \
-                                                 freqStopMhz=int(node.cols.freqStop[0]), \
-                                                 freqStopKhz=int((node.cols.freqStop[0]-int(node.cols.freqStop[0]))*1000), \
-                                                 freqRes=int(node.cols.freqRes[0]), \
-                                                 modFormat=int(node.cols.modFormat[0]), \
-                                                 agcEnabled=1 if node.cols.agcEnabled[0] else 0, \
-                                                 lnaGain=int(node.cols.lnaGain[0]), \
-                                                 lna2Gain=int(node.cols.lna2Gain[0]), \
-                                                 dvgaGain=int(node.cols.dvgaGain[0]), \
-                                                 rssiWait=int(node.cols.rssiWait[0]))
-                    
-            #If there is new data, update the board selected in the list,
-            #if there is none we pick the first board of the HDF5 file
-            if self.macPlottedBoard==None:
-                self.macPlottedBoard=node.cols.macAddr[0]
-                self.plottedDataTimestamp=node.cols.timestamp[len(node)-1]
-                self.scanPlot.update_plot(node)
-            elif self.macPlottedBoard==node.cols.macAddr[0] and self.plottedDataTimestamp<node.cols.timestamp[len(node)-1]:
-                self.plottedDataTimestamp=node.cols.timestamp[len(node)-1]
-                self.scanPlot.update_plot(node)
-        
-        #Close the HDF5 file after reading
-        h5File.close()
+                statIndex=self.boardList.SetStringItem(macIndex, col=2, label="Inactive")
+                self.boardList.SetItemTextColour(statIndex, wx.NamedColour("indian red"))
+            self.boardList.SetStringItem(macIndex, col=3, label=joinDate)
+            self.flash_status_message("Detected a new board with the MAC "+liveData.macAddr)
+        else:
+            statItem=self.boardList.GetItem(boardIndex, col=2)
+            joinItem=self.boardList.GetItem(boardIndex, col=3)
+            if liveData.isAlive and statItem.GetText()!="Active":
+                statItem.SetText("Active")
+                self.boardList.SetItem(statItem)
+                self.boardList.SetItemTextColour(boardIndex, wx.NamedColour("forest green"))
+                joinItem.SetText(joinDate)
+                self.boardList.SetItem(joinItem)
+                self.flash_status_message("The board with the MAC "+liveData.macAddr+" became active")
+            elif not liveData.isAlive and statItem.GetText()!="Inactive":
+                statItem.SetText("Inactive")
+                self.boardList.SetItem(statItem)
+                self.boardList.SetItemTextColour(boardIndex, wx.NamedColour("indian red"))
+                self.flash_status_message("The board with the MAC "+liveData.macAddr+" became inactive")
+                
+        #Get the scan options of the node with the most recent timestamp
+        if liveData.isAlive and liveData.timestamp>self.recvScanOptTimestamp:
+            self.recvScanOptTimestamp=liveData.timestamp
+            self.recvScanOpt=liveData.recvOpt
+                
+        #If there is new data, update the board selected in the list,
+        #if there is none we pick the first board that reports data.
+        #The fused spectrum replaces the plot of the board, which is redrawn when it's disabled
+        if self.macPlottedBoard==None:
+            self.macPlottedBoard=liveData.macAddr
+            self.plottedDataTimestamp=liveData.timestamp
+            if not self.plotFused:
+                self.scanPlot.update_plot(liveData)
+            self.waterfallPlot.set_board(self.macPlottedBoard)
+        elif self.macPlottedBoard==liveData.macAddr and self.plottedDataTimestamp<liveData.timestamp:
+            self.plottedDataTimestamp=liveData.timestamp
+            if not self.plotFused:
+                self.scanPlot.update_plot(liveData)
+        
+    def process_channel_changes(self, changeList):
+        '''
+        Report in the status bar the channels seen by the plotted board that became free or occupied
+        :param changeList: List of ChannelChange namedtuples published by the occupancy engine
+        '''
+        msgList=[]
+        for change in changeList:
+            if change.macAddr!=self.macPlottedBoard or change.isFree==None:
+                continue
+            msgList.append("%s %.3f-%.3f MHz %s" % (change.bandName, change.lowFreq, change.highFreq,
+                                                    "free" if change.isFree else "occupied"))
+        if len(msgList)>0:
+            self.flash_status_message(", ".join(msgList), 3000)
         
     def flash_status_message(self, msg, flash_len_ms=1500):
         self.statusbar.SetStatusText(msg)
@@ -515,6 +760,7 @@ class ScannerGUI(wx.Frame):
         self.macPlottedBoard=event.GetText()
         self.plottedDataTimestamp=0
         self.replotRequested=True
+        self.waterfallPlot.set_board(self.macPlottedBoard)
         
     def on_settings_check(self, event):
         '''
@@ -563,6 +809,23 @@ class ScannerGUI(wx.Frame):
         '''
         self.scanOptChanged=True
     
+    def on_fused_view(self, event):
+        '''
+        Function triggered when the user enables or disables the plot of the fused spectrum
+        :param event: wx.EVT_MENU
+        '''
+        self.plotFused=self.fusedItem.IsChecked()
+        self.replotRequested=True
+    
+    def on_statsWindow_change(self, event):
+        '''
+        Function triggered when the user changes the statistics shown in the plot,
+        which are redrawn with the latest data of the plotted board
+        :param event: wx.EVT_COMBOBOX
+        '''
+        self.scanPlot.statsWindow=self.statsWindowDict[self.statsWindowBox.GetValue()]
+        self.replotRequested=True
+    
     def on_timing_change(self, event):
         '''
         Function triggered when the user changes the timing settings,
@@ -574,10 +837,15 @@ class ScannerGUI(wx.Frame):
         
     def on_h5_view(self, event):
         '''
-        Open the graphical HDF5 view tool to explore the data
+        Open the graphical HDF5 view tool to explore the segment being written
         :param event: Event that triggered this function
         '''
-        subprocess.Popen(["vitables", "data/newScanData.h5"])
+        #The writer process reports its segment with its first statistics
+        h5FilePath=self.udpScanServer.h5Thread.h5FilePath
+        if h5FilePath==None:
+            self.flash_status_message("The HDF5 file isn't open yet, try again in a moment")
+            return
+        subprocess.Popen(["vitables", h5FilePath])
         self.flash_status_message("Opening the HDF5 file explorer...")
         
     def on_save(self, event):
@@ -623,7 +891,7 @@ class ScannerGUI(wx.Frame):
         self.exit_program()
         
     def exit_program(self):
-        self.h5Timer.Stop()
+        self.liveTimer.Stop()
         self.sendScanOptTimer.Stop()
         self.udpScanServer.close_backend()
         self.Destroy()
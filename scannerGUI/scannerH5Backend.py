@@ -1,160 +1,934 @@
 #!/usr/bin/python
 
 import datetime
+import math
 import os
+import Queue
 import tables as tb
 import numpy as np
 import threading
 import time
+from scannerLiveData import LiveScanData
+from scannerStats import monotonic
+from scannerSegments import SegmentManifest, scan_segment_contents, index_segment, fsync_path
+from scannerWindowStats import SpectrumWindows, DFLT_WINDOW_SWEEPS, DFLT_WINDOW_TIME, DFLT_EWMA_HALF_LIFE
+
+#The sweeps are stored as the raw RSSI bytes sent by the boards, the CC1101 register
+#read as a signed byte. Its value in dBm is int8(code)*RSSI_SCALE+RSSI_OFFSET,
+#the same conversion as UdpScanProt.rssiDbmLut with an offset of 74 dB
+RSSI_SCALE=0.5
+RSSI_OFFSET=-73.5
+
+def rssi_codes_to_dbm(rssiCodes, table=None):
+    '''
+    Convert raw RSSI codes read from a session table to float32 dBm
+    :param rssiCodes: uint8 array with the codes of one or several sweeps
+    :param table: Session table the codes come from, its rssiScale and rssiOffset
+    attributes are used if present. None to use the default conversion
+    '''
+    scale, offset=RSSI_SCALE, RSSI_OFFSET
+    if table!=None and 'rssiScale' in table.attrs:
+        scale, offset=table.attrs.rssiScale, table.attrs.rssiOffset
+    rssiDbm=np.asarray(rssiCodes, np.uint8).view(np.int8).astype(np.float32)
+    rssiDbm*=scale
+    rssiDbm+=offset
+    return rssiDbm
+
+def blosc_codecs():
+    '''
+    Return the names of the codecs built in the blosc library, which can be used as blosc:<codec>.
+    PyTables 2 can't list them, it only has blosclz
+    '''
+    if hasattr(tb, 'blosc_compressor_list'):
+        return tb.blosc_compressor_list()
+    return ['blosclz']
+
+def first_row_after(table, startTime):
+    '''
+    Return the number of the first row of a table with a timestamp not before startTime.
+    The rows are appended in time order, so the whole timestamp column is searched
+    :param table: HDF5 table with a timestamp column
+    :param startTime: Start time, None for the first row
+    '''
+    if startTime==None or table.nrows==0:
+        return 0
+    return int(np.searchsorted(table.col('timestamp').reshape(-1), startTime, side='left'))
+
+class NodeEntry():
+    '''
+    Entry of the in-memory index of the scanner nodes stored in the HDF5 file.
+    Each node is a group with one table per scan session, the entry holds the
+    current session and the rows of the node waiting to be appended to its table
+    '''
+    
+    def __init__(self, group, isAlive=True, maxPendingRows=64):
+        '''
+        Constructor
+        :param group: HDF5 group of the node
+        :param isAlive: False if the board timed out, also stored in the isAlive attribute of the group
+        :param maxPendingRows: Size of the buffer of pending rows
+        '''
+        self.group=group
+        self.nodeName=group._v_name
+        self.isAlive=isAlive
+        self.maxPendingRows=maxPendingRows
+        #Table, running statistics and scan options of the current session,
+        #see H5ScannerThread.opt_columns for the format of the options
+        self.table=None
+        self.summaryTable=None
+        self.sessionStart=None
+        self.accumulator=None
+        self.optColumns=None
+        #History tables of the current session, from the finest to the coarsest level,
+        #and the HistoryPyramid that fills them, None if the session has no history
+        self.historyTables=[]
+        self.pyramid=None
+        #SpectrumWindows with the statistics of the recent sweeps of the board for the live data,
+        #kept only in memory, None if there is no live channel
+        self.windows=None
+        #Structured array with the rows not yet appended to the table
+        self.pendingRows=None
+        self.pendingCount=0
+        #Amount of sweeps and time of the last row of the summary table
+        self.summaryCount=0
+        self.summaryTime=0
+    
+    def start_session(self, table, summaryTable, accumulator, optColumns, historyTables=(), pyramid=None):
+        '''
+        Make a session table the one where the new rows are appended,
+        there must be no pending rows of the previous session
+        :param table: HDF5 table of the session
+        :param summaryTable: HDF5 table with the running statistics of the session
+        :param accumulator: RssiAccumulator with the running statistics of the session
+        :param optColumns: Scan options of the session as stored in its columns
+        :param historyTables: HDF5 history tables of the session, from the finest to the coarsest level
+        :param pyramid: HistoryPyramid of the session, None if the session has no history
+        '''
+        self.table=table
+        self.summaryTable=summaryTable
+        self.historyTables=list(historyTables)
+        self.pyramid=pyramid
+        self.summaryCount=accumulator.count
+        self.summaryTime=time.time()
+        self.sessionStart=table.attrs.startTime
+        self.accumulator=accumulator
+        self.optColumns=optColumns
+        self.pendingRows=np.empty(self.maxPendingRows, dtype=table.dtype)
+        self.pendingCount=0
+        self.group._v_attrs.currentSession=table._v_name
+    
+    def set_status(self, isAlive, lastSeen=None):
+        '''
+        Store the liveness of the board in the attributes of its group,
+        which takes constant time regardless of the amount of rows
+        :param isAlive: False if the board timed out
+        :param lastSeen: Timestamp of the last sweep stored, None to keep the current one
+        '''
+        self.isAlive=isAlive
+        self.group._v_attrs.isAlive=isAlive
+        if lastSeen!=None:
+            self.group._v_attrs.lastSeen=lastSeen
+    
+class RssiAccumulator():
+    '''
+    Running min, average and max of the RSSI sweeps of a node, kept in memory
+    as float32 arrays that are updated in place with every new sweep
+    '''
+    
+    def __init__(self, amtRssiValues):
+        '''
+        Constructor
+        :param amtRssiValues: Amount of RSSI values of each sweep
+        '''
+        self.rssiMin=np.empty(amtRssiValues, np.float32)
+        self.rssiAvg=np.empty(amtRssiValues, np.float32)
+        self.rssiMax=np.empty(amtRssiValues, np.float32)
+        #Scratch array for the incremental mean
+        self.rssiDelta=np.empty(amtRssiValues, np.float32)
+        #Amount of sweeps accumulated
+        self.count=0
+    
+    @classmethod
+    def from_tables(cls, table, summaryTable):
+        '''
+        Restore the accumulator from the last row of the summary table of a session,
+        replaying the sweeps stored in the session table after it
+        :param table: HDF5 session table, see the H5ScannerThread code for details on the fields
+        :param summaryTable: HDF5 summary table of the session
+        '''
+        accumulator=cls(table.coldescrs['rssiCodes'].shape[0])
+        #Sweeps of the session stored in previous segment files
+        firstCount=table.attrs.firstCount if 'firstCount' in table.attrs else 0
+        if summaryTable.nrows>0:
+            lastRow=summaryTable[summaryTable.nrows-1]
+            accumulator.rssiMin[:]=lastRow['rssiMin']
+            accumulator.rssiAvg[:]=lastRow['rssiAvg']
+            accumulator.rssiMax[:]=lastRow['rssiMax']
+            accumulator.count=int(lastRow['count'])
+        replayStart=max(0, accumulator.count-firstCount)
+        if replayStart<table.nrows:
+            for rssiDbm in rssi_codes_to_dbm(table.read(start=replayStart, field='rssiCodes'), table):
+                accumulator.update(rssiDbm)
+        return accumulator
+    
+    def update(self, rssiData):
+        '''
+        Add a new sweep to the running statistics
+        :param rssiData: Array with the RSSI values of the sweep in dBm
+        '''
+        self.count+=1
+        if self.count==1:
+            self.rssiMin[:]=rssiData
+            self.rssiAvg[:]=rssiData
+            self.rssiMax[:]=rssiData
+        else:
+            np.minimum(self.rssiMin, rssiData, out=self.rssiMin)
+            np.maximum(self.rssiMax, rssiData, out=self.rssiMax)
+            #avg+=(rssiData-avg)/count
+            np.subtract(rssiData, self.rssiAvg, out=self.rssiDelta)
+            self.rssiDelta/=self.count
+            self.rssiAvg+=self.rssiDelta
+    
+class HistoryLevel():
+    '''
+    Bucket being filled of a level of the history pyramid, the mean is kept as a sum
+    so the buckets of the level below can be merged into it with their count
+    '''
+    
+    def __init__(self, bucketTime, amtRssiValues):
+        '''
+        Constructor
+        :param bucketTime: Length of the buckets of the level in seconds
+        :param amtRssiValues: Amount of RSSI values of each sweep
+        '''
+        self.bucketTime=bucketTime
+        self.bucketStart=None
+        self.count=0
+        self.rssiMin=np.empty(amtRssiValues, np.float32)
+        self.rssiSum=np.empty(amtRssiValues, np.float64)
+        self.rssiMax=np.empty(amtRssiValues, np.float32)
+    
+    def add(self, count, rssiMin, rssiSum, rssiMax):
+        '''
+        Add a sweep or a bucket of the level below to the bucket
+        :param count: Amount of sweeps added
+        :param rssiMin: Minimum in dBm of the sweeps
+        :param rssiSum: Sum in dBm of the sweeps
+        :param rssiMax: Maximum in dBm of the sweeps
+        '''
+        if self.count==0:
+            self.rssiMin[:]=rssiMin
+            self.rssiSum[:]=rssiSum
+            self.rssiMax[:]=rssiMax
+        else:
+            np.minimum(self.rssiMin, rssiMin, out=self.rssiMin)
+            self.rssiSum+=rssiSum
+            np.maximum(self.rssiMax, rssiMax, out=self.rssiMax)
+        self.count+=count
+    
+class HistoryPyramid():
+    '''
+    Downsampled history of the sweeps of a session, with the min, mean and max of every
+    bucket of several lengths, such as 10s, 1min, 10min and 1h. The buckets are aligned
+    to multiples of their length and each length is a multiple of the previous one.
+    A sweep only updates the bucket of the finest level, a bucket is merged into the
+    next level when it ends, so a level costs one update per bucket of the level below.
+    The ended buckets are kept as rows until they are appended to the history tables
+    '''
+    
+    def __init__(self, levelTimes, amtRssiValues):
+        '''
+        Constructor
+        :param levelTimes: Lengths of the buckets of each level in seconds, from the finest to the coarsest
+        :param amtRssiValues: Amount of RSSI values of each sweep
+        '''
+        self.levelList=[HistoryLevel(bucketTime, amtRssiValues) for bucketTime in levelTimes]
+        #Ended buckets of each level not yet written, as (bucketStart, count, rssiMin, rssiAvg, rssiMax)
+        self.pendingList=[[] for bucketTime in levelTimes]
+    
+    @classmethod
+    def from_tables(cls, table, historyTables):
+        '''
+        Restore the buckets being filled from the history tables of a session. The open bucket of
+        a level is rebuilt from the rows of the level below written after its last row, starting
+        from the coarsest level, and the one of the finest level from the sweeps of the session table
+        :param table: HDF5 session table
+        :param historyTables: HDF5 history tables of the session, from the finest to the coarsest level
+        '''
+        pyramid=cls(table.attrs.historyLevels, table.coldescrs['rssiCodes'].shape[0])
+        for levelNumber in range(len(historyTables)-1, -1, -1):
+            historyTable=historyTables[levelNumber]
+            replayStart=None
+            if historyTable.nrows>0:
+                replayStart=historyTable[historyTable.nrows-1]['timestamp']+pyramid.levelList[levelNumber].bucketTime
+            if levelNumber>0:
+                sourceTable=historyTables[levelNumber-1]
+                for row in sourceTable.read(start=first_row_after(sourceTable, replayStart)):
+                    pyramid.add(levelNumber, row['timestamp'], row['count'], row['rssiMin'],
+                                row['rssiAvg']*np.float64(row['count']), row['rssiMax'])
+            else:
+                start=first_row_after(table, replayStart)
+                timestamps=table.read(start=start, field='timestamp').reshape(-1)
+                for timestamp, rssiDbm in zip(timestamps, rssi_codes_to_dbm(table.read(start=start, field='rssiCodes'), table)):
+                    pyramid.update(timestamp, rssiDbm)
+        return pyramid
+    
+    def update(self, timestamp, rssiData):
+        '''
+        Add a new sweep to the bucket of the finest level
+        :param timestamp: Timestamp of the sweep
+        :param rssiData: Array with the RSSI values of the sweep in dBm
+        '''
+        self.add(0, timestamp, 1, rssiData, rssiData, rssiData)
+    
+    def add(self, levelNumber, timestamp, count, rssiMin, rssiSum, rssiMax):
+        '''
+        Add a sweep or a bucket of the level below to a level, ending its bucket
+        first if the timestamp falls in the next one
+        '''
+        level=self.levelList[levelNumber]
+        bucketStart=math.floor(timestamp/level.bucketTime)*level.bucketTime
+        if level.count>0 and bucketStart!=level.bucketStart:
+            self.end_bucket(levelNumber)
+        if level.count==0:
+            level.bucketStart=bucketStart
+        level.add(count, rssiMin, rssiSum, rssiMax)
+    
+    def end_bucket(self, levelNumber):
+        '''
+        Store the bucket of a level as a pending row and merge it into the next level
+        '''
+        level=self.levelList[levelNumber]
+        rssiAvg=(level.rssiSum/level.count).astype(np.float32)
+        self.pendingList[levelNumber].append((level.bucketStart, level.count, level.rssiMin.copy(),
+                                              rssiAvg, level.rssiMax.copy()))
+        if levelNumber+1<len(self.levelList):
+            self.add(levelNumber+1, level.bucketStart, level.count, level.rssiMin, level.rssiSum, level.rssiMax)
+        level.count=0
+    
+    def end_all(self):
+        '''
+        End the buckets being filled of every level, used when the session ends
+        '''
+        for levelNumber in range(len(self.levelList)):
+            if self.levelList[levelNumber].count>0:
+                self.end_bucket(levelNumber)
     
 class H5ScannerThread(threading.Thread):
     '''
     Class that writes the scanning data received by the
-    UDP backend into a HDF5-formatted file
+    UDP backend into HDF5-formatted segment files. Each node keeps a series of
+    scan sessions, one table per set of scan options and start time. The rows
+    of each node are batched in memory and appended to its table in a single write.
+    The segment is rolled over to a new file after a time or size limit, see
+    SegmentManifest for the naming of the files and the manifest that lists them
     '''
     
-    def __init__(self, scanQueue, h5FileLock):
+    def __init__(self, scanQueue, h5FileLock, h5Dir="data", segmentPrefix="scanData", resume=False,
+                 segmentTime=3600.0, segmentBytes=512*1024*1024,
+                 flushRows=64, flushBytes=4*1024*1024, flushLatency=1.0, liveChannel=None, pipelineStats=None,
+                 summaryInterval=10.0, historyLevels=(10.0, 60.0, 600.0, 3600.0),
+                 windowSweeps=DFLT_WINDOW_SWEEPS, windowTime=DFLT_WINDOW_TIME, windowBuckets=10, ewmaHalfLife=DFLT_EWMA_HALF_LIFE, complib="lzo", complevel=1, shuffle=True, chunkBytes=64*1024, expectedRows=65536):
         '''
         Constructor
-        :param scanQueue: Queue where the scanning data
-        is stored as a ScanResults namedtuple (clientAddr,recvOpt,rssiData)
+        :param scanQueue: ScanQueue or Queue where the scanning data
+        is stored as a ScanResults namedtuple, the string 'exit' closes the thread
         :param h5FileLock: Lock that regulates access to the HDF5 scan data file
+        :param h5Dir: Folder of the HDF5 segment files and their manifest
+        :param segmentPrefix: Prefix of the names of the segment files
+        :param resume: If True, keep appending to the last segment left open by a crash
+        instead of closing it and starting a new one
+        :param segmentTime: Maximum time in seconds a segment is written before rolling over, None for no limit
+        :param segmentBytes: Maximum size in bytes of a segment before rolling over, None for no limit
+        :param flushRows: Maximum amount of pending rows of a node before writing them
+        :param flushBytes: Maximum size in bytes of all the pending rows before writing them
+        :param flushLatency: Maximum time in seconds that a row can be pending before writing it
+        :param liveChannel: LiveDataChannel where the latest state of each board is published, None to disable it
+        :param pipelineStats: PipelineStats where the stage latencies and the queue depths are recorded, None to disable it
+        :param summaryInterval: Minimum time in seconds between the rows of the summary table of a session
+        :param historyLevels: Lengths in seconds of the buckets of the levels of the history
+        of each session, see HistoryPyramid, each one a multiple of the previous one. None to disable it
+        :param windowSweeps: Amount of sweeps of the window statistics published in the live data, None to disable them
+        :param windowTime: Length in seconds of the time window statistics published in the live data, None to disable them
+        :param windowBuckets: Amount of buckets the time window is split in
+        :param ewmaHalfLife: Half-life in seconds of the exponential average published in the live data, None to disable it
+        :param complib: Compression library of the tables, any supported by PyTables such as
+        "zlib", "lzo", "bzip2" or "blosc:lz4". If the library is not available, zlib is used,
+        a blosc codec that is not available raises ValueError
+        :param complevel: Compression level from 0 (disabled) to 9
+        :param shuffle: If True, apply the byte shuffle filter before compressing
+        :param chunkBytes: Target size of the chunks of the session tables, the amount of rows per
+        chunk is derived from it and the sweep length, None to let PyTables choose it from expectedRows
+        :param expectedRows: Amount of rows expected in each session table
         '''
         self.scanQueue = scanQueue
+        self.liveChannel=liveChannel
+        self.pipelineStats=pipelineStats
+        #Functions called with the scan results of every board after they are stored,
+        #such as the analysis of the spectrum, see UdpScannerServer.add_scan_consumer
+        self.scanConsumers=[]
+        #Stage timestamps of the pending rows, completed with the commit time when they are written
+        self.pendingStageTimes=[]
         self.h5FileLock=h5FileLock
+        #Index that maps the MAC address of each node to its NodeEntry,
+        #so finding the table of a board doesn't require reading the file
+        self.nodeIndex={}
+        #Running statistics, scan options and start time of the sessions that were
+        #open when the segment rolled over, indexed by MAC address. They continue
+        #in the next segment when their board sends again
+        self.carryDict={}
+        
+        #Segment rollover
+        self.segmentTime=segmentTime
+        self.segmentBytes=segmentBytes
+        self.segmentCheckDue=False
+        
+        #Batching thresholds
+        self.flushRows=flushRows
+        self.flushBytes=flushBytes
+        self.flushLatency=flushLatency
+        self.summaryInterval=summaryInterval
+        self.historyLevels=tuple(float(bucketTime) for bucketTime in historyLevels) if historyLevels else ()
+        for bucketTime in self.historyLevels:
+            #Written this way so NaN is rejected too
+            if not 0<bucketTime<float('inf'):
+                raise ValueError("Every history level must be a positive length "+str(self.historyLevels))
+        for bucketTime, nextTime in zip(self.historyLevels, self.historyLevels[1:]):
+            if nextTime<=bucketTime or abs(nextTime/bucketTime-round(nextTime/bucketTime))>1e-9:
+                raise ValueError("Each history level must be a multiple of the previous one "+str(self.historyLevels))
+        self.windowOptions={'windowSweeps':windowSweeps, 'windowTime':windowTime,
+                            'windowBuckets':windowBuckets, 'ewmaHalfLife':ewmaHalfLife}
+        self.pendingBytes=0
+        #Storage layout of the tables
+        if complib not in ("zlib", "lzo", "bzip2", "blosc") and not complib.startswith("blosc:"):
+            raise ValueError("Unknown compression library "+str(complib))
+        if tb.whichLibVersion(complib.split(":")[0])==None:
+            print "Compression library", complib, "not available, using zlib instead"
+            complib="zlib"
+        elif complib.startswith("blosc:") and complib[len("blosc:"):] not in blosc_codecs():
+            #Checked here because a codec not built in blosc would only fail at the first write
+            raise ValueError("Blosc codec "+complib+" not available, expected one of "+", ".join(blosc_codecs()))
+        self.h5Filters=tb.Filters(complevel=complevel, complib=complib, shuffle=shuffle)
+        self.chunkBytes=chunkBytes
+        self.expectedRows=expectedRows
+        #Time at which the oldest pending row was stored, None if there are no pending rows
+        self.pendingSince=None
+        #Write statistics
+        self.rowsWritten=0
+        self.flushCount=0
+        #Time spent appending and flushing the rows, without the time waiting for sweeps
+        self.flushTime=0.0
         
         threading.Thread.__init__(self)
         self.alive = threading.Event()
         self.alive.set()
         
         #Check if the data folder exists and create it otherwise
-        if not os.path.exists("data/"):
-            os.makedirs("data/")
+        if h5Dir!="" and not os.path.exists(h5Dir):
+            os.makedirs(h5Dir)
+        self.manifest=SegmentManifest(h5Dir, segmentPrefix)
         
-        #Open the HDF5 file and create the table to store the data
+        #Close the segments left open by a crash, except the last one if resuming
+        partList=self.manifest.segment_numbers(SegmentManifest.partSuffix)
+        resumeNumber=None
+        if resume and len(partList)>0:
+            resumeNumber=partList.pop()
+        for partNumber in partList:
+            self.manifest.recover_part(partNumber)
         with self.h5FileLock:
-            self.h5File=tb.openFile("data/newScanData.h5", mode="w", title="Scan data file", complevel=1, complib="lzo")
-            self.h5Group = self.h5File.createGroup("/", 'scannerNodes', 'White space detector nodes')
+            if resumeNumber==None or not self.open_segment(resumeNumber, resume=True):
+                self.open_segment(self.manifest.next_number())
         
         self.start()
-        
+    
+    def open_segment(self, number, resume=False):
+        '''
+        Open a segment file and make it the one where the data is written,
+        must be called with the H5 file lock held
+        :param number: Number of the segment
+        :param resume: If True, keep appending to the existing .part file of the segment
+        Return False if the segment couldn't be resumed, in which case it's recovered as a complete segment
+        '''
+        self.segmentNumber=number
+        self.h5FilePath=self.manifest.segment_path(number, SegmentManifest.partSuffix)
+        self.nodeIndex={}
+        if resume:
+            try:
+                self.segmentStartTime, self.segmentEndTime, macList, self.segmentRows=scan_segment_contents(self.h5FilePath)
+                self.h5File=tb.openFile(self.h5FilePath, mode="a", title="Scan data file", filters=self.h5Filters)
+            except Exception, e:
+                print "Segment", self.h5FilePath, "can't be resumed:", e
+                self.manifest.recover_part(number)
+                return False
+            self.segmentMacs=set(macList)
+            self.h5Group=self.h5File.root.scannerNodes
+            self.build_node_index()
+        else:
+            self.segmentStartTime=self.segmentEndTime=None
+            self.segmentMacs=set()
+            self.segmentRows=0
+            self.h5File=tb.openFile(self.h5FilePath, mode="w", title="Scan data file", filters=self.h5Filters)
+            self.h5Group = self.h5File.createGroup("/", 'scannerNodes', 'White space detector nodes')
+        self.segmentOpenTime=time.time()
+        return True
+    
+    def close_segment(self):
+        '''
+        Close the current segment, rename it to a complete segment and add it to the manifest.
+        A segment without sweeps is removed. The pending rows and the summaries must be
+        written first, and it must be called with the H5 file lock held
+        '''
+        if self.segmentRows>0:
+            index_segment(self.h5File)
+        self.h5File.close()
+        fsync_path(self.h5FilePath)
+        if self.segmentRows==0:
+            os.remove(self.h5FilePath)
+            return
+        os.rename(self.h5FilePath, self.manifest.segment_path(self.segmentNumber))
+        fsync_path(self.manifest.h5Dir)
+        self.manifest.add_segment(self.segmentNumber, self.segmentStartTime, self.segmentEndTime,
+                                  list(self.segmentMacs), self.segmentRows)
+    
+    def segment_due(self):
+        '''
+        Return True if the current segment reached its time or size limit
+        '''
+        if self.segmentTime!=None and time.time()-self.segmentOpenTime>=self.segmentTime:
+            return True
+        return self.segmentBytes!=None and os.path.getsize(self.h5FilePath)>=self.segmentBytes
+    
+    def roll_segment(self):
+        '''
+        Close the current segment and continue writing in a new one. The sessions of the
+        boards that are alive continue in the new segment with the same running statistics
+        '''
+        self.flush_pending()
+        carryDict={}
+        for macAddr, nodeEntry in self.nodeIndex.iteritems():
+            self.write_summary(nodeEntry)
+            if nodeEntry.isAlive:
+                carryDict[macAddr]=(nodeEntry.accumulator, nodeEntry.optColumns, nodeEntry.sessionStart, nodeEntry.windows)
+        with self.h5FileLock:
+            self.close_segment()
+            self.open_segment(self.manifest.next_number())
+        self.carryDict=carryDict
+    
+    @staticmethod
+    def scan_table_desc(amtRssiValues):
+        '''
+        Return the description of a session table, the sweeps are stored as raw RSSI codes,
+        use rssi_codes_to_dbm to read them in dBm
+        :param amtRssiValues: Amount of RSSI values of each sweep
+        '''
+        return {'macAddr':tb.StringCol(18),
+                'ipAddr':tb.StringCol(13),
+                'isAlive':tb.BoolCol(1),
+                'freqStart':tb.Float32Col(1),
+                'freqStop':tb.Float32Col(1),
+                'freqRes':tb.Float32Col(1),
+                'modFormat':tb.UInt8Col(1),
+                'agcEnabled':tb.BoolCol(1),
+                'lnaGain':tb.UInt8Col(1),
+                'lna2Gain':tb.UInt8Col(1),
+                'dvgaGain':tb.UInt8Col(1),
+                'rssiWait':tb.UInt32Col(1),
+                #Scalar column, PyTables can only index columns without shape
+                'timestamp':tb.Time64Col(),
+                'rssiCodes':tb.UInt8Col(shape=(amtRssiValues,))}
+    
+    @staticmethod
+    def session_chunkshape(amtRssiValues, chunkBytes):
+        '''
+        Return the chunk shape of a session table that holds about chunkBytes per chunk.
+        A chunk is the unit of compression and of reading, so the amount of rows
+        per chunk shrinks as the sweeps get longer to keep the chunks the same size
+        :param amtRssiValues: Amount of RSSI values of each sweep
+        :param chunkBytes: Target size of a chunk in bytes, None to let PyTables choose
+        '''
+        if chunkBytes==None:
+            return None
+        rowBytes=tb.Description(H5ScannerThread.scan_table_desc(amtRssiValues))._v_dtype.itemsize
+        return (max(1, chunkBytes/rowBytes),)
+    
+    @staticmethod
+    def summary_table_desc(amtRssiValues):
+        '''
+        Return the description of the summary table of a session, with the running
+        statistics in dBm of the count first sweeps of the session
+        :param amtRssiValues: Amount of RSSI values of each sweep
+        '''
+        return {'timestamp':tb.Time64Col(1),
+                'count':tb.UInt64Col(1),
+                'rssiMin':tb.Float32Col(shape=(amtRssiValues,)),
+                'rssiAvg':tb.Float32Col(shape=(amtRssiValues,)),
+                'rssiMax':tb.Float32Col(shape=(amtRssiValues,))}
+    
+    @staticmethod
+    def history_table_desc(amtRssiValues):
+        '''
+        Return the description of a history table of a session, with the statistics
+        in dBm of the count sweeps of each bucket that starts at timestamp
+        :param amtRssiValues: Amount of RSSI values of each sweep
+        '''
+        return {'timestamp':tb.Time64Col(),
+                'count':tb.UInt64Col(),
+                'rssiMin':tb.Float32Col(shape=(amtRssiValues,)),
+                'rssiAvg':tb.Float32Col(shape=(amtRssiValues,)),
+                'rssiMax':tb.Float32Col(shape=(amtRssiValues,))}
+    
+    @staticmethod
+    def opt_columns(scanOpt):
+        '''
+        Return the scan options as a tuple of the values stored in the table columns
+        freqStart, freqStop, freqRes, modFormat, agcEnabled, lnaGain, lna2Gain, dvgaGain and rssiWait
+        :param scanOpt: UdpScanProt.Opt namedtuple with the scan options
+        '''
+        return (np.float32(scanOpt.freqStartMhz + scanOpt.freqStartKhz/1000.0),
+                np.float32(scanOpt.freqStopMhz + scanOpt.freqStopKhz/1000.0),
+                np.float32(scanOpt.freqRes),
+                scanOpt.modFormat,
+                scanOpt.agcEnabled!=0,
+                scanOpt.lnaGain,
+                scanOpt.lna2Gain,
+                scanOpt.dvgaGain,
+                scanOpt.rssiWait)
+    
+    def build_node_index(self):
+        '''
+        Rebuild the MAC address index from the node groups already stored in the file,
+        only needed when an existing file is opened. The running statistics of
+        each node are restored from the summary of its current session
+        '''
+        self.nodeIndex={}
+        for group in self.h5File.iterNodes(self.h5Group, classname='Group'):
+            nodeEntry=NodeEntry(group, isAlive=bool(group._v_attrs.isAlive), maxPendingRows=self.flushRows)
+            table=self.h5File.getNode(group, group._v_attrs.currentSession)
+            summaryTable=self.h5File.getNode(group, table.attrs.summaryTable)
+            accumulator=RssiAccumulator.from_tables(table, summaryTable)
+            #The sessions written before the history was added have no history tables
+            historyTables=[]
+            pyramid=None
+            if 'historyTables' in table.attrs and len(table.attrs.historyTables)>0:
+                historyTables=[self.h5File.getNode(group, tableName) for tableName in table.attrs.historyTables]
+                pyramid=HistoryPyramid.from_tables(table, historyTables)
+            nodeEntry.start_session(table, summaryTable, accumulator, table.attrs.scanOpt, historyTables, pyramid)
+            nodeEntry.windows=self.new_windows(table.coldescrs['rssiCodes'].shape[0])
+            self.nodeIndex[group._v_attrs.macAddr]=nodeEntry
+    
+    @staticmethod
+    def child_name(group, prefix):
+        '''
+        Return the name of the next child of a group, consecutively named
+        as prefix1, prefix2, prefix3, etc by order of creation
+        :param group: HDF5 group
+        :param prefix: Prefix of the name
+        '''
+        #Only the children with the same prefix count, a node also holds summary tables
+        childNumber=sum(1 for childName in group._v_children if childName.startswith(prefix) and childName[len(prefix):].isdigit())+1
+        while prefix+str(childNumber) in group:
+            childNumber+=1
+        return prefix+str(childNumber)
+    
+    def new_windows(self, amtRssiValues):
+        '''
+        Return a new SpectrumWindows for the live data of a node, None if there is no live channel
+        :param amtRssiValues: Amount of RSSI values of each sweep
+        '''
+        if self.liveChannel==None:
+            return None
+        return SpectrumWindows(amtRssiValues, **self.windowOptions)
+    
+    def new_session(self, nodeEntry, optColumns, amtRssiValues, accumulator=None, startTime=None, windows=None):
+        '''
+        Create a new session table, its summary table and its history tables for the node
+        and make them the current ones, the tables of the previous sessions are kept untouched
+        :param nodeEntry: NodeEntry of the node
+        :param optColumns: Scan options of the session as stored in its columns
+        :param amtRssiValues: Amount of RSSI values of each sweep
+        :param accumulator: RssiAccumulator of a session that continues from
+        the previous segment, None to start a new one
+        :param startTime: Start time of the session that continues, None to start a new one
+        :param windows: SpectrumWindows of the session that continues, None to start new ones
+        '''
+        if startTime==None:
+            startTime=time.time()
+        if accumulator==None:
+            accumulator=RssiAccumulator(amtRssiValues)
+        with self.h5FileLock:
+            sessionName=self.child_name(nodeEntry.group, "session")
+            table=self.h5File.createTable(nodeEntry.group, sessionName, self.scan_table_desc(amtRssiValues),
+                                          "Scan session started on "+datetime.datetime.fromtimestamp(startTime).strftime('%c'),
+                                          expectedrows=self.expectedRows,
+                                          chunkshape=self.session_chunkshape(amtRssiValues, self.chunkBytes))
+            #The summary table shares the number of its session
+            summaryTable=self.h5File.createTable(nodeEntry.group, "summary"+sessionName[len("session"):],
+                                                 self.summary_table_desc(amtRssiValues),
+                                                 "Running statistics of "+sessionName)
+            table.attrs.startTime=startTime
+            table.attrs.scanOpt=optColumns
+            table.attrs.rssiScale=RSSI_SCALE
+            table.attrs.rssiOffset=RSSI_OFFSET
+            table.attrs.summaryTable=summaryTable._v_name
+            table.attrs.firstCount=accumulator.count
+            #A history table per level, named history<session number>_<level number> so the name is a valid
+            #identifier whatever the bucket length, which is in the attributes of the session and the title
+            historyTables=[]
+            for levelNumber, bucketTime in enumerate(self.historyLevels):
+                historyTables.append(self.h5File.createTable(nodeEntry.group, "history%s_%d" % (sessionName[len("session"):], levelNumber),
+                                                             self.history_table_desc(amtRssiValues),
+                                                             "History of "+sessionName+" in buckets of %g s" % bucketTime))
+            table.attrs.historyLevels=self.historyLevels
+            table.attrs.historyTables=[historyTable._v_name for historyTable in historyTables]
+            pyramid=HistoryPyramid(self.historyLevels, amtRssiValues) if len(self.historyLevels)>0 else None
+            nodeEntry.start_session(table, summaryTable, accumulator, optColumns, historyTables, pyramid)
+            nodeEntry.windows=windows if windows!=None else self.new_windows(amtRssiValues)
+            nodeEntry.set_status(True)
+            #A session that continues starts its summary with the statistics carried over
+            if accumulator.count>0:
+                self.append_summary(nodeEntry, time.time())
+    
+    def flush_timeout(self):
+        '''
+        Return how long the thread can wait for new data before the oldest
+        pending row exceeds the latency threshold, None if there are no pending rows
+        '''
+        if self.pendingSince==None:
+            return None
+        return max(0.0, self.pendingSince+self.flushLatency-time.time())
+    
     def run(self):
         '''
         Main loop of the thread, checks if there is any data
         in the queue and stores it in the proper HDF5 table
         '''
         while self.alive.isSet():
-            qResult=self.scanQueue.get()
+            try:
+                qResult=self.scanQueue.get(block=True, timeout=self.flush_timeout())
+            except Queue.Empty:
+                #The oldest pending row reached the latency threshold
+                self.flush_pending()
+                continue
             
             #Check if we received the exit message
             if qResult=='exit':
                 self.alive.clear()
                 break
             
-            scanResults=qResult
-            
-            if scanResults.rssiData!=None:
-                #Create the table description based on the scan options!
-                scanTableDesc={'macAddr':tb.StringCol(18),
-                               'ipAddr':tb.StringCol(13),
-                               'isAlive':tb.BoolCol(1),
-                               'freqStart':tb.Float32Col(1),
-                               'freqStop':tb.Float32Col(1),
-                               'freqRes':tb.Float32Col(1),
-                               'modFormat':tb.UInt8Col(1),
-                               'agcEnabled':tb.BoolCol(1),
-                               'lnaGain':tb.UInt8Col(1),
-                               'lna2Gain':tb.UInt8Col(1),
-                               'dvgaGain':tb.UInt8Col(1),
-                               'rssiWait':tb.UInt32Col(1),
-                               'timestamp':tb.Time64Col(1),
-                               'rssiData':tb.Float32Col(shape=(len(scanResults.rssiData),)),
-                               'rssiMin':tb.Float32Col(shape=(len(scanResults.rssiData),)),
-                               'rssiAvg':tb.Float32Col(shape=(len(scanResults.rssiData),)),
-                               'rssiMax':tb.Float32Col(shape=(len(scanResults.rssiData),))}
-                
-                scanOpt=scanResults.recvOpt
-            
-            
-            #Obtain the table associated with the node MAC address 
-            #or create it if it doesn't exist
+            if self.pipelineStats!=None:
+                self.pipelineStats.gauges['scanDataQueue'].record(self.scanQueue.qsize())
+                if qResult.stageTimes!=None:
+                    qResult.stageTimes.append(monotonic())
+            self.process_scan(qResult)
+            for consumer in self.scanConsumers:
+                consumer(qResult)
+            if self.pendingBytes>=self.flushBytes:
+                self.flush_pending()
+            #The limits of the segment are checked after every write
+            if self.segmentCheckDue:
+                self.segmentCheckDue=False
+                if self.segment_due():
+                    self.roll_segment()
+        
+        #Close the segment before exit, so the next start of the backend writes a new one
+        self.flush_pending()
+        for nodeEntry in self.nodeIndex.itervalues():
+            self.write_summary(nodeEntry)
+        with self.h5FileLock:
+            self.close_segment()
+    
+    def process_scan(self, scanResults):
+        '''
+        Store the scan results of a board in the pending rows of its node
+        :param scanResults: ScanResults namedtuple, with rssiData set to None if the board timed out
+        '''
+        nodeEntry=self.nodeIndex.get(scanResults.macAddr)
+        
+        #If no RSSI data was included in the queue, we assume the board to be inactive
+        if scanResults.rssiData is None:
+            if nodeEntry!=None:
+                self.flush_pending()
+                self.write_summary(nodeEntry)
+                with self.h5FileLock:
+                    nodeEntry.set_status(False)
+            else:
+                #A board without a node in this segment yet, its session ends instead of being carried over
+                self.carryDict.pop(scanResults.macAddr, None)
+            if self.liveChannel!=None:
+                self.liveChannel.publish_status(scanResults.macAddr, False)
+            return
+        
+        optColumns=self.opt_columns(scanResults.recvOpt)
+        amtRssiValues=len(scanResults.rssiData)
+        #Obtain the group associated with the node MAC address
+        #or create it if it doesn't exist
+        if nodeEntry==None:
             with self.h5FileLock:
-                self.tableFound=False
-                nodeNumber=0
-                for table in self.h5File.root.scannerNodes:
-                    nodeNumber+=1
-                    if len(table)>0 and table.cols.macAddr[0]==scanResults.macAddr:
-                        self.tableFound=True
-                        break
-                
-                if not self.tableFound:
-                    #Avoid creating a new table with no data
-                    if scanResults.rssiData==None:
-                        continue
-                    #The new tables will be consecutively named as node1, node2, node3, etc by order of arrival
-                    tableName="node"+str(nodeNumber+1)
-                    table=self.h5File.createTable(self.h5Group, tableName, scanTableDesc, "Node with the MAC " + str(scanResults.macAddr), expectedrows=65536)
-                    
-                else:
-                    #Reset the node if it was inactive in the previous iteration
-                    #or if the scan options have changed
-                    if table.nrows>0 and not table.cols.isAlive[0] \
-                        or table.cols.freqStart[0]!=scanOpt.freqStartMhz+scanOpt.freqStartKhz/1000.0 \
-                        or table.cols.freqStop[0]!=scanOpt.freqStopMhz+scanOpt.freqStopKhz/1000.0 \
-                        or table.cols.freqRes[0]!=scanOpt.freqRes \
-                        or table.cols.modFormat[0]!=scanOpt.modFormat \
-                        or table.cols.agcEnabled[0]!=scanOpt.agcEnabled!=0 \
-                        or table.cols.lnaGain[0]!=scanOpt.lnaGain \
-                        or table.cols.lna2Gain[0]!=scanOpt.lna2Gain \
-                        or table.cols.dvgaGain[0]!=scanOpt.dvgaGain \
-                        or table.cols.rssiWait[0]!=scanOpt.rssiWait:
-                        self.h5File.removeNode(self.h5Group, name="node"+str(nodeNumber), recursive=True)
-                        table=self.h5File.createTable(self.h5Group, "node"+str(nodeNumber), scanTableDesc, "Node with the MAC " + str(scanResults.macAddr), expectedrows=65536)
-                        self.h5File.flush()                
-                
-                #If no RSSI data was included in the queue, we assume the board to be inactive
-                if scanResults.rssiData==None:
-                    for row in table:
-                        row['isAlive']=False
-                        row.update()
-                    table.flush()
-                else:
-                    #Store the scan options in the table
-                    table.row['timestamp']=time.time()
-                    table.row['macAddr']=str(scanResults.macAddr)
-                    table.row['ipAddr']=str(scanResults.ipAddr)
-                    table.row['isAlive']=True
-                    table.row['freqStart']=scanOpt.freqStartMhz + scanOpt.freqStartKhz/1000.0
-                    table.row['freqStop']=scanOpt.freqStopMhz + scanOpt.freqStopKhz/1000.0
-                    table.row['freqRes']=scanOpt.freqRes
-                    table.row['modFormat']=scanOpt.modFormat
-                    table.row['agcEnabled']=scanOpt.agcEnabled!=0
-                    table.row['lnaGain']=scanOpt.lnaGain
-                    table.row['lna2Gain']=scanOpt.lna2Gain
-                    table.row['dvgaGain']=scanOpt.dvgaGain
-                    table.row['rssiWait']=scanOpt.rssiWait
-                    #Store the scan data and calculate its current max, min and avg
-                    table.row['rssiData']=scanResults.rssiData
-                    if len(table)>0:
-                        table.row['rssiAvg']=np.average(np.vstack((table.cols.rssiAvg[len(table)-1], scanResults.rssiData)), axis=0, weights=[len(table),1])
-                        table.row['rssiMin']=np.vstack((table.cols.rssiMin[len(table)-1], scanResults.rssiData)).min(axis=0)
-                        table.row['rssiMax']=self.maxData=np.vstack((table.cols.rssiMax[len(table)-1], scanResults.rssiData)).max(axis=0)
-                    else:
-                        table.row['rssiAvg']=scanResults.rssiData
-                        table.row['rssiMin']=scanResults.rssiData
-                        table.row['rssiMax']=scanResults.rssiData
-                    #Save the changes
-                    table.row.append()
-                    table.flush()
+                group=self.h5File.createGroup(self.h5Group, self.child_name(self.h5Group, "node"), "Node with the MAC " + str(scanResults.macAddr))
+                group._v_attrs.macAddr=str(scanResults.macAddr)
+            nodeEntry=NodeEntry(group, maxPendingRows=self.flushRows)
+            self.nodeIndex[scanResults.macAddr]=nodeEntry
+            #Continue the session of the previous segment if the scan options didn't change
+            carriedSession=self.carryDict.pop(scanResults.macAddr, None)
+            if carriedSession!=None and carriedSession[1]==optColumns and len(carriedSession[0].rssiMin)==amtRssiValues:
+                self.new_session(nodeEntry, optColumns, amtRssiValues, carriedSession[0], carriedSession[2], carriedSession[3])
+            else:
+                self.new_session(nodeEntry, optColumns, amtRssiValues)
+        #Start a new session if the board was inactive in the previous iteration
+        #or if the scan options have changed
+        elif not nodeEntry.isAlive or nodeEntry.optColumns!=optColumns:
+            #Write the pending rows and the statistics of the previous session first
+            self.flush_pending()
+            self.write_summary(nodeEntry)
+            self.new_session(nodeEntry, optColumns, amtRssiValues)
         
-        #Close the H5 file before exit and rename 
-        #it to avoid being overwritten if the backend starts again
-        with self.h5FileLock:    
-            self.h5File.close()
-            os.rename("data/newScanData.h5", "data/scanData"+datetime.datetime.now().strftime("_%d-%m-%y_%H-%M")+".h5")
-            
-            
-            
+        #Store the scan options in the next pending row
+        row=nodeEntry.pendingRows[nodeEntry.pendingCount]
+        row['timestamp']=time.time()
+        row['macAddr']=str(scanResults.macAddr)
+        row['ipAddr']=str(scanResults.ipAddr)
+        row['isAlive']=True
+        row['freqStart'], row['freqStop'], row['freqRes'], row['modFormat'], row['agcEnabled'], \
+            row['lnaGain'], row['lna2Gain'], row['dvgaGain'], row['rssiWait']=optColumns
+        #Store the raw scan data and update its max, min and avg,
+        #which are written to the summary table at a lower rate
+        accumulator=nodeEntry.accumulator
+        accumulator.update(scanResults.rssiData)
+        if nodeEntry.pyramid!=None:
+            nodeEntry.pyramid.update(row['timestamp'].item(), scanResults.rssiData)
+        if nodeEntry.windows!=None:
+            nodeEntry.windows.update(row['timestamp'].item(), scanResults.rssiData)
+        row['rssiCodes']=scanResults.rssiCodes
+        if self.liveChannel!=None:
+            #The accumulator and window arrays are updated in place, so the channel gets copies
+            self.liveChannel.publish(LiveScanData(macAddr=scanResults.macAddr, ipAddr=scanResults.ipAddr, isAlive=True,
+                                                  joinTime=nodeEntry.sessionStart, timestamp=row['timestamp'].item(),
+                                                  recvOpt=scanResults.recvOpt, rssiData=scanResults.rssiData,
+                                                  rssiMin=accumulator.rssiMin.copy(), rssiAvg=accumulator.rssiAvg.copy(),
+                                                  rssiMax=accumulator.rssiMax.copy(), windowStats=nodeEntry.windows.snapshot()))
+        
+        if self.pipelineStats!=None and scanResults.stageTimes!=None:
+            self.pendingStageTimes.append(scanResults.stageTimes)
+        nodeEntry.pendingCount+=1
+        self.pendingBytes+=nodeEntry.pendingRows.itemsize
+        if self.pendingSince==None:
+            self.pendingSince=time.time()
+        if nodeEntry.pendingCount>=len(nodeEntry.pendingRows):
+            self.flush_pending()
+    
+    def flush_pending(self):
+        '''
+        Append the pending rows of every node to its table,
+        with a single write per node, and flush the file
+        '''
+        if self.pendingSince==None:
+            return
+        rowsFlushed=0
+        now=time.time()
+        with self.h5FileLock:
+            flushStart=monotonic()
+            for nodeEntry in self.nodeIndex.itervalues():
+                if nodeEntry.pendingCount>0:
+                    nodeEntry.table.append(nodeEntry.pendingRows[:nodeEntry.pendingCount])
+                    lastTimestamp=nodeEntry.pendingRows[nodeEntry.pendingCount-1]['timestamp'].item()
+                    nodeEntry.set_status(True, lastTimestamp)
+                    #Time range and boards of the segment for the manifest
+                    firstTimestamp=nodeEntry.pendingRows[0]['timestamp'].item()
+                    if self.segmentStartTime==None or firstTimestamp<self.segmentStartTime:
+                        self.segmentStartTime=firstTimestamp
+                    if self.segmentEndTime==None or lastTimestamp>self.segmentEndTime:
+                        self.segmentEndTime=lastTimestamp
+                    self.segmentMacs.add(nodeEntry.group._v_attrs.macAddr)
+                    self.segmentRows+=nodeEntry.pendingCount
+                    rowsFlushed+=nodeEntry.pendingCount
+                    nodeEntry.pendingCount=0
+                    if now-nodeEntry.summaryTime>=self.summaryInterval:
+                        self.append_summary(nodeEntry, now)
+                self.append_history(nodeEntry)
+            self.h5File.flush()
+            self.flushTime+=monotonic()-flushStart
+        self.segmentCheckDue=True
+        
+        if self.pipelineStats!=None:
+            commitTime=monotonic()
+            for stageTimes in self.pendingStageTimes:
+                stageTimes.append(commitTime)
+                self.pipelineStats.record_stages(stageTimes)
+            self.pendingStageTimes=[]
+            self.pipelineStats.gauges['pendingRows'].record(rowsFlushed)
+        self.pendingBytes=0
+        self.pendingSince=None
+        self.rowsWritten+=rowsFlushed
+        self.flushCount+=1
+    
+    def append_summary(self, nodeEntry, now):
+        '''
+        Append the running statistics of the node to its summary table,
+        must be called with the H5 file lock held
+        :param nodeEntry: NodeEntry of the node
+        :param now: Timestamp of the summary row
+        '''
+        accumulator=nodeEntry.accumulator
+        summaryRow=np.empty(1, dtype=nodeEntry.summaryTable.dtype)
+        summaryRow['timestamp']=now
+        summaryRow['count']=accumulator.count
+        summaryRow['rssiMin']=accumulator.rssiMin
+        summaryRow['rssiAvg']=accumulator.rssiAvg
+        summaryRow['rssiMax']=accumulator.rssiMax
+        nodeEntry.summaryTable.append(summaryRow)
+        nodeEntry.summaryCount=accumulator.count
+        nodeEntry.summaryTime=now
+    
+    def append_history(self, nodeEntry):
+        '''
+        Append the ended buckets of the history of the node to its history tables,
+        must be called with the H5 file lock held
+        :param nodeEntry: NodeEntry of the node
+        '''
+        if nodeEntry.pyramid==None:
+            return
+        for historyTable, rowList in zip(nodeEntry.historyTables, nodeEntry.pyramid.pendingList):
+            if len(rowList)==0:
+                continue
+            historyRows=np.empty(len(rowList), dtype=historyTable.dtype)
+            historyRows['timestamp'], historyRows['count'], historyRows['rssiMin'], \
+                historyRows['rssiAvg'], historyRows['rssiMax']=zip(*rowList)
+            historyTable.append(historyRows)
+            #The buckets may start before the first sweep of the segment
+            if self.segmentStartTime==None or historyRows['timestamp'][0]<self.segmentStartTime:
+                self.segmentStartTime=historyRows['timestamp'][0].item()
+            del rowList[:]
+    
+    def write_summary(self, nodeEntry):
+        '''
+        Write the running statistics of the node if they changed since its last
+        summary row and the buckets of its history being filled, used when its
+        session ends or the segment rolls over. The pending rows must be flushed first.
+        The history of a session that continues in the next segment starts new buckets,
+        the buckets split between both segments are merged by ScanArchive.query_history
+        :param nodeEntry: NodeEntry of the node
+        '''
+        if nodeEntry.accumulator.count>nodeEntry.summaryCount:
+            with self.h5FileLock:
+                self.append_summary(nodeEntry, time.time())
+                nodeEntry.summaryTable.flush()
+        if nodeEntry.pyramid!=None:
+            nodeEntry.pyramid.end_all()
+            with self.h5FileLock:
+                self.append_history(nodeEntry)
+                self.h5File.flush()
+    
+    def write_stats(self):
+        '''
+        Return a dictionary with the write statistics of the thread, including the rows
+        per second it sustains while writing, which doesn't depend on the rate of the boards
+        '''
+        rowsPerSec=self.rowsWritten/self.flushTime if self.flushTime>0 else 0.0
+        return {'rowsWritten':self.rowsWritten,
+                'flushCount':self.flushCount,
+                'flushTime':self.flushTime,
+                'rowsPerSec':rowsPerSec,
+                'pendingBytes':self.pendingBytes}
+    
     def join(self, timeout=None):
         self.alive.clear()
-        
\ No newline at end of file
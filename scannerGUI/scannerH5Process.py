@@ -0,0 +1,311 @@
+#!/usr/bin/python
+
+import multiprocessing
+import threading
+import signal
+import time
+import Queue
+import numpy as np
+from scannerH5Backend import H5ScannerThread
+from scannerLiveData import LiveDataChannel, LiveScanData
+from scannerQueue import ScanQueue
+from scannerStats import PipelineStats
+
+#Message sent through the batch pipe to make the writer process exit, discarding its backlog
+EXIT_MESSAGE='exit'
+#Message sent through the batch pipe to make the writer process exit after writing its backlog
+DRAIN_MESSAGE='drain'
+#Gauges of the pipeline measured in the writer process, the stages are all
+#recorded there once the sweeps are written
+WRITER_GAUGES=('pendingRows',)
+
+def pack_scan(scanResults):
+    '''
+    Return the scan results of a board as a plain tuple that can be sent to the writer process,
+    (macAddr, ipAddr, recvOpt, rssiCodes, stageTimes). The sweep is sent as its raw RSSI codes,
+    the dBm values are decoded again in the writer process
+    :param scanResults: ScanResults namedtuple, with rssiData set to None if the board timed out
+    '''
+    if scanResults.rssiData is None:
+        return (scanResults.macAddr, scanResults.ipAddr, None, None, None)
+    stageTimes=tuple(scanResults.stageTimes) if scanResults.stageTimes!=None else None
+    return (scanResults.macAddr, scanResults.ipAddr, tuple(scanResults.recvOpt),
+            scanResults.rssiCodes.tostring(), stageTimes)
+
+def pack_live(liveData):
+    '''
+    Return a LiveScanData namedtuple as a plain tuple that can be sent to the main process
+    '''
+    return tuple(liveData._replace(recvOpt=tuple(liveData.recvOpt)))
+
+def writer_main(batchConn, eventConn, h5Options, queueSize, eventInterval):
+    '''
+    Main function of the writer process. It receives the batches of scan results from
+    the main process and passes them to a H5ScannerThread, and sends back the latest
+    data of each board and the write statistics every eventInterval seconds.
+    It exits on the exit message, discarding the batches not written yet, on the drain
+    message or if the main process closes the pipe, writing them before closing the segment
+    '''
+    #Imported here because scannerUdpBackend imports this module
+    from scannerUdpBackend import UdpScanProt, ScanResults
+    #The main process decides when the writer exits
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    scanQueue=ScanQueue(queueSize, 'block')
+    #The plain channel keeps only the latest update of each board, so the updates are coalesced
+    #between two sends instead of copying every sweep back to the main process
+    liveChannel=LiveDataChannel()
+    pipelineStats=PipelineStats()
+    h5Thread=H5ScannerThread(scanQueue, threading.Lock(), liveChannel=liveChannel,
+                             pipelineStats=pipelineStats, **h5Options)
+
+    def send_events():
+        eventConn.send(('live', [pack_live(liveData) for liveData in liveChannel.poll()]))
+        eventConn.send(('stats', {'write':h5Thread.write_stats(),
+                                  'pipeline':pipelineStats.snapshot(),
+                                  'h5FilePath':h5Thread.h5FilePath}))
+
+    lastEvent=time.time()
+    drain=True
+    while h5Thread.isAlive():
+        try:
+            if batchConn.poll(eventInterval):
+                batch=batchConn.recv()
+                if batch in (EXIT_MESSAGE, DRAIN_MESSAGE):
+                    drain=batch==DRAIN_MESSAGE
+                    break
+                for macAddr, ipAddr, recvOpt, rssiCodes, stageTimes in batch:
+                    if rssiCodes==None:
+                        scanQueue.put(ScanResults(macAddr, ipAddr, None, None, None, None))
+                        continue
+                    rssiCodes=np.frombuffer(rssiCodes, dtype=np.uint8)
+                    scanQueue.put(ScanResults(macAddr, ipAddr, UdpScanProt.Opt(*recvOpt),
+                                              UdpScanProt.rssiDbmLut.take(rssiCodes), rssiCodes,
+                                              list(stageTimes) if stageTimes!=None else None))
+        except (EOFError, IOError):
+            #The main process is gone
+            break
+        if time.time()-lastEvent>=eventInterval:
+            lastEvent=time.time()
+            try:
+                send_events()
+            except IOError:
+                break
+
+    #The H5 thread writes its pending rows and, if it's drained, the backlog before it gets the exit message
+    scanQueue.close(drain)
+    while h5Thread.isAlive():
+        time.sleep(0.01)
+    try:
+        send_events()
+    except IOError:
+        pass
+
+class H5WriterProcess(threading.Thread):
+    '''
+    Runs the H5 backend in a separate process, so the compression and NumPy work of
+    the writes don't compete for the GIL with the receive loop. This thread reads the scan
+    results from the scan queue and sends them in batches of plain tuples through a pipe,
+    and a second thread receives the latest data of each board from the writer process and
+    publishes it in the live channel. If the writer process dies it's restarted, resuming the
+    segment left open, and the sweeps it had not written yet are lost. It provides the same
+    interface to the UDP backend as H5ScannerThread
+    '''
+    
+    def __init__(self, scanQueue, h5FileLock=None, liveChannel=None, pipelineStats=None,
+                 batchSize=64, batchLatency=0.05, eventInterval=0.05, restartDelay=1.0,
+                 queueSize=4096, **h5Options):
+        '''
+        Constructor, starts the writer process and the thread
+        :param scanQueue: ScanQueue where the UDP backend puts the scan results
+        :param h5FileLock: Unused, the H5 file is only accessed by the writer process
+        :param liveChannel: LiveDataChannel where the latest data of each board is published, None to not publish it
+        :param pipelineStats: PipelineStats of the UDP backend, the writer process keeps its own
+        :param batchSize: Maximum amount of scan results sent to the writer process at once
+        :param batchLatency: Maximum time in seconds a scan result waits to be sent to the writer process
+        :param eventInterval: Time in seconds between the updates of the live data and the statistics
+        :param restartDelay: Time in seconds to wait before restarting a writer process that died
+        :param queueSize: Size of the queue between the pipe and the H5 backend inside the writer process
+        :param h5Options: Keyword arguments of the H5ScannerThread of the writer process
+        '''
+        threading.Thread.__init__(self)
+        self.scanQueue=scanQueue
+        self.liveChannel=liveChannel
+        self.pipelineStats=pipelineStats
+        #Functions called with the scan results of every board in this process before they are
+        #sent to the writer process, see UdpScannerServer.add_scan_consumer
+        self.scanConsumers=[]
+        self.batchSize=batchSize
+        self.batchLatency=batchLatency
+        self.eventInterval=eventInterval
+        self.restartDelay=restartDelay
+        self.queueSize=queueSize
+        self.h5Options=h5Options
+        
+        #Latest statistics and segment reported by the writer process
+        self.statsLock=threading.Lock()
+        self.writerStats={'write':{'rowsWritten':0, 'flushCount':0, 'flushTime':0.0, 'rowsPerSec':0.0, 'pendingBytes':0}}
+        self.h5FilePath=None
+        #Supervisor counters
+        self.batchesSent=0
+        self.sweepsLost=0
+        self.restarts=0
+        #The counters of the writer processes that already exited
+        self.rowsWrittenBefore=0
+        
+        self.alive = threading.Event()
+        self.alive.set()
+        self.start_writer(h5Options.get('resume', False))
+        self.start()
+    
+    def start_writer(self, resume):
+        '''
+        Start a new writer process and the thread that receives its events
+        :param resume: If True, the writer process continues the segment left open by the previous one
+        '''
+        h5Options=dict(self.h5Options, resume=resume)
+        batchRecvConn, self.batchConn=multiprocessing.Pipe(duplex=False)
+        eventRecvConn, eventSendConn=multiprocessing.Pipe(duplex=False)
+        self.process=multiprocessing.Process(target=writer_main, name="H5Writer",
+                                             args=(batchRecvConn, eventSendConn, h5Options,
+                                                   self.queueSize, self.eventInterval))
+        self.process.daemon=True
+        self.process.start()
+        #Close the ends used by the writer process, so the pipes report when it dies
+        batchRecvConn.close()
+        eventSendConn.close()
+        self.eventThread=threading.Thread(target=self.receive_events, args=(eventRecvConn,))
+        self.eventThread.daemon=True
+        self.eventThread.start()
+    
+    def restart_writer(self):
+        '''
+        Wait for the writer process that died and start a new one
+        '''
+        self.process.join()
+        self.batchConn.close()
+        self.eventThread.join()
+        print "H5 writer process exited with code", self.process.exitcode, ", restarting it"
+        with self.statsLock:
+            self.rowsWrittenBefore+=self.writerStats['write']['rowsWritten']
+            self.writerStats['write']['rowsWritten']=0
+        self.restarts+=1
+        time.sleep(self.restartDelay)
+        self.start_writer(True)
+    
+    def receive_events(self, eventConn):
+        '''
+        Main loop of the event thread of a writer process, publishes the latest
+        data of the boards in the live channel and stores the statistics
+        :param eventConn: Pipe end where the writer process sends its events
+        '''
+        #Imported here because scannerUdpBackend imports this module
+        from scannerUdpBackend import UdpScanProt
+        while True:
+            try:
+                eventType, eventData=eventConn.recv()
+            except (EOFError, IOError):
+                break
+            if eventType=='live':
+                if self.liveChannel!=None:
+                    for liveData in eventData:
+                        liveData=LiveScanData(*liveData)
+                        self.liveChannel.publish(liveData._replace(recvOpt=UdpScanProt.Opt(*liveData.recvOpt)))
+            elif eventType=='stats':
+                with self.statsLock:
+                    self.writerStats=eventData
+                    self.h5FilePath=eventData['h5FilePath']
+        eventConn.close()
+    
+    def send_batch(self, batch):
+        '''
+        Send a batch of packed scan results to the writer process,
+        restarting it if it died. The batch is lost if the send fails
+        :param batch: List of tuples returned by pack_scan
+        '''
+        try:
+            self.batchConn.send(batch)
+            self.batchesSent+=1
+            return
+        except IOError:
+            self.sweepsLost+=len(batch)
+        self.restart_writer()
+    
+    def run(self):
+        '''
+        Main loop of the thread, reads the scan queue and sends the scan results to the writer
+        process once the batch is full or its oldest item waited batchLatency seconds
+        '''
+        batch=[]
+        batchStart=None
+        while self.alive.isSet():
+            if not self.process.is_alive():
+                self.sweepsLost+=len(batch)
+                batch=[]
+                self.restart_writer()
+            timeout=self.batchLatency if batchStart==None else max(0.0, batchStart+self.batchLatency-time.time())
+            try:
+                qResult=self.scanQueue.get(block=True, timeout=timeout)
+            except Queue.Empty:
+                qResult=None
+            
+            if qResult==ScanQueue.exitMessage:
+                self.alive.clear()
+                break
+            if qResult!=None:
+                if self.pipelineStats!=None:
+                    self.pipelineStats.gauges['scanDataQueue'].record(self.scanQueue.qsize())
+                for consumer in self.scanConsumers:
+                    consumer(qResult)
+                batch.append(pack_scan(qResult))
+                if batchStart==None:
+                    batchStart=time.time()
+            if len(batch)>=self.batchSize or (len(batch)>0 and time.time()-batchStart>=self.batchLatency):
+                self.send_batch(batch)
+                batch=[]
+                batchStart=None
+        
+        #Send what is left if the queue is drained and wait for the writer process to close the segment
+        try:
+            if self.scanQueue.drainOnClose:
+                if len(batch)>0:
+                    self.batchConn.send(batch)
+                self.batchConn.send(DRAIN_MESSAGE)
+            else:
+                self.batchConn.send(EXIT_MESSAGE)
+        except IOError:
+            pass
+        self.process.join()
+        self.eventThread.join()
+        self.batchConn.close()
+    
+    def write_stats(self):
+        '''
+        Return a dictionary with the write statistics last reported by the writer process,
+        with the rows written by all the writer processes and the supervisor counters
+        '''
+        with self.statsLock:
+            writeStats=dict(self.writerStats['write'])
+        writeStats['rowsWritten']+=self.rowsWrittenBefore
+        writeStats['batchesSent']=self.batchesSent
+        writeStats['sweepsLost']=self.sweepsLost
+        writeStats['restarts']=self.restarts
+        return writeStats
+    
+    def merge_pipeline(self, snapshot):
+        '''
+        Replace the stages and the gauges of a pipeline snapshot of the main process
+        that are measured in the writer process with the last ones it reported
+        :param snapshot: Dictionary returned by PipelineStats.snapshot()
+        '''
+        with self.statsLock:
+            writerSnapshot=self.writerStats.get('pipeline')
+        if writerSnapshot==None:
+            return snapshot
+        snapshot['stages']=writerSnapshot['stages']
+        for gaugeName in WRITER_GAUGES:
+            snapshot['gauges'][gaugeName]=writerSnapshot['gauges'][gaugeName]
+        return snapshot
+    
+    def join(self, timeout=None):
+        self.alive.clear()
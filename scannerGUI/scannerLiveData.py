@@ -0,0 +1,63 @@
+#!/usr/bin/python
+
+import collections
+import threading
+
+#Namedtuple with the latest state of a board, as published by the backend.
+#rssiMin, rssiAvg and rssiMax cover the whole session, windowStats is a dictionary
+#with the WindowStats of the recent sweeps, see scannerWindowStats.SpectrumWindows
+LiveScanData=collections.namedtuple('LiveScanData', 'macAddr ipAddr isAlive joinTime timestamp recvOpt \
+                                    rssiData rssiMin rssiAvg rssiMax windowStats')
+
+class LiveDataChannel():
+    '''
+    In-process publish/subscribe channel that carries the latest spectrum and
+    status of each board from the backend to the graphical interface.
+    Only the newest update of each board is kept, so a slow reader
+    gets the updates coalesced instead of a growing backlog
+    '''
+
+    def __init__(self):
+        self.lock=threading.Lock()
+        #Latest state of every board known, indexed by MAC address
+        self.latestDict={}
+        #MAC addresses of the boards updated since the last poll
+        self.updatedSet=set()
+
+    def publish(self, liveData):
+        '''
+        Publish the latest state of a board, replacing any update not yet read
+        :param liveData: LiveScanData namedtuple, its arrays must not be modified afterwards
+        '''
+        with self.lock:
+            self.latestDict[liveData.macAddr]=liveData
+            self.updatedSet.add(liveData.macAddr)
+
+    def publish_status(self, macAddr, isAlive):
+        '''
+        Publish a change in the status of a board, keeping its latest spectrum
+        :param macAddr: MAC address of the board
+        :param isAlive: False if the board timed out
+        '''
+        with self.lock:
+            liveData=self.latestDict.get(macAddr)
+            if liveData!=None and liveData.isAlive!=isAlive:
+                self.latestDict[macAddr]=liveData._replace(isAlive=isAlive)
+                self.updatedSet.add(macAddr)
+
+    def poll(self):
+        '''
+        Return a list with the latest state of every board updated since the last poll
+        '''
+        with self.lock:
+            updateList=[self.latestDict[macAddr] for macAddr in self.updatedSet]
+            self.updatedSet.clear()
+        return updateList
+
+    def get(self, macAddr):
+        '''
+        Return the latest state of a board, or None if it's unknown
+        :param macAddr: MAC address of the board
+        '''
+        with self.lock:
+            return self.latestDict.get(macAddr)
@@ -0,0 +1,233 @@
+#!/usr/bin/python
+
+import collections
+import threading
+import time
+import numpy as np
+
+#Bands where the free channels are searched, as (bandName, lowFreq, highFreq, channelWidth)
+#in MHz. The defaults are the sub-GHz ISM/SRD bands within the tuning range of the boards
+DFLT_BAND_PLAN=[("CN779", 779.0, 787.0, 1.0),
+                ("EU868", 863.0, 870.0, 1.0),
+                ("US915", 902.0, 928.0, 1.0)]
+
+#Change in the state of a channel seen by a board. The channels of a new board
+#start as free, isFree is None once the board times out or changes its scan options
+ChannelChange=collections.namedtuple('ChannelChange', 'macAddr bandName lowFreq highFreq isFree timestamp')
+
+class ChannelLayout():
+    '''
+    Mapping between the RSSI values of a sweep and the channels of the band plan.
+    The values of a sweep are split in consecutive segments that are either a channel
+    or a gap between channels, so the occupied values of every channel are counted
+    with a single np.add.reduceat over the whole sweep
+    '''
+    
+    def __init__(self, freqStart, freqRes, amtRssiValues, bandPlan):
+        '''
+        Constructor
+        :param freqStart: Start frequency of the sweep in MHz
+        :param freqRes: Frequency resolution of the sweep in KHz
+        :param amtRssiValues: Amount of RSSI values of each sweep
+        :param bandPlan: List of (bandName, lowFreq, highFreq, channelWidth), sorted by frequency
+        '''
+        binFreqs=freqStart+np.arange(amtRssiValues)*freqRes/1000.0
+        #(bandName, lowFreq, highFreq) of each channel with at least one value of the sweep
+        self.channelList=[]
+        segmentStarts=[0]
+        isChannelList=[]
+        for bandName, lowFreq, highFreq, channelWidth in bandPlan:
+            amtChannels=int(round((highFreq-lowFreq)/channelWidth))
+            for channelNumber in range(amtChannels):
+                channelLow=lowFreq+channelNumber*channelWidth
+                channelHigh=channelLow+channelWidth
+                firstBin=int(np.searchsorted(binFreqs, channelLow, side='left'))
+                stopBin=int(np.searchsorted(binFreqs, channelHigh, side='left'))
+                if stopBin<=firstBin:
+                    continue
+                if firstBin>segmentStarts[-1]:
+                    #Gap since the end of the previous channel
+                    isChannelList.append(False)
+                    segmentStarts.append(firstBin)
+                isChannelList.append(True)
+                segmentStarts.append(stopBin)
+                self.channelList.append((bandName, channelLow, channelHigh))
+        #Values after the last channel
+        isChannelList.append(False)
+        if segmentStarts[-1]>=amtRssiValues:
+            segmentStarts.pop()
+            isChannelList.pop()
+        self.segmentStarts=np.array(segmentStarts, dtype=np.intp)
+        self.channelMask=np.array(isChannelList, dtype=bool)
+        segmentLens=np.diff(np.append(self.segmentStarts, amtRssiValues))
+        self.binsPerChannel=segmentLens[self.channelMask]
+    
+class BoardOccupancy():
+    '''
+    Occupancy state of the values and the channels seen by a board
+    '''
+    
+    def __init__(self, layout, rssiData):
+        '''
+        Constructor, the noise floor starts flat at the median of the first sweep,
+        most of the band is expected to be free, and then adapts to each frequency
+        :param layout: ChannelLayout of the scan options of the board
+        :param rssiData: First sweep of the board in dBm
+        '''
+        self.layout=layout
+        self.noiseFloor=np.empty(len(rssiData), dtype=np.float32)
+        self.noiseFloor.fill(np.median(rssiData))
+        self.occupied=np.zeros(len(rssiData), dtype=bool)
+        #The channels start as free, the ones seen occupied are published on the first sweep
+        self.channelFree=np.ones(len(layout.channelList), dtype=bool)
+        #Free channels of each band, updated only with the changes
+        self.freeDict=collections.defaultdict(set)
+        for channelIndex, (bandName, _, _) in enumerate(layout.channelList):
+            self.freeDict[bandName].add(channelIndex)
+    
+class OccupancyEngine():
+    '''
+    Streaming classification of the spectrum seen by each board. A value is occupied when it
+    rises onMargin dB over the noise floor of its frequency and free again when it falls
+    under offMargin dB over it. The noise floor of every value follows the free values with an
+    exponential average that falls faster than it rises, so carriers don't raise it. A channel
+    is occupied when more than occupiedFraction of its values are. The work per sweep is a
+    few vectorized operations over the sweep, only the channels that change are handled
+    one by one and published as ChannelChange to be read with poll()
+    '''
+    
+    def __init__(self, bandPlan=DFLT_BAND_PLAN, onMargin=10.0, offMargin=6.0, occupiedFraction=0.2,
+                 riseRate=0.01, fallRate=0.2, maxChanges=65536):
+        '''
+        Constructor
+        :param bandPlan: List of (bandName, lowFreq, highFreq, channelWidth) in MHz,
+        the channels of a band are contiguous and channelWidth wide
+        :param onMargin: dB over the noise floor for a free value to become occupied
+        :param offMargin: dB over the noise floor under which an occupied value becomes free
+        :param occupiedFraction: Fraction of occupied values over which a channel is occupied
+        :param riseRate: Weight of a new sweep in the noise floor when it's over the floor
+        :param fallRate: Weight of a new sweep in the noise floor when it's under the floor
+        :param maxChanges: Maximum amount of changes kept until they are polled, the oldest are discarded
+        '''
+        self.bandPlan=sorted(bandPlan, key=lambda band: band[1])
+        self.onMargin=np.float32(onMargin)
+        self.offMargin=np.float32(offMargin)
+        self.occupiedFraction=occupiedFraction
+        self.riseRate=np.float32(riseRate)
+        self.fallRate=np.float32(fallRate)
+        #Layouts shared by all the boards with the same frequency settings
+        self.layoutDict={}
+        self.boardDict={}
+        self.lock=threading.Lock()
+        self.changeDeque=collections.deque(maxlen=maxChanges)
+        self.changesDiscarded=0
+    
+    def get_layout(self, scanOpt, amtRssiValues):
+        '''
+        Return the ChannelLayout of a sweep, created once for each frequency setting
+        :param scanOpt: UdpScanProt.Opt namedtuple with the scan options
+        :param amtRssiValues: Amount of RSSI values of each sweep
+        '''
+        layoutKey=(scanOpt.freqStartMhz, scanOpt.freqStartKhz, scanOpt.freqRes, amtRssiValues)
+        layout=self.layoutDict.get(layoutKey)
+        if layout==None:
+            freqStart=scanOpt.freqStartMhz+scanOpt.freqStartKhz/1000.0
+            layout=ChannelLayout(freqStart, scanOpt.freqRes, amtRssiValues, self.bandPlan)
+            self.layoutDict[layoutKey]=layout
+        return layout
+    
+    def update(self, scanResults, now=None):
+        '''
+        Classify a new sweep of a board, meant to be added as a scan consumer of the UDP backend
+        :param scanResults: ScanResults namedtuple, with rssiData set to None if the board timed out
+        :param now: Timestamp of the changes, None for the current time
+        '''
+        if now==None:
+            now=time.time()
+        macAddr=scanResults.macAddr
+        if scanResults.rssiData is None:
+            self.remove_board(macAddr, now)
+            return
+        rssiData=scanResults.rssiData
+        layout=self.get_layout(scanResults.recvOpt, len(rssiData))
+        board=self.boardDict.get(macAddr)
+        if board==None or board.layout is not layout:
+            #The channels seen with the previous scan options are no longer known
+            if board!=None:
+                self.remove_board(macAddr, now)
+            board=BoardOccupancy(layout, rssiData)
+            with self.lock:
+                self.boardDict[macAddr]=board
+        
+        #Hysteresis, the occupied values need to fall under the lower margin to be free again
+        threshold=board.noiseFloor+np.where(board.occupied, self.offMargin, self.onMargin)
+        np.greater(rssiData, threshold, out=board.occupied)
+        #Only the free values update the noise floor
+        delta=rssiData-board.noiseFloor
+        rate=np.where(delta<0, self.fallRate, self.riseRate)
+        rate[board.occupied]=0
+        board.noiseFloor+=rate*delta
+        
+        if len(layout.channelList)==0:
+            return
+        occupiedBins=np.add.reduceat(board.occupied.view(np.uint8), layout.segmentStarts)[layout.channelMask]
+        channelFree=occupiedBins<=self.occupiedFraction*layout.binsPerChannel
+        changedList=np.flatnonzero(channelFree!=board.channelFree)
+        if len(changedList)==0:
+            return
+        board.channelFree=channelFree
+        with self.lock:
+            for channelIndex in changedList:
+                bandName, lowFreq, highFreq=layout.channelList[channelIndex]
+                isFree=bool(channelFree[channelIndex])
+                if isFree:
+                    board.freeDict[bandName].add(channelIndex)
+                else:
+                    board.freeDict[bandName].discard(channelIndex)
+                self.add_change(ChannelChange(macAddr, bandName, lowFreq, highFreq, isFree, now))
+    
+    def remove_board(self, macAddr, now):
+        '''
+        Forget the state of a board, publishing its channels as unknown
+        :param macAddr: MAC address of the board
+        :param now: Timestamp of the changes
+        '''
+        with self.lock:
+            board=self.boardDict.pop(macAddr, None)
+            if board==None:
+                return
+            for bandName, lowFreq, highFreq in board.layout.channelList:
+                self.add_change(ChannelChange(macAddr, bandName, lowFreq, highFreq, None, now))
+    
+    def add_change(self, change):
+        '''
+        Queue a change to be polled, must be called with the lock held
+        '''
+        if len(self.changeDeque)==self.changeDeque.maxlen:
+            self.changesDiscarded+=1
+        self.changeDeque.append(change)
+    
+    def poll(self):
+        '''
+        Return the list of ChannelChange since the last poll, oldest first
+        '''
+        with self.lock:
+            changeList=list(self.changeDeque)
+            self.changeDeque.clear()
+        return changeList
+    
+    def free_channels(self, macAddr, bandName=None):
+        '''
+        Return the sorted list of (bandName, lowFreq, highFreq) of the free channels seen by a board
+        :param macAddr: MAC address of the board
+        :param bandName: Name of the band, None for all the bands
+        '''
+        with self.lock:
+            board=self.boardDict.get(macAddr)
+            if board==None:
+                return []
+            if bandName!=None:
+                indexList=list(board.freeDict.get(bandName, ()))
+            else:
+                indexList=[channelIndex for freeSet in board.freeDict.values() for channelIndex in freeSet]
+            return [board.layout.channelList[channelIndex] for channelIndex in sorted(indexList)]
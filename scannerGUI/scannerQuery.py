@@ -0,0 +1,297 @@
+#!/usr/bin/python
+import argparse
+import collections
+import math
+import numpy as np
+import tables as tb
+from scannerH5Backend import rssi_codes_to_dbm
+from scannerSegments import SegmentManifest
+
+#Sweeps of a board in a time window, with a single frequency axis.
+#timestamps has one value per row of rssiDbm and freqValues one per column, in MHz
+ScanBlock=collections.namedtuple('ScanBlock', 'macAddr timestamps freqValues rssiDbm scanOpt')
+#Statistics of the sweeps of a board in buckets of bucketTime seconds, timestamps has the start
+#of each bucket and count its amount of sweeps. bucketTime is 0 if they are the sweeps themselves
+HistoryBlock=collections.namedtuple('HistoryBlock', 'macAddr timestamps freqValues rssiMin rssiAvg rssiMax count bucketTime scanOpt')
+#Fields of the blocks with a value per row, concatenated when the blocks are joined
+ROW_FIELDS=('timestamps', 'rssiDbm', 'rssiMin', 'rssiAvg', 'rssiMax', 'count')
+
+def freq_bin_slice(freqStart, freqStop, freqRes, amtRssiValues, lowFreq=None, highFreq=None):
+    '''
+    Return the slice of the RSSI values of a sweep between two frequencies.
+    The value i of a sweep is measured at freqStart+i*freqRes
+    :param freqStart: Start frequency of the sweep in MHz
+    :param freqStop: Stop frequency of the sweep in MHz
+    :param freqRes: Frequency resolution of the sweep in KHz
+    :param amtRssiValues: Amount of RSSI values of each sweep
+    :param lowFreq: Lowest frequency in MHz, None for the start of the sweep
+    :param highFreq: Highest frequency in MHz, None for the stop of the sweep
+    '''
+    freqStep=freqRes/1000.0
+    firstBin=0
+    lastBin=amtRssiValues
+    #A small tolerance avoids losing the bins at the limits to rounding errors of the float32 columns
+    if lowFreq!=None:
+        firstBin=max(firstBin, int(math.ceil((lowFreq-freqStart)/freqStep-1e-3)))
+    if highFreq!=None:
+        lastBin=min(lastBin, int(math.floor((highFreq-freqStart)/freqStep+1e-3))+1)
+    return slice(firstBin, max(firstBin, lastBin))
+
+class ScanArchive():
+    '''
+    Read access to the scan data stored by the H5 backend. The segments of the time
+    window and board of a query are found in the manifest of the data folder, the rows
+    of each session are found with the index of its timestamp column and only the
+    requested frequency bins are converted to dBm. The rows of a table are stored as
+    compound records, so the whole sweep of each row in the window is read from disk
+    '''
+    
+    def __init__(self, h5Dir="data", prefix="scanData", pathList=None):
+        '''
+        Constructor
+        :param h5Dir: Folder of the segment files and their manifest
+        :param prefix: Prefix of the names of the segment files
+        :param pathList: Scan files to query instead of the segments of the manifest,
+        such as the files written before the data was split in segments
+        '''
+        self.pathList=pathList
+        self.manifest=None
+        if pathList==None:
+            self.manifest=SegmentManifest(h5Dir, prefix)
+    
+    def find_files(self, macAddr, startTime, endTime):
+        '''
+        Return the paths of the files that may hold sweeps of the board in the time window
+        '''
+        if self.manifest!=None:
+            return self.manifest.find_segments(macAddr, startTime, endTime)
+        return self.pathList
+    
+    @staticmethod
+    def row_range(table, startTime, endTime):
+        '''
+        Return the (start, stop) range of the rows of a session table in the time window.
+        The rows are appended in time order, so the rows in the window are consecutive
+        :param table: Session table
+        :param startTime: Start of the time window, None for no lower limit
+        :param endTime: End of the time window, None for no upper limit
+        '''
+        if table.nrows==0:
+            return 0, 0
+        conditionList=[]
+        if startTime!=None:
+            conditionList.append("(timestamp>=startTime)")
+        if endTime!=None:
+            conditionList.append("(timestamp<=endTime)")
+        if len(conditionList)==0:
+            return 0, table.nrows
+        if table.coldescrs['timestamp'].shape==():
+            #The index of the column is used if the segment was indexed when it was closed
+            rowList=table.getWhereList("&".join(conditionList),
+                                       condvars={'timestamp':table.cols.timestamp,
+                                                 'startTime':startTime, 'endTime':endTime})
+            if len(rowList)==0:
+                return 0, 0
+            return int(rowList[0]), int(rowList[-1])+1
+        #The timestamps of the older files have shape (1,) and can't be used in conditions
+        timestamps=table.col('timestamp').reshape(-1)
+        start=0 if startTime==None else int(np.searchsorted(timestamps, startTime, side='left'))
+        stop=table.nrows if endTime==None else int(np.searchsorted(timestamps, endTime, side='right'))
+        return start, max(start, stop)
+    
+    def read_session(self, table, macAddr, startTime, endTime, lowFreq, highFreq):
+        '''
+        Return the ScanBlock of the sweeps of a session table in the time
+        window and frequency range, None if there are none
+        '''
+        start, stop=self.row_range(table, startTime, endTime)
+        if stop<=start:
+            return None
+        scanOpt=tuple(table.attrs.scanOpt)
+        freqStart, freqStop, freqRes=[float(value) for value in scanOpt[:3]]
+        amtRssiValues=table.coldescrs['rssiCodes'].shape[0]
+        binSlice=freq_bin_slice(freqStart, freqStop, freqRes, amtRssiValues, lowFreq, highFreq)
+        if binSlice.stop<=binSlice.start:
+            return None
+        rssiCodes=table.read(start=start, stop=stop, field='rssiCodes')[:, binSlice]
+        timestamps=table.read(start=start, stop=stop, field='timestamp').reshape(-1)
+        freqValues=freqStart+np.arange(binSlice.start, binSlice.stop)*freqRes/1000.0
+        return ScanBlock(macAddr, timestamps, freqValues, rssi_codes_to_dbm(rssiCodes, table), scanOpt)
+    
+    def read_history(self, table, historyTable, bucketTime, macAddr, startTime, endTime, lowFreq, highFreq):
+        '''
+        Return the HistoryBlock of the buckets of a history table that overlap the
+        time window, in the frequency range, None if there are none
+        '''
+        #The bucket that started before the window holds its first sweeps
+        start, stop=self.row_range(historyTable, startTime-bucketTime, endTime)
+        if stop>start and historyTable.read(start=start, stop=start+1, field='timestamp')[0]<=startTime-bucketTime:
+            #That bucket ended right at the start of the window
+            start+=1
+        if stop<=start:
+            return None
+        scanOpt=tuple(table.attrs.scanOpt)
+        freqStart, freqStop, freqRes=[float(value) for value in scanOpt[:3]]
+        amtRssiValues=table.coldescrs['rssiCodes'].shape[0]
+        binSlice=freq_bin_slice(freqStart, freqStop, freqRes, amtRssiValues, lowFreq, highFreq)
+        if binSlice.stop<=binSlice.start:
+            return None
+        historyRows=historyTable.read(start=start, stop=stop)
+        freqValues=freqStart+np.arange(binSlice.start, binSlice.stop)*freqRes/1000.0
+        return HistoryBlock(macAddr, historyRows['timestamp'], freqValues, historyRows['rssiMin'][:, binSlice],
+                            historyRows['rssiAvg'][:, binSlice], historyRows['rssiMax'][:, binSlice],
+                            historyRows['count'], bucketTime, scanOpt)
+    
+    def query(self, macAddr, startTime=None, endTime=None, lowFreq=None, highFreq=None):
+        '''
+        Return the sweeps of a board in a time window and frequency range as a list
+        of ScanBlock sorted by time. Consecutive sessions with the same frequency bins,
+        such as a session split in several segments, are joined in a single block
+        :param macAddr: MAC address of the board
+        :param startTime: Start of the time window, None for no lower limit
+        :param endTime: End of the time window, None for no upper limit
+        :param lowFreq: Lowest frequency in MHz, None for the start of each sweep
+        :param highFreq: Highest frequency in MHz, None for the stop of each sweep
+        '''
+        blockList=[]
+        for h5FilePath in self.find_files(macAddr, startTime, endTime):
+            h5File=tb.openFile(h5FilePath, mode="r")
+            try:
+                for group in h5File.iterNodes(h5File.root.scannerNodes, classname='Group'):
+                    if group._v_attrs.macAddr!=macAddr:
+                        continue
+                    for table in h5File.iterNodes(group, classname='Table'):
+                        if 'rssiCodes' not in table.colnames:
+                            continue
+                        block=self.read_session(table, macAddr, startTime, endTime, lowFreq, highFreq)
+                        if block!=None:
+                            blockList.append(block)
+            finally:
+                h5File.close()
+        blockList.sort(key=lambda block: block.timestamps[0])
+        return self.join_blocks(blockList)
+    
+    def query_history(self, macAddr, startTime, endTime, maxRows=500, lowFreq=None, highFreq=None):
+        '''
+        Return the statistics of the sweeps of a board in a time window and frequency range
+        as a list of HistoryBlock sorted by time. They are read from the coarsest level of the
+        history of each session with at least maxRows buckets in the window, so a view maxRows
+        pixels wide is filled reading about maxRows rows instead of every sweep. The sweeps
+        themselves are read if no level is that fine, or if the session has no history.
+        The buckets split between two segments are merged
+        :param macAddr: MAC address of the board
+        :param startTime: Start of the time window
+        :param endTime: End of the time window
+        :param maxRows: Amount of rows that fills the view
+        :param lowFreq: Lowest frequency in MHz, None for the start of each sweep
+        :param highFreq: Highest frequency in MHz, None for the stop of each sweep
+        '''
+        blockList=[]
+        for h5FilePath in self.find_files(macAddr, startTime, endTime):
+            h5File=tb.openFile(h5FilePath, mode="r")
+            try:
+                for group in h5File.iterNodes(h5File.root.scannerNodes, classname='Group'):
+                    if group._v_attrs.macAddr!=macAddr:
+                        continue
+                    for table in h5File.iterNodes(group, classname='Table'):
+                        if 'rssiCodes' not in table.colnames:
+                            continue
+                        levelList=[]
+                        #The sessions written before the history was added have neither attribute
+                        if 'historyLevels' in table.attrs and 'historyTables' in table.attrs:
+                            levelList=[(bucketTime, tableName) for bucketTime, tableName
+                                       in zip(table.attrs.historyLevels, table.attrs.historyTables)
+                                       if (endTime-startTime)/bucketTime>=maxRows]
+                        if len(levelList)>0:
+                            bucketTime, tableName=levelList[-1]
+                            block=self.read_history(table, h5File.getNode(group, tableName), bucketTime,
+                                                    macAddr, startTime, endTime, lowFreq, highFreq)
+                        else:
+                            block=self.read_session(table, macAddr, startTime, endTime, lowFreq, highFreq)
+                            if block!=None:
+                                block=HistoryBlock(macAddr, block.timestamps, block.freqValues, block.rssiDbm, block.rssiDbm,
+                                                   block.rssiDbm, np.ones(len(block.timestamps), np.uint64), 0.0, block.scanOpt)
+                        if block!=None:
+                            blockList.append(block)
+            finally:
+                h5File.close()
+        blockList.sort(key=lambda block: block.timestamps[0])
+        return [self.merge_buckets(block) for block in self.join_blocks(blockList)]
+    
+    @staticmethod
+    def merge_buckets(block):
+        '''
+        Merge the consecutive rows of a HistoryBlock that belong to the same bucket,
+        written in two segments because the segment rolled over while the bucket was being filled
+        '''
+        if block.bucketTime==0 or len(block.timestamps)<2:
+            return block
+        bucketStarts=np.flatnonzero(np.concatenate(([True], np.diff(block.timestamps)>0)))
+        if len(bucketStarts)==len(block.timestamps):
+            return block
+        count=np.add.reduceat(block.count, bucketStarts)
+        rssiSum=np.add.reduceat(block.rssiAvg*block.count[:, np.newaxis].astype(np.float64), bucketStarts, axis=0)
+        return block._replace(timestamps=block.timestamps[bucketStarts], count=count,
+                              rssiMin=np.minimum.reduceat(block.rssiMin, bucketStarts, axis=0),
+                              rssiAvg=(rssiSum/count[:, np.newaxis]).astype(np.float32),
+                              rssiMax=np.maximum.reduceat(block.rssiMax, bucketStarts, axis=0))
+    
+    @staticmethod
+    def join_blocks(blockList):
+        '''
+        Join the consecutive blocks of a time sorted list that share the frequency bins,
+        and the bucket length in the case of HistoryBlock
+        '''
+        joinedList=[]
+        partList=[]
+        for block in blockList:
+            if len(partList)>0 and (not np.array_equal(partList[-1].freqValues, block.freqValues)
+                                    or getattr(partList[-1], 'bucketTime', None)!=getattr(block, 'bucketTime', None)):
+                joinedList.append(ScanArchive.concat_blocks(partList))
+                partList=[]
+            partList.append(block)
+        if len(partList)>0:
+            joinedList.append(ScanArchive.concat_blocks(partList))
+        return joinedList
+    
+    @staticmethod
+    def concat_blocks(partList):
+        '''
+        Return a single block with the sweeps of the blocks of the list
+        '''
+        if len(partList)==1:
+            return partList[0]
+        return partList[0]._replace(**dict((field, np.concatenate([getattr(block, field) for block in partList]))
+                                           for field in partList[0]._fields if field in ROW_FIELDS))
+    
+if __name__=='__main__':
+    parser = argparse.ArgumentParser(description="Extract the sweeps of a board in a time window and \
+frequency range from the scan data and store them in a .npz file")
+    parser.add_argument("macAddr", help="MAC address of the board")
+    parser.add_argument("-d", "--dataDir", help="Folder of the scan segments", default="data", metavar="dir")
+    parser.add_argument("-i", "--input", help="Scan files to query instead of the segments of the folder", nargs='+', metavar="h5File")
+    parser.add_argument("-s", "--startTime", help="Start of the time window as a UNIX timestamp", type=float, metavar="time")
+    parser.add_argument("-e", "--endTime", help="End of the time window as a UNIX timestamp", type=float, metavar="time")
+    parser.add_argument("-f", "--freqRange", help="Frequency range in MHz", type=float, nargs=2, metavar=("low", "high"))
+    parser.add_argument("-r", "--maxRows", help="Read the statistics of the coarsest level of the history with at least \
+this amount of rows in the time window instead of the sweeps, requires the time window", type=int, metavar="rows")
+    parser.add_argument("-o", "--output", help="Output .npz file", default="scanQuery.npz", metavar="file")
+    args=parser.parse_args()
+    
+    archive=ScanArchive(args.dataDir, pathList=args.input)
+    lowFreq, highFreq=args.freqRange if args.freqRange else (None, None)
+    if args.maxRows!=None:
+        if args.startTime==None or args.endTime==None:
+            parser.error("--maxRows requires --startTime and --endTime")
+        blockList=archive.query_history(args.macAddr, args.startTime, args.endTime, args.maxRows, lowFreq, highFreq)
+    else:
+        blockList=archive.query(args.macAddr, args.startTime, args.endTime, lowFreq, highFreq)
+    outputDict={}
+    for blockNumber, block in enumerate(blockList):
+        rowType="sweeps" if getattr(block, 'bucketTime', 0)==0 else "buckets of %g s" % block.bucketTime
+        print "Block", blockNumber, ":", len(block.timestamps), rowType, "of", len(block.freqValues), \
+            "RSSI values from", block.freqValues[0], "to", block.freqValues[-1], "MHz"
+        for field in block._fields:
+            if field in ROW_FIELDS or field=='freqValues':
+                outputDict['%s%d' % (field, blockNumber)]=getattr(block, field)
+    np.savez(args.output, **outputDict)
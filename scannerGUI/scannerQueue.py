@@ -0,0 +1,164 @@
+#!/usr/bin/python
+
+import collections
+import threading
+import Queue
+
+class ScanQueue():
+    '''
+    Bounded queue that passes the scan results from the UDP backend to the H5 backend.
+    When the queue is full, the policy decides what happens with a new sweep:
+    'block' waits until the writer makes room, 'dropOldest' discards the oldest sweep and
+    'latest' keeps only the newest pending sweep of each board, replacing it in place.
+    Closing the queue stops new items and the exit message jumps ahead of the pending
+    items, which are discarded, unless the queue is closed to drain them first.
+    It keeps the get()/qsize() interface of Queue.Queue, raising Queue.Empty on timeout
+    '''
+    policies=('block', 'dropOldest', 'latest')
+    #Message returned by get() once the queue is closed
+    exitMessage='exit'
+    
+    def __init__(self, maxSize=4096, policy='block'):
+        '''
+        Constructor
+        :param maxSize: Maximum amount of pending items
+        :param policy: What to do with a new sweep when the queue is full, one of ScanQueue.policies
+        '''
+        if policy not in self.policies:
+            raise ValueError("Unknown queue policy "+str(policy)+", expected one of "+", ".join(self.policies))
+        if maxSize<1:
+            raise ValueError("The queue needs room for at least one item")
+        self.maxSize=maxSize
+        self.policy=policy
+        #Each pending item is a one element list, so the 'latest' policy can replace its content in place
+        self.itemDeque=collections.deque()
+        #Slot of the pending sweep of each board, only used by the 'latest' policy
+        self.latestSlotDict={}
+        self.closed=False
+        #True if the reader gets the pending items before the exit message
+        self.drainOnClose=False
+        self.mutex=threading.Lock()
+        self.notEmpty=threading.Condition(self.mutex)
+        self.notFull=threading.Condition(self.mutex)
+        #Counters
+        self.putCount=0
+        self.dropped=0
+        self.coalesced=0
+        self.blockedPuts=0
+        self.discardedOnExit=0
+    
+    def put(self, scanResults):
+        '''
+        Add the scan results of a board to the queue, applying the policy if it's full.
+        Items put after the queue is closed are discarded
+        :param scanResults: ScanResults namedtuple, with rssiData set to None if the board timed out
+        '''
+        with self.mutex:
+            if self.closed:
+                self.discardedOnExit+=1
+                return
+            self.putCount+=1
+            #Status messages are never coalesced, only the sweeps of a board
+            isSweep=scanResults.rssiData is not None
+            if self.policy=='latest':
+                if isSweep:
+                    slot=self.latestSlotDict.get(scanResults.macAddr)
+                    if slot!=None:
+                        slot[0]=scanResults
+                        self.coalesced+=1
+                        return
+                else:
+                    #The sweeps after a timeout must not replace the ones before it
+                    self.latestSlotDict.pop(scanResults.macAddr, None)
+            if len(self.itemDeque)>=self.maxSize:
+                if self.policy=='block':
+                    self.blockedPuts+=1
+                    while len(self.itemDeque)>=self.maxSize and not self.closed:
+                        self.notFull.wait()
+                    if self.closed:
+                        self.discardedOnExit+=1
+                        return
+                else:
+                    self.drop_oldest()
+            slot=[scanResults]
+            self.itemDeque.append(slot)
+            if self.policy=='latest' and isSweep:
+                self.latestSlotDict[scanResults.macAddr]=slot
+            self.notEmpty.notify()
+    
+    def drop_oldest(self):
+        '''
+        Discard the oldest pending item, must be called with the mutex held
+        '''
+        slot=self.itemDeque.popleft()
+        self.forget_slot(slot)
+        self.dropped+=1
+    
+    def forget_slot(self, slot):
+        '''
+        Remove the slot from the pending sweeps of its board if it's still there,
+        must be called with the mutex held
+        '''
+        macAddr=slot[0].macAddr
+        if self.latestSlotDict.get(macAddr) is slot:
+            del self.latestSlotDict[macAddr]
+    
+    def get(self, block=True, timeout=None):
+        '''
+        Remove and return the oldest item, or the exit message if the queue was closed and it's empty
+        :param block: If False, raise Queue.Empty at once if there are no items
+        :param timeout: Maximum time to wait in seconds, None to wait forever
+        '''
+        with self.mutex:
+            if not self.closed and len(self.itemDeque)==0:
+                if not block:
+                    raise Queue.Empty
+                self.notEmpty.wait(timeout)
+                if not self.closed and len(self.itemDeque)==0:
+                    raise Queue.Empty
+            #The pending items of a closed queue are only left if it's drained
+            if len(self.itemDeque)==0:
+                return self.exitMessage
+            slot=self.itemDeque.popleft()
+            if self.policy=='latest':
+                self.forget_slot(slot)
+            self.notFull.notify()
+            return slot[0]
+    
+    def qsize(self):
+        '''
+        Return the amount of pending items
+        '''
+        with self.mutex:
+            return len(self.itemDeque)
+    
+    def close(self, drain=False):
+        '''
+        Close the queue, the items put afterwards are discarded. Any put blocked
+        by a full queue is released and its item discarded
+        :param drain: If True, the reader gets the pending items before the exit message.
+        Otherwise they are discarded and the reader gets the exit message straight away
+        '''
+        with self.mutex:
+            self.closed=True
+            self.drainOnClose=drain
+            if not drain:
+                self.discardedOnExit+=len(self.itemDeque)
+                self.itemDeque.clear()
+                self.latestSlotDict.clear()
+            self.notEmpty.notify_all()
+            self.notFull.notify_all()
+    
+    def stats(self):
+        '''
+        Return a dictionary with the counters of the queue
+        '''
+        with self.mutex:
+            return {'policy':self.policy,
+                    'maxSize':self.maxSize,
+                    'pending':len(self.itemDeque),
+                    'put':self.putCount,
+                    'dropped':self.dropped,
+                    'coalesced':self.coalesced,
+                    'blockedPuts':self.blockedPuts,
+                    'discardedOnExit':self.discardedOnExit}
@@ -0,0 +1,200 @@
+#!/usr/bin/python
+
+import json
+import os
+import re
+import tables as tb
+
+def fsync_path(path):
+    '''
+    Flush a file or a folder to disk, so a rename inside the folder survives a crash
+    :param path: Path of the file or folder
+    '''
+    fd=os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+def scan_segment_contents(h5FilePath):
+    '''
+    Read the time range, the MAC addresses and the amount of sweeps stored in a segment file,
+    used to recover the segments left open by a crash. Raise an exception if the file can't be read
+    :param h5FilePath: Path of the segment
+    Return a tuple (startTime, endTime, macList, rows), the times are None if there are no rows
+    '''
+    h5File=tb.openFile(h5FilePath, mode="r")
+    try:
+        startTime=endTime=None
+        macList=[]
+        rows=0
+        for group in h5File.iterNodes(h5File.root.scannerNodes, classname='Group'):
+            macList.append(group._v_attrs.macAddr)
+            for table in h5File.iterNodes(group, classname='Table'):
+                if table.nrows==0 or 'rssiCodes' not in table.colnames:
+                    continue
+                timestamps=table.col('timestamp')
+                rows+=table.nrows
+                if startTime==None or timestamps.min()<startTime:
+                    startTime=float(timestamps.min())
+                if endTime==None or timestamps.max()>endTime:
+                    endTime=float(timestamps.max())
+        return startTime, endTime, sorted(macList), rows
+    finally:
+        h5File.close()
+
+def index_segment(h5File):
+    '''
+    Create a full index of the timestamp column of every session table of a segment,
+    so the queries of a time window don't read the whole column. It's done once the
+    segment is complete to keep the cost of updating the index out of the writes
+    :param h5File: Segment opened in append mode
+    '''
+    for table in h5File.walkNodes(h5File.root, classname='Table'):
+        #The timestamps of the files written before the column was scalar can't be indexed
+        if 'rssiCodes' in table.colnames and table.coldescrs['timestamp'].shape==() \
+                and not table.cols.timestamp.is_indexed:
+            table.cols.timestamp.createCSIndex()
+    h5File.flush()
+
+class SegmentManifest():
+    '''
+    Manifest of the segment files of a data folder. The scan data is written
+    into numbered segments, prefix_000001.h5, prefix_000002.h5, etc. The segment being
+    written has the .part suffix and it's renamed once it's closed, so a segment
+    without suffix is always complete. The manifest is a JSON file with the time range,
+    the MAC addresses and the amount of sweeps of every complete segment, so readers
+    can open only the segments they need. It's replaced atomically on every change
+    '''
+    manifestName="manifest.json"
+    partSuffix=".part"
+    corruptSuffix=".corrupt"
+
+    def __init__(self, h5Dir, prefix="scanData"):
+        '''
+        Constructor, loads the manifest of the folder if it exists
+        :param h5Dir: Folder of the segment files
+        :param prefix: Prefix of the names of the segment files
+        '''
+        self.h5Dir=h5Dir
+        self.prefix=prefix
+        self.manifestPath=os.path.join(h5Dir, self.manifestName)
+        self.segmentPattern=re.compile(re.escape(prefix)+r"_(\d+)\.h5")
+        #List of dictionaries with the file name and contents of each segment, sorted by number
+        self.segmentList=[]
+        if os.path.isfile(self.manifestPath):
+            with open(self.manifestPath) as manifestFile:
+                self.segmentList=json.load(manifestFile)['segments']
+
+    def segment_path(self, number, suffix=""):
+        '''
+        Return the path of a segment
+        :param number: Number of the segment
+        :param suffix: Suffix added to the name, such as partSuffix for the segment being written
+        '''
+        return os.path.join(self.h5Dir, "%s_%06d.h5%s" % (self.prefix, number, suffix))
+
+    def segment_numbers(self, suffix=""):
+        '''
+        Return the sorted numbers of the segment files in the folder with the given suffix
+        :param suffix: Suffix of the files, "" for the complete segments
+        '''
+        numberList=[]
+        for fileName in os.listdir(self.h5Dir):
+            match=self.segmentPattern.match(fileName)
+            if match!=None and fileName[match.end():]==suffix:
+                numberList.append(int(match.group(1)))
+        return sorted(numberList)
+
+    def next_number(self):
+        '''
+        Return the number of the next segment, higher than any segment listed
+        in the manifest or present in the folder in any state
+        '''
+        lastNumber=0
+        for fileName in os.listdir(self.h5Dir):
+            match=self.segmentPattern.match(fileName)
+            if match!=None:
+                lastNumber=max(lastNumber, int(match.group(1)))
+        for segment in self.segmentList:
+            lastNumber=max(lastNumber, segment['number'])
+        return lastNumber+1
+
+    def add_segment(self, number, startTime, endTime, macList, rows, recovered=False):
+        '''
+        Add a complete segment to the manifest and save it
+        :param number: Number of the segment
+        :param startTime: Timestamp of the first sweep of the segment
+        :param endTime: Timestamp of the last sweep of the segment
+        :param macList: MAC addresses of the boards with sweeps in the segment
+        :param rows: Amount of sweeps of the segment
+        :param recovered: True if the segment was closed after a crash
+        '''
+        self.segmentList.append({'number':number,
+                                 'file':os.path.basename(self.segment_path(number)),
+                                 'startTime':startTime,
+                                 'endTime':endTime,
+                                 'macAddrs':sorted(macList),
+                                 'rows':rows,
+                                 'recovered':recovered})
+        self.segmentList.sort(key=lambda segment: segment['number'])
+        self.save()
+
+    def save(self):
+        '''
+        Write the manifest to a temporary file and rename it over the old one,
+        so readers always find either the old or the new manifest complete
+        '''
+        tmpPath=self.manifestPath+".tmp"
+        with open(tmpPath, "w") as manifestFile:
+            json.dump({'segments':self.segmentList}, manifestFile, indent=1)
+            manifestFile.flush()
+            os.fsync(manifestFile.fileno())
+        os.rename(tmpPath, self.manifestPath)
+        fsync_path(self.h5Dir)
+
+    def find_segments(self, macAddr=None, startTime=None, endTime=None):
+        '''
+        Return the paths of the complete segments that may hold sweeps
+        of a board within a time window, sorted by time
+        :param macAddr: MAC address of the board, None for any board
+        :param startTime: Start of the time window, None for no lower limit
+        :param endTime: End of the time window, None for no upper limit
+        '''
+        pathList=[]
+        for segment in self.segmentList:
+            if segment['rows']==0:
+                continue
+            if macAddr!=None and macAddr not in segment['macAddrs']:
+                continue
+            if startTime!=None and segment['endTime']<startTime:
+                continue
+            if endTime!=None and segment['startTime']>endTime:
+                continue
+            pathList.append(os.path.join(self.h5Dir, segment['file']))
+        return pathList
+
+    def recover_part(self, number):
+        '''
+        Close a segment left with the .part suffix by a crash. If it can be read,
+        it's renamed to a complete segment and added to the manifest,
+        otherwise it's renamed with the .corrupt suffix and left for manual inspection
+        :param number: Number of the segment
+        Return True if the segment was recovered
+        '''
+        partPath=self.segment_path(number, self.partSuffix)
+        try:
+            startTime, endTime, macList, rows=scan_segment_contents(partPath)
+            h5File=tb.openFile(partPath, mode="a")
+            try:
+                index_segment(h5File)
+            finally:
+                h5File.close()
+        except Exception, e:
+            print "Segment", partPath, "can't be read, keeping it as corrupt:", e
+            os.rename(partPath, self.segment_path(number, self.corruptSuffix))
+            return False
+        os.rename(partPath, self.segment_path(number))
+        fsync_path(self.h5Dir)
+        self.add_segment(number, startTime, endTime, macList, rows, recovered=True)
+        return True
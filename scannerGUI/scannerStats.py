@@ -0,0 +1,189 @@
+#!/usr/bin/python
+
+import bisect
+import collections
+import ctypes
+import ctypes.util
+import math
+import time
+
+def _load_monotonic():
+    '''
+    Return a function that reads a monotonic clock in seconds. Python 2 has no
+    time.monotonic, so CLOCK_MONOTONIC is read through clock_gettime in Linux,
+    falling back to time.time if it's not available
+    '''
+    if hasattr(time, 'monotonic'):
+        return time.monotonic
+
+    class Timespec(ctypes.Structure):
+        _fields_=[('tv_sec', ctypes.c_long), ('tv_nsec', ctypes.c_long)]
+
+    try:
+        librt=ctypes.CDLL(ctypes.util.find_library('rt') or 'librt.so.1', use_errno=True)
+        clockGettime=librt.clock_gettime
+    except (OSError, AttributeError):
+        return time.time
+    clockGettime.argtypes=[ctypes.c_int, ctypes.POINTER(Timespec)]
+    #CLOCK_MONOTONIC in Linux
+    clockId=1
+    timespec=Timespec()
+    timespecRef=ctypes.byref(timespec)
+
+    def monotonic():
+        clockGettime(clockId, timespecRef)
+        return timespec.tv_sec+timespec.tv_nsec*1e-9
+    return monotonic
+
+#Monotonic clock used to timestamp the stages of the ingest pipeline
+monotonic=_load_monotonic()
+
+class LatencyHistogram():
+    '''
+    Histogram of latencies in seconds with logarithmic buckets. Recording a value
+    is a binary search and an increment, so it can be done for every sweep.
+    The percentiles are approximated by the upper bound of their bucket
+    '''
+    
+    def __init__(self, minLatency=1e-6, maxLatency=100.0, bucketsPerDecade=10):
+        '''
+        Constructor
+        :param minLatency: Upper bound of the first bucket in seconds
+        :param maxLatency: Lower bound of the overflow bucket in seconds
+        :param bucketsPerDecade: Amount of buckets between each power of 10
+        '''
+        amtBounds=int(round(bucketsPerDecade*math.log10(maxLatency/minLatency)))+1
+        self.bounds=[minLatency*10**(n/float(bucketsPerDecade)) for n in range(amtBounds)]
+        #The last bucket holds the values above the last bound
+        self.counts=[0]*(len(self.bounds)+1)
+        self.count=0
+        self.total=0.0
+        self.maxValue=0.0
+    
+    def record(self, value):
+        '''
+        Add a latency to the histogram
+        :param value: Latency in seconds
+        '''
+        self.counts[bisect.bisect_left(self.bounds, value)]+=1
+        self.count+=1
+        self.total+=value
+        if value>self.maxValue:
+            self.maxValue=value
+    
+    def percentile(self, percent, counts=None):
+        '''
+        Return the approximate latency below which the given percent of values fall,
+        None if the histogram is empty
+        :param percent: Percent between 0 and 100
+        :param counts: Copy of the bucket counts to use, None to use the current ones
+        '''
+        if counts==None:
+            counts=self.counts
+        amtValues=sum(counts)
+        if amtValues==0:
+            return None
+        threshold=amtValues*percent/100.0
+        accumulated=0
+        for bucketIndex, bucketCount in enumerate(counts):
+            accumulated+=bucketCount
+            if accumulated>=threshold and bucketCount>0:
+                if bucketIndex<len(self.bounds):
+                    return min(self.bounds[bucketIndex], self.maxValue)
+                break
+        return self.maxValue
+    
+    def snapshot(self):
+        '''
+        Return a dictionary with the count, mean, max and main percentiles of the latencies.
+        The counts are copied first, so it can be called while other thread keeps recording
+        '''
+        counts=list(self.counts)
+        count=self.count
+        return {'count':count,
+                'mean':self.total/count if count>0 else None,
+                'p50':self.percentile(50, counts),
+                'p90':self.percentile(90, counts),
+                'p99':self.percentile(99, counts),
+                'max':self.maxValue if count>0 else None}
+    
+class QueueGauge():
+    '''
+    Gauge of the depth of a queue or buffer, sampled by its consumer
+    '''
+    
+    def __init__(self):
+        self.current=0
+        self.peak=0
+        self.samples=0
+        self.total=0
+    
+    def record(self, depth):
+        '''
+        Store a new sample of the depth
+        :param depth: Amount of items waiting
+        '''
+        self.current=depth
+        self.samples+=1
+        self.total+=depth
+        if depth>self.peak:
+            self.peak=depth
+    
+    def snapshot(self):
+        '''
+        Return a dictionary with the current, peak and mean depth
+        '''
+        samples=self.samples
+        return {'current':self.current,
+                'peak':self.peak,
+                'mean':float(self.total)/samples if samples>0 else 0.0}
+    
+class PipelineStats():
+    '''
+    Latency histograms of each stage of the ingest pipeline and depth gauges of its queues.
+    The stage timestamps of a sweep are taken with monotonic() as
+    [received, parsed, dequeued by the writer, committed to the file]
+    '''
+    #Name of each stage, measured between consecutive timestamps, and of the whole pipeline
+    stageNames=('parse', 'queueWait', 'write', 'total')
+    #Datagrams read per socket wakeup, sweeps waiting for the writer and rows written per flush.
+    #All the gauges are created in advance, so the threads that record them never modify the dictionary
+    gaugeNames=('recvBatch', 'scanDataQueue', 'pendingRows')
+    
+    def __init__(self):
+        self.histograms=collections.OrderedDict((stageName, LatencyHistogram()) for stageName in self.stageNames)
+        self.gauges=collections.OrderedDict((gaugeName, QueueGauge()) for gaugeName in self.gaugeNames)
+    
+    def record_stages(self, stageTimes):
+        '''
+        Add the latency of each stage of a sweep to the histograms
+        :param stageTimes: Sequence with the four stage timestamps of the sweep
+        '''
+        recvTime, parsedTime, dequeuedTime, committedTime=stageTimes
+        self.histograms['parse'].record(parsedTime-recvTime)
+        self.histograms['queueWait'].record(dequeuedTime-parsedTime)
+        self.histograms['write'].record(committedTime-dequeuedTime)
+        self.histograms['total'].record(committedTime-recvTime)
+    
+    def snapshot(self):
+        '''
+        Return a dictionary with the snapshot of every histogram and gauge
+        '''
+        return {'stages':collections.OrderedDict((name, histogram.snapshot()) for name, histogram in self.histograms.iteritems()),
+                'gauges':collections.OrderedDict((name, gauge.snapshot()) for name, gauge in self.gauges.iteritems())}
+    
+    @staticmethod
+    def format_snapshot(snapshot):
+        '''
+        Return a snapshot as a human readable table, with the latencies in ms
+        :param snapshot: Dictionary returned by snapshot()
+        '''
+        toMs=lambda value: "%.3f" % (value*1000.0) if value!=None else "-"
+        lines=["%-10s %8s %9s %9s %9s %9s %9s" % ("stage", "count", "mean", "p50", "p90", "p99", "max")]
+        for name, stage in snapshot['stages'].iteritems():
+            lines.append("%-10s %8d %9s %9s %9s %9s %9s" % (name, stage['count'], toMs(stage['mean']), toMs(stage['p50']),
+                                                           toMs(stage['p90']), toMs(stage['p99']), toMs(stage['max'])))
+        lines.append("%-16s %8s %8s %8s" % ("gauge", "current", "peak", "mean"))
+        for name, gauge in snapshot['gauges'].iteritems():
+            lines.append("%-16s %8d %8d %8.1f" % (name, gauge['current'], gauge['peak'], gauge['mean']))
+        return "\n".join(lines)
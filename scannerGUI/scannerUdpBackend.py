@@ -1,16 +1,30 @@
 #!/usr/bin/python
 
+import os
+import errno
 import socket
 import select
 import struct
 import collections
 import binascii
 import threading
-import Queue
 import signal
+import time
 import numpy as np
 from scannerH5Backend import H5ScannerThread
+from scannerH5Process import H5WriterProcess
+from scannerLiveData import LiveDataChannel
+from scannerOccupancy import OccupancyEngine
+from scannerFusion import SpectrumFusion
+from scannerStats import PipelineStats, monotonic
+from scannerQueue import ScanQueue
+from scannerWindowStats import DFLT_WINDOW_SWEEPS, DFLT_WINDOW_TIME, DFLT_EWMA_HALF_LIFE
 
+#Namedtuple format used to pass the scan results of a board to the H5 backend,
+#rssiData holds the sweep in dBm and rssiCodes the raw bytes as received,
+#stageTimes is a list with the monotonic timestamps of the pipeline stages
+#of the sweep (see PipelineStats) or None if they aren't measured
+ScanResults=collections.namedtuple('ScanResults', 'macAddr ipAddr recvOpt rssiData rssiCodes stageTimes')
 
 class UdpScanProt():
 	'''
@@ -20,6 +34,11 @@ class UdpScanProt():
 	protId="GW"
 	headerFormat='<2sH6s'
 	optFormat='<HHHHHBBBBBxH'
+	#Precompiled structs and sizes of the header and the options
+	headerStruct=struct.Struct(headerFormat)
+	optStruct=struct.Struct(optFormat)
+	headerLen=headerStruct.size
+	optLen=optStruct.size
 	Header=collections.namedtuple('ProtHeader', 'protId protLen macAddr')
 	Opt=collections.namedtuple('ScanOptions', 'freqStartMhz freqStartKhz \
 									freqStopMhz freqStopKhz freqRes modFormat agcEnabled \
@@ -51,6 +70,13 @@ class UdpScanProt():
 	minDvgaGain=0
 	maxDvgaGain=7
 	
+	#RSSI conversion, the boards send the raw RSSI register value of the CC1101
+	#as a signed byte, which is converted to dBm as (rssiDec-2*rssiOffset+1)/2
+	rssiOffset=74
+	#Lookup table with the value in dBm of each of the 256 possible RSSI bytes,
+	#indexed by the byte read as unsigned
+	rssiDbmLut=(np.arange(256).astype(np.uint8).view(np.int8).astype(np.float32)-2*rssiOffset+1)/2
+	
 	@staticmethod
 	def validate_opt(opt):
 		'''
@@ -67,33 +93,120 @@ class UdpScanProt():
 			return False
 		else:
 			return True
+	
+	@staticmethod
+	def read_rssi_codes(buf, offset=0, count=-1):
+		'''
+		Return a copy of the raw RSSI bytes of a message as an uint8 array,
+		so the buffer can be reused afterwards
+		:param buf: bytearray or string containing the RSSI bytes
+		:param offset: Position of the first RSSI byte inside buf
+		:param count: Amount of RSSI values to read, -1 reads until the end of buf
+		'''
+		return np.frombuffer(buf, dtype=np.uint8, count=count, offset=offset).copy()
+	
+	@staticmethod
+	def decode_rssi(buf, offset=0, count=-1):
+		'''
+		Convert the raw RSSI bytes of a message to dBm in a single vectorized step.
+		The bytes are viewed in place as an uint8 array, so the payload is not copied
+		:param buf: bytearray or string containing the RSSI bytes
+		:param offset: Position of the first RSSI byte inside buf
+		:param count: Amount of RSSI values to decode, -1 decodes until the end of buf
+		'''
+		return UdpScanProt.rssiDbmLut.take(np.frombuffer(buf, dtype=np.uint8, count=count, offset=offset))
+	
+	@staticmethod
+	def decode_rssi_batch(payloadList):
+		'''
+		Convert the RSSI payloads of several sweeps to dBm at once,
+		returning a 2-D array with one sweep per row
+		:param payloadList: Sequence of bytearrays or strings, all of them
+		with the same amount of RSSI bytes
+		'''
+		rowLen=len(payloadList[0]) if len(payloadList)>0 else 0
+		rssiBytes=np.empty((len(payloadList), rowLen), np.uint8)
+		for rowIndex, payload in enumerate(payloadList):
+			if len(payload)!=rowLen:
+				raise ValueError("All the sweeps of a batch must have the same amount of RSSI values")
+			rssiBytes[rowIndex]=np.frombuffer(payload, dtype=np.uint8)
+		return UdpScanProt.rssiDbmLut.take(rssiBytes)
 
 class UdpScannerServer(threading.Thread):
 	'''
 	Class that starts the receiver socket for the UDP protocol
-	and launches the state machine for each new board that 
-	communicates with the server
+	and runs the event loop that feeds each datagram to the state machine
+	of the board that sent it. All the boards are handled by this single thread
 	'''
 	
-	def __init__(self, guiActive=False):
+	def __init__(self, guiActive=False, rcvBufSize=None, recvBatchSize=64, listenPort=UdpScanProt.listenPort,
+				h5Dir="data", liveChannel=None, stageTiming=True, queueSize=4096, queuePolicy='block',
+				h5Options=None, writerProcess=False, occupancyEngine=None, spectrumFusion=None):
 		'''
 		Init the UDP server back-end
+		:param guiActive: True if there is a GUI that takes care of closing the backend
+		:param rcvBufSize: Size in bytes requested for the SO_RCVBUF of the socket,
+		None keeps the default of the OS
+		:param recvBatchSize: Maximum amount of datagrams read from the socket on each wakeup
+		:param listenPort: UDP port where the server listens
+		:param h5Dir: Folder of the HDF5 segment files where the scan data is stored
+		:param liveChannel: LiveDataChannel where the latest data of each board is published,
+		None to create a new one
+		:param stageTiming: If True, timestamp every sweep at each stage of the pipeline
+		to keep the latency histograms of the stages
+		:param queueSize: Maximum amount of scan results waiting for the H5 backend
+		:param queuePolicy: What to do when the H5 backend falls behind and the queue
+		is full, one of ScanQueue.policies
+		:param h5Options: Dictionary with additional keyword arguments of H5ScannerThread,
+		such as the compression settings or the segment limits, None to use the defaults
+		:param writerProcess: If True, the H5 backend runs in a separate process
+		so the writes don't stall the reception of the datagrams
+		:param occupancyEngine: OccupancyEngine that classifies the channels seen by each board,
+		None to create a new one
+		:param spectrumFusion: SpectrumFusion that joins the latest sweep of every board in a single
+		spectrum, None to create a new one
 		'''
 		
 		self.udpBuflen = 8192
 		self.sock=None
+		self.listenPort=listenPort
+		self.rcvBufSize=rcvBufSize
+		#Pool of receive buffers preallocated once and reused for every batch of datagrams
+		self.recvBatchSize=recvBatchSize
+		self.recvBufPool=[bytearray(self.udpBuflen) for _ in range(self.recvBatchSize)]
+		#Receive counters
+		self.datagramsReceived=0
+		self.bytesReceived=0
+		#Latency histograms of the pipeline stages and depth gauges of its queues
+		self.stageTiming=stageTiming
+		self.pipelineStats=PipelineStats()
 		
-		#Dictionary that maps each active client IP address to its protocol handler
-		#and the state machine queue
-		self.clientDict={}
-		self.ClientHandler=collections.namedtuple('ClientHandler', 'udpChunkQueue scannerSM')
-		#Queue to pass the scan results to the H5 backend
-		#TODO: Consider switching to a Priority queue to 
-		#avoid having to read all the remaining data before the 'exit' string
-		self.scanDataQueue=Queue.Queue()
+		#Dictionary that maps each active client IP address to its protocol state machine,
+		#ordered from the least to the most recently heard board to expire the silent ones
+		self.clientDict=collections.OrderedDict()
+		#If we hear nothing from a board in 5 seconds, we close its state machine
+		self.maxSilentWait=5.0
+		#Bounded queue to pass the scan results to the H5 backend,
+		#closing it makes the H5 backend exit without reading the backlog unless it's drained
+		self.scanDataQueue=ScanQueue(queueSize, queuePolicy)
 		#Lock used to regulate access to the H5 file
 		self.h5FileLock=threading.Lock()
-		self.h5Thread=H5ScannerThread(self.scanDataQueue, self.h5FileLock)
+		#Channel where the H5 backend publishes the latest data of each board for the GUI
+		self.liveChannel=liveChannel if liveChannel!=None else LiveDataChannel()
+		self.writerProcess=writerProcess
+		h5Class=H5WriterProcess if writerProcess else H5ScannerThread
+		self.h5Thread=h5Class(self.scanDataQueue, self.h5FileLock, h5Dir=h5Dir, liveChannel=self.liveChannel,
+							pipelineStats=self.pipelineStats, **(h5Options or {}))
+		#Window statistics of the live data, see SpectrumWindows, the ones set to None are disabled
+		self.windowOptions=dict((name, (h5Options or {}).get(name, dfltValue)) for name, dfltValue in
+								(('windowSweeps', DFLT_WINDOW_SWEEPS), ('windowTime', DFLT_WINDOW_TIME),
+								('ewmaHalfLife', DFLT_EWMA_HALF_LIFE)))
+		#Free and occupied channels seen by each board, the changes are read with its poll()
+		self.occupancyEngine=occupancyEngine if occupancyEngine!=None else OccupancyEngine()
+		self.add_scan_consumer(self.occupancyEngine.update)
+		#Spectrum of all the boards on a common frequency grid, read with its snapshot()
+		self.spectrumFusion=spectrumFusion if spectrumFusion!=None else SpectrumFusion()
+		self.add_scan_consumer(self.spectrumFusion.update)
 		
 		threading.Thread.__init__(self)
 		self.alive = threading.Event()
@@ -103,6 +216,9 @@ class UdpScannerServer(threading.Thread):
 		#if there is no GUI associated to take care of that task
 		if not guiActive:
 			signal.signal(signal.SIGINT, self.sigint_handler)
+		#Dump the statistics on SIGUSR1, signal handlers can only be set from the main thread
+		if hasattr(signal, 'SIGUSR1') and isinstance(threading.current_thread(), threading._MainThread):
+			signal.signal(signal.SIGUSR1, self.sigusr1_handler)
 		
 		#Start the thread by default
 		self.start()
@@ -112,88 +228,218 @@ class UdpScannerServer(threading.Thread):
 			self.sock = socket.socket(socket.AF_INET, # Internet
 				socket.SOCK_DGRAM) # UDP
 			#Bind without specifying IP address to listen in all the interfaces
-			self.sock.bind(("", UdpScanProt.listenPort))
+			if self.rcvBufSize!=None:
+				self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, self.rcvBufSize)
+			#Store the size actually granted by the OS
+			self.rcvBufSize=self.sock.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF)
+			self.sock.bind(("", self.listenPort))
 			self.sock.setblocking(False)
 			
 			while self.alive.isSet():
 				readable, _, _ = select.select([self.sock],[],[],1)
 				if self.sock in readable:
-					dataChunk, ipPortTuple=self.sock.recvfrom(self.udpBuflen)
-					self.addr=ipPortTuple[0]
-					#print "Received a UDP packet of",len(dataChunk),"bytes from:", self.addr
-					#Check if this is a new client and add it to the dictionary
-					#or if the associated state machine timed out
-					if not self.clientDict.has_key(self.addr) or not self.clientDict[self.addr].scannerSM.isAlive():
-						#New client, start a protocol handler thread
-						#and create the communication queue
-						udpChunkQueue=Queue.Queue()
-						self.clientDict[self.addr]=self.ClientHandler(udpChunkQueue=udpChunkQueue, scannerSM=UdpScannerSM(self.addr, udpChunkQueue, self.scanDataQueue))
-					#Process the incoming UDP data
-					self.clientDict[self.addr].udpChunkQueue.put(dataChunk)
+					self.drain_socket()
+				self.expire_clients(time.time())
 		finally:
 			self.sock.close()
+	
+	def drain_socket(self):
+		'''
+		Read all the datagrams pending in the socket into the buffer pool,
+		up to recvBatchSize, and then feed them to the state machines
+		'''
+		recvList=[]
+		for recvBuf in self.recvBufPool:
+			try:
+				nbytes, ipPortTuple=self.sock.recvfrom_into(recvBuf)
+			except socket.error, e:
+				if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+					break
+				raise
+			recvList.append((recvBuf, nbytes, ipPortTuple[0]))
+			self.bytesReceived+=nbytes
+		self.datagramsReceived+=len(recvList)
+		self.pipelineStats.gauges['recvBatch'].record(len(recvList))
+		
+		recvTime=time.time()
+		recvStamp=monotonic() if self.stageTiming else None
+		for recvBuf, nbytes, addr in recvList:
+			self.dispatch_chunk(recvBuf, addr, recvTime, nbytes, recvStamp)
+	
+	def read_kernel_drops(self):
+		'''
+		Return the amount of datagrams dropped by the kernel because the receive
+		buffer of the socket was full, or None if the OS doesn't report it.
+		The counter is read from /proc/net/udp, so it's only available in Linux
+		'''
+		if self.sock==None:
+			return None
+		try:
+			sockInode=str(os.fstat(self.sock.fileno()).st_ino)
+			with open("/proc/net/udp") as udpFile:
+				#Skip the header line, the inode is the 10th field and the drops the last one
+				for line in udpFile.readlines()[1:]:
+					fields=line.split()
+					if fields[9]==sockInode:
+						return int(fields[-1])
+		except (IOError, OSError, socket.error, IndexError, ValueError):
+			pass
+		return None
+	
+	def recv_stats(self):
+		'''
+		Return a dictionary with the receive counters of the server,
+		useful to size the socket buffer for the grid
+		'''
+		return {'datagramsReceived':self.datagramsReceived,
+				'bytesReceived':self.bytesReceived,
+				'kernelDrops':self.read_kernel_drops(),
+				'rcvBufSize':self.rcvBufSize}
+	
+	def stats(self):
+		'''
+		Return a dictionary with the receive and write counters and the snapshot
+		of the pipeline histograms and gauges. It can be called from any thread
+		while the backend keeps running
+		'''
+		pipelineSnapshot=self.pipelineStats.snapshot()
+		if self.writerProcess:
+			self.h5Thread.merge_pipeline(pipelineSnapshot)
+		return {'recv':self.recv_stats(),
+				'write':self.h5Thread.write_stats(),
+				'queue':self.scanDataQueue.stats(),
+				'pipeline':pipelineSnapshot}
+	
+	def add_scan_consumer(self, consumer):
+		'''
+		Add a function that is called with the scan results of every board, including the
+		timeouts, in the thread that reads the scan queue. It runs out of the receive loop,
+		but it delays the writes, so it should take a small time compared to the sweep period
+		:param consumer: Function that takes a ScanResults namedtuple, with rssiData set to None if the board timed out
+		'''
+		self.h5Thread.scanConsumers.append(consumer)
+	
+	def dump_stats(self):
+		'''
+		Print the statistics of the backend as a human readable table
+		'''
+		stats=self.stats()
+		print "Receive:", ", ".join("%s=%s" % item for item in sorted(stats['recv'].iteritems()))
+		print "Write:", ", ".join("%s=%s" % item for item in sorted(stats['write'].iteritems()))
+		print "Queue:", ", ".join("%s=%s" % item for item in sorted(stats['queue'].iteritems()))
+		print PipelineStats.format_snapshot(stats['pipeline'])
+	
+	def dispatch_chunk(self, dataChunk, addr, recvTime, chunkLen=None, recvStamp=None):
+		'''
+		Feed a chunk of UDP data to the state machine of the board that sent it,
+		creating the state machine if this is a new client
+		:param dataChunk: Chunk of UDP data received through the socket
+		:param addr: IP address of the board that sent the data
+		:param recvTime: Time at which the data was received
+		:param chunkLen: Amount of valid bytes in dataChunk, None if it's the whole chunk
+		:param recvStamp: Monotonic time at which the data was received, None to not time the stages
+		'''
+		#print "Received a UDP packet of",len(dataChunk),"bytes from:", addr
+		#Pop the state machine and insert it again to keep the clients
+		#sorted by the time they were last heard
+		scannerSM=self.clientDict.pop(addr, None)
+		if scannerSM==None:
+			scannerSM=UdpScannerSM(addr, self.scanDataQueue)
+		scannerSM.lastHeard=recvTime
+		self.clientDict[addr]=scannerSM
+		scannerSM.process_chunk(dataChunk, chunkLen, recvStamp)
+	
+	def expire_clients(self, now):
+		'''
+		Close the state machines of the boards that have been silent for 
+		longer than maxSilentWait and inform the H5 backend about it
+		:param now: Current time
+		'''
+		while len(self.clientDict)>0:
+			addr, scannerSM=next(self.clientDict.iteritems())
+			if now-scannerSM.lastHeard<self.maxSilentWait:
+				break
+			del self.clientDict[addr]
+			scannerSM.timeout()
 		
-	def close_backend(self):
+	def close_backend(self, drain=False):
 		'''
 		Close all threads
+		:param drain: If True, the H5 backend writes the scan results still in the queue before
+		closing the segment. Otherwise it gets the exit message ahead of them and only writes
+		the rows it already had pending, so the shutdown doesn't wait behind the backlog
 		'''
 		self.alive.clear()
-		for clientAddr in self.clientDict:
-			self.clientDict[clientAddr].udpChunkQueue.put('exit')
-		#Send the exit message to the H5 thread through the queue
-		self.scanDataQueue.put('exit')
+		self.scanDataQueue.close(drain)
 	
 	def sigint_handler(self,signum,stack):
 		print "\nCtrl-C detected, closing the backend threads and the HDF5 file..."
 		self.close_backend()
+	
+	def sigusr1_handler(self,signum,stack):
+		self.dump_stats()
 		
-class UdpScannerSM(threading.Thread):
+class UdpScannerSM():
 	'''
 	State machine class for the UDP scanning protocol. It processes the chunks of data
-	received via UDP and stores them into the Queue that feeds the graphical interface 
+	received via UDP and stores them into the Queue that feeds the H5 backend.
+	It has no thread of its own, the server calls it for every chunk of the board
 	'''
 	
-	def __init__(self, clientAddr, udpChunkQueue, scanDataQueue):
+	def __init__(self, clientAddr, scanDataQueue):
 		self.ipAddr = clientAddr
 		self.macAddr=""
-		self.udpChunkQueue = udpChunkQueue
+		#Raw MAC address of the last header, to format it only when it changes
+		self.rawMacAddr=None
 		self.scanDataQueue = scanDataQueue
-		
-		#Namedtuple format to input data into the queue of the graphical interface 
-		self.ScanResults=collections.namedtuple('ScanResult', 'macAddr ipAddr recvOpt rssiData')
+		#Time at which the server last received data from the board
+		self.lastHeard=0
 		
 		#Protocol parameters
 		self.recvScanOptions=UdpScanProt.defaultOpt
-		#The payload format will be defined once we know the full length of the message
-		self.dataPayloadFormat=""
-		#If we hear nothing from the board in 5 seconds, we close the state machine
-		self.maxSilentWait=5.0
 		
 		#SM parameters
 		self.udpScanState=self.protIdle
 		self.udpScanPrevState=self.protIdle
 		self.rssiData=np.array([], np.dtype('B'))
+		self.rssiCodes=np.array([], np.dtype('B'))
 		self.protBuffer=bytearray()
 		self.newChunk=bytearray()
+		#Position of the first byte of protBuffer not consumed yet by the states,
+		#the consumed bytes are trimmed once per chunk instead of once per state
+		self.bufOffset=0
 		self.amtRssiValues=0
 		self.msgExpected=False
+		#Monotonic time at which the first data of the current message was received
+		self.recvStamp=None
 		
-		threading.Thread.__init__(self)
-		self.alive = threading.Event()
-		self.alive.set()
-		self.start()
-		
+	def buffered_bytes(self):
+		'''
+		Return the amount of bytes of protBuffer not consumed yet
+		'''
+		return len(self.protBuffer)-self.bufOffset
+	
+	def set_mac_addr(self, rawMacAddr):
+		'''
+		Store the MAC address of the board formatted for easier printing
+		:param rawMacAddr: The 6 bytes of the MAC address as received
+		'''
+		if rawMacAddr!=self.rawMacAddr:
+			self.rawMacAddr=rawMacAddr
+			self.macAddr=":".join(binascii.hexlify(x) for x in rawMacAddr)
+	
 	#Define the state machine for the custom UDP protocol
 	#****SM Start****
 	def protFail(self):
 		#print "FAIL state"
 		self.protBuffer=bytearray()
+		self.bufOffset=0
 		self.msgExpected=True
 		return self.protIdle
 	
 	def protIdle(self):
 		#print "IDLE state"
-		if len(self.protBuffer)>0:
+		if self.buffered_bytes()>0:
 			self.rssiData=np.array([], np.dtype('B'))
 			self.amtRssiValues=0
 			return self.protRecvHeader
@@ -203,22 +449,18 @@ class UdpScannerSM(threading.Thread):
 		
 	def protRecvHeader(self):
 		#print "RECV_HEADER state"
-		if len(self.protBuffer)>=struct.calcsize(UdpScanProt.headerFormat):
-# 			protId, msgLen, rawMac=struct.unpack_from(UdpScanProt.headerFormat, bytes(self.protBuffer))
-			protHeader=UdpScanProt.Header._make(struct.unpack_from(UdpScanProt.headerFormat, bytes(self.protBuffer)))
-			#Format the mac address for easier printing
-			mac = [binascii.hexlify(x) for x in protHeader.macAddr]
-			self.macAddr=":".join(mac)
-			del self.protBuffer[:struct.calcsize(UdpScanProt.headerFormat)]
+		if self.buffered_bytes()>=UdpScanProt.headerLen:
+			protHeader=UdpScanProt.Header._make(UdpScanProt.headerStruct.unpack_from(self.protBuffer, self.bufOffset))
+			self.set_mac_addr(protHeader.macAddr)
+			self.bufOffset+=UdpScanProt.headerLen
 			if protHeader.protId==UdpScanProt.protId:
-				if protHeader.protLen<struct.calcsize(UdpScanProt.optFormat):
+				if protHeader.protLen<UdpScanProt.optLen:
 					return self.protFail
-				#Get the amount of UINT16 RSSI values that the message contains and initialize the dataPayloadFormat string
-				self.amtRssiValues=protHeader.protLen-struct.calcsize(UdpScanProt.headerFormat)-struct.calcsize(UdpScanProt.optFormat)
+				#Get the amount of RSSI values that the message contains
+				self.amtRssiValues=protHeader.protLen-UdpScanProt.headerLen-UdpScanProt.optLen
 				if self.amtRssiValues<=0:
 					#Bad message, no RSSI data inside
 					return self.protFail
-				self.dataPayloadFormat=str(self.amtRssiValues)+"b"
 				return self.protRecvOpt
 			else:
 				#Wrong ProtId, ignoring message
@@ -229,9 +471,9 @@ class UdpScannerSM(threading.Thread):
 	
 	def protRecvOpt(self):
 		#print "RECV_OPT state"
-		if len(self.protBuffer)>=struct.calcsize(UdpScanProt.optFormat):
-			self.recvScanOptions=UdpScanProt.Opt._make(struct.unpack_from(UdpScanProt.optFormat, bytes(self.protBuffer)))
-			del self.protBuffer[:struct.calcsize(UdpScanProt.optFormat)]
+		if self.buffered_bytes()>=UdpScanProt.optLen:
+			self.recvScanOptions=UdpScanProt.Opt._make(UdpScanProt.optStruct.unpack_from(self.protBuffer, self.bufOffset))
+			self.bufOffset+=UdpScanProt.optLen
 			#Check if the options make sense
 			if UdpScanProt.validate_opt(self.recvScanOptions):
 				return self.protRecvData
@@ -243,15 +485,11 @@ class UdpScannerSM(threading.Thread):
 	
 	def protRecvData(self):
 		#print "RECV_DATA state"
-		if len(self.protBuffer)>=struct.calcsize(self.dataPayloadFormat):
-			#print "Unpacking RSSI data"
-			rssiByteData=struct.unpack_from(self.dataPayloadFormat, bytes(self.protBuffer))
-			del self.protBuffer[:struct.calcsize(self.dataPayloadFormat)]
-			
-			#Convert the RSSI data to dBm
-			rssiDbmData = [(int(x)-2*74+1)/2.0 for x in rssiByteData]
-			#rssiDbmData = [x if x>=-120 else -70 for x in rssiDbmData]
-			self.rssiData=np.array(rssiDbmData)
+		if self.buffered_bytes()>=self.amtRssiValues:
+			#Keep the raw RSSI bytes for the file and convert them to dBm for the front-end
+			self.rssiCodes=UdpScanProt.read_rssi_codes(self.protBuffer, offset=self.bufOffset, count=self.amtRssiValues)
+			self.rssiData=UdpScanProt.rssiDbmLut.take(self.rssiCodes)
+			self.bufOffset+=self.amtRssiValues
 			#print "RSSI data: ", self.rssiData
 			return self.protRecvDone
 		
@@ -262,44 +500,83 @@ class UdpScannerSM(threading.Thread):
 	def protRecvDone(self):
 		#print "RECV_DONE state"
 		#print "***Finished receiving packet***\n"
-		self.msgExpected=True
 		#Pass the data to the graphical front-end as a namedtuple through the queue
-		self.scanDataQueue.put(self.ScanResults(macAddr=self.macAddr, ipAddr=self.ipAddr, recvOpt=self.recvScanOptions, rssiData=self.rssiData))
+		stageTimes=[self.recvStamp, monotonic()] if self.recvStamp!=None else None
+		self.scanDataQueue.put(ScanResults(macAddr=self.macAddr, ipAddr=self.ipAddr, recvOpt=self.recvScanOptions,
+										rssiData=self.rssiData, rssiCodes=self.rssiCodes, stageTimes=stageTimes))
+		#The IDLE state waits for more data only if there isn't
+		#another message concatenated after this one
 		return self.protIdle
 		
 		#****SM END****
 	
-	def run(self):
+	def parse_datagram(self, dataChunk, chunkLen):
 		'''
-		Main handler of the state machine
-		:param data: Chunk of UDP data received through the socket
+		Fast path for the usual case of a datagram that holds exactly one message.
+		The header, the options and the payload are decoded in a single pass
+		straight from the receive buffer, without going through protBuffer
+		:param dataChunk: Datagram received through the socket
+		:param chunkLen: Amount of valid bytes in dataChunk
+		Return False if the datagram is not a single complete message,
+		so it must go through the state machine
 		'''
-		while self.alive.isSet():
-			#Wait until a new chunk of data arrives or 
-			#the timeout condition is fulfilled
-			try:
-				newDataChunk=self.udpChunkQueue.get(block=True, timeout=self.maxSilentWait)
-			except Queue.Empty, e:
-				#Inform the H5 backend about the timeout by sending None in place of the rssi array
-				self.scanDataQueue.put(self.ScanResults(macAddr=self.macAddr, ipAddr=self.ipAddr, recvOpt=None, rssiData=None))
-				self.join()
-			else:
-				#Check if we received the exit message
-				if newDataChunk=='exit':
-					self.alive.clear()
-					break
-				#Save the new data into the buffer
-				self.protBuffer.extend(newDataChunk)
-				self.msgExpected=False
-				while not self.msgExpected:
-					#if self.udpScanPrevState!=self.udpScanState:
-					#	print "State changed to ", self.udpScanState
-					self.udpScanPrevState=self.udpScanState
-					self.udpScanState=self.udpScanState()
+		if chunkLen<UdpScanProt.headerLen+UdpScanProt.optLen:
+			return False
+		protHeader=UdpScanProt.Header._make(UdpScanProt.headerStruct.unpack_from(dataChunk))
+		if protHeader.protLen!=chunkLen or protHeader.protId!=UdpScanProt.protId:
+			return False
+		self.amtRssiValues=chunkLen-UdpScanProt.headerLen-UdpScanProt.optLen
+		if self.amtRssiValues<=0:
+			return False
+		recvScanOptions=UdpScanProt.Opt._make(UdpScanProt.optStruct.unpack_from(dataChunk, UdpScanProt.headerLen))
+		if not UdpScanProt.validate_opt(recvScanOptions):
+			return False
+		self.set_mac_addr(protHeader.macAddr)
+		self.recvScanOptions=recvScanOptions
+		self.rssiCodes=UdpScanProt.read_rssi_codes(dataChunk, offset=UdpScanProt.headerLen+UdpScanProt.optLen,
+													count=self.amtRssiValues)
+		self.rssiData=UdpScanProt.rssiDbmLut.take(self.rssiCodes)
+		self.protRecvDone()
+		return True
 	
-	def join(self, timeout=None):
-		self.alive.clear()
-#		threading.Thread.join(self, timeout)
+	def process_chunk(self, dataChunk, chunkLen=None, recvStamp=None):
+		'''
+		Main handler of the state machine, runs it until it needs more data
+		:param dataChunk: Chunk of UDP data received through the socket
+		:param chunkLen: Amount of valid bytes in dataChunk, None if it's the whole chunk
+		:param recvStamp: Monotonic time at which the chunk was received, None to not time the stages
+		'''
+		if chunkLen==None:
+			chunkLen=len(dataChunk)
+		#A new message starts with this chunk
+		if self.buffered_bytes()==0:
+			self.recvStamp=recvStamp
+			#Nothing pending from previous chunks, try the single message fast path first
+			if self.udpScanState==self.protIdle and self.parse_datagram(dataChunk, chunkLen):
+				return
+		#Fragmented or concatenated messages go through the state machine,
+		#save the new data into the buffer
+		if chunkLen==len(dataChunk):
+			self.protBuffer.extend(dataChunk)
+		else:
+			self.protBuffer.extend(memoryview(dataChunk)[:chunkLen])
+		self.msgExpected=False
+		while not self.msgExpected:
+			#if self.udpScanPrevState!=self.udpScanState:
+			#	print "State changed to ", self.udpScanState
+			self.udpScanPrevState=self.udpScanState
+			self.udpScanState=self.udpScanState()
+		#Trim the bytes consumed by the states
+		if self.bufOffset>0:
+			del self.protBuffer[:self.bufOffset]
+			self.bufOffset=0
+	
+	def timeout(self):
+		'''
+		Inform the H5 backend that the board went silent
+		by sending None in place of the rssi array
+		'''
+		self.scanDataQueue.put(ScanResults(macAddr=self.macAddr, ipAddr=self.ipAddr, recvOpt=None, rssiData=None, rssiCodes=None, stageTimes=None))
 
 
 class UdpScannerClient(threading.Thread):
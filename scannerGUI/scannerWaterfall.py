@@ -0,0 +1,101 @@
+#!/usr/bin/python
+
+import threading
+import numpy as np
+
+class WaterfallRing():
+    '''
+    Ring buffer with the last maxRows sweeps of a board. Every sweep is written twice,
+    in rows head and head+maxRows of a buffer of 2*maxRows rows, so the last maxRows
+    sweeps are always the contiguous rows [head, head+maxRows), oldest first, and can
+    be read as a view without copying or rolling the buffer
+    '''
+    
+    def __init__(self, maxRows, amtRssiValues):
+        '''
+        Constructor, the rows without sweeps are NaN
+        :param maxRows: Amount of sweeps kept
+        :param amtRssiValues: Amount of RSSI values of each sweep
+        '''
+        self.maxRows=maxRows
+        self.rows=np.empty((2*maxRows, amtRssiValues), dtype=np.float32)
+        self.rows.fill(np.nan)
+        self.head=0
+        #Amount of sweeps appended since the creation of the ring
+        self.seq=0
+    
+    def append(self, rssiData):
+        '''
+        Add a sweep, replacing the oldest one
+        :param rssiData: Sweep in dBm
+        '''
+        self.rows[self.head]=rssiData
+        self.rows[self.head+self.maxRows]=rssiData
+        self.head=(self.head+1)%self.maxRows
+        self.seq+=1
+    
+    def view(self):
+        '''
+        Return a view of the last maxRows sweeps, oldest first
+        '''
+        return self.rows[self.head:self.head+self.maxRows]
+    
+    def newest(self, amtRows):
+        '''
+        Return a view of the last amtRows sweeps, oldest first
+        :param amtRows: Amount of sweeps, at most maxRows
+        '''
+        return self.rows[self.head+self.maxRows-amtRows:self.head+self.maxRows]
+    
+class WaterfallBuffer():
+    '''
+    Waterfall of the latest sweeps of every board, meant to be added as a scan consumer
+    of the UDP backend. A reader keeps the sequence number of the last sweep it got
+    and only copies the sweeps received since then
+    '''
+    
+    def __init__(self, maxRows=256):
+        '''
+        Constructor
+        :param maxRows: Amount of sweeps kept for each board
+        '''
+        self.maxRows=maxRows
+        self.lock=threading.Lock()
+        #Ring and scan options of the sweeps of each board, indexed by MAC address
+        self.ringDict={}
+    
+    def update(self, scanResults):
+        '''
+        Add a sweep to the waterfall of its board, the waterfall starts again if the scan options change.
+        The timeouts are ignored, the waterfall of the board keeps its last sweeps
+        :param scanResults: ScanResults namedtuple, with rssiData set to None if the board timed out
+        '''
+        if scanResults.rssiData is None:
+            return
+        with self.lock:
+            ring, scanOpt=self.ringDict.get(scanResults.macAddr, (None, None))
+            if ring==None or scanOpt!=scanResults.recvOpt or ring.rows.shape[1]!=len(scanResults.rssiData):
+                ring=WaterfallRing(self.maxRows, len(scanResults.rssiData))
+                self.ringDict[scanResults.macAddr]=(ring, scanResults.recvOpt)
+            ring.append(scanResults.rssiData)
+    
+    def read_new(self, macAddr, lastSeq, lastOpt=None):
+        '''
+        Return the sweeps of a board received after a given one as a tuple
+        (scanOpt, newRows, seq), newRows is a copy with at most maxRows sweeps,
+        oldest first, and seq is the sequence number of the last one.
+        If the scan options aren't lastOpt anymore, the waterfall of the board
+        started again and all its sweeps are returned.
+        Return None if there is no waterfall for the board
+        :param macAddr: MAC address of the board
+        :param lastSeq: Sequence number of the last sweep read, 0 for none
+        :param lastOpt: Scan options of the last sweep read
+        '''
+        with self.lock:
+            ring, scanOpt=self.ringDict.get(macAddr, (None, None))
+            if ring==None:
+                return None
+            if scanOpt!=lastOpt or lastSeq>ring.seq:
+                lastSeq=0
+            amtRows=min(ring.seq-lastSeq, ring.maxRows)
+            return scanOpt, ring.newest(amtRows).copy(), ring.seq
@@ -0,0 +1,248 @@
+#!/usr/bin/python
+
+import collections
+import math
+import numpy as np
+
+#Windows used when none are configured: amount of sweeps of the SweepWindow, length in seconds
+#of the TimeWindow and half-life in seconds of the EwmaStats
+DFLT_WINDOW_SWEEPS=100
+DFLT_WINDOW_TIME=60.0
+DFLT_EWMA_HALF_LIFE=10.0
+
+#Statistics in dBm of a window of sweeps, rssiMin and rssiMax are None for the exponential average
+WindowStats=collections.namedtuple('WindowStats', 'rssiMin rssiAvg rssiMax')
+
+class SweepWindow():
+    '''
+    Min, average and max of the last windowSweeps sweeps. The min and the max use the
+    van Herk/Gil-Werman algorithm: the sweeps are split in blocks of windowSweeps, the
+    window is the end of the previous block and the start of the current one, so it's
+    the combination of a suffix of the previous block, computed once when the block is
+    complete, and a running prefix of the current one. The average is a running sum
+    that subtracts the sweep that leaves the window. The work per sweep is a few
+    operations over the sweep, plus one pass over the block once per windowSweeps sweeps
+    '''
+    
+    def __init__(self, windowSweeps, amtRssiValues):
+        '''
+        Constructor
+        :param windowSweeps: Amount of sweeps of the window
+        :param amtRssiValues: Amount of RSSI values of each sweep
+        '''
+        self.windowSweeps=windowSweeps
+        #Sweeps of the current block, the ones not yet replaced belong to the previous block
+        self.sweeps=np.empty((windowSweeps, amtRssiValues), np.float32)
+        #Min and max of the previous block from each sweep to its end
+        self.suffixMin=np.empty((windowSweeps, amtRssiValues), np.float32)
+        self.suffixMax=np.empty((windowSweeps, amtRssiValues), np.float32)
+        #Min and max of the current block from its start
+        self.prefixMin=np.empty(amtRssiValues, np.float32)
+        self.prefixMax=np.empty(amtRssiValues, np.float32)
+        self.rssiSum=np.zeros(amtRssiValues, np.float64)
+        self.rssiMin=np.empty(amtRssiValues, np.float32)
+        self.rssiAvg=np.empty(amtRssiValues, np.float32)
+        self.rssiMax=np.empty(amtRssiValues, np.float32)
+        #Amount of sweeps added
+        self.count=0
+    
+    def update(self, rssiData):
+        '''
+        Add a new sweep to the window, removing the oldest one if the window is full
+        :param rssiData: Array with the RSSI values of the sweep in dBm
+        '''
+        position=self.count%self.windowSweeps
+        if self.count>=self.windowSweeps:
+            #The sweep that leaves the window is the one of the previous block in the same position
+            self.rssiSum-=self.sweeps[position]
+        self.rssiSum+=rssiData
+        self.sweeps[position]=rssiData
+        if position==0:
+            self.prefixMin[:]=rssiData
+            self.prefixMax[:]=rssiData
+        else:
+            np.minimum(self.prefixMin, rssiData, out=self.prefixMin)
+            np.maximum(self.prefixMax, rssiData, out=self.prefixMax)
+        self.count+=1
+        
+        if position==self.windowSweeps-1:
+            #The block is complete and it's the whole window
+            self.rssiMin[:]=self.prefixMin
+            self.rssiMax[:]=self.prefixMax
+            np.minimum.accumulate(self.sweeps[::-1], axis=0, out=self.suffixMin[::-1])
+            np.maximum.accumulate(self.sweeps[::-1], axis=0, out=self.suffixMax[::-1])
+            #The sum is taken again from the sweeps so the rounding errors don't build up
+            self.sweeps.sum(axis=0, dtype=np.float64, out=self.rssiSum)
+        elif self.count<=self.windowSweeps:
+            #There is no previous block yet
+            self.rssiMin[:]=self.prefixMin
+            self.rssiMax[:]=self.prefixMax
+        else:
+            np.minimum(self.suffixMin[position+1], self.prefixMin, out=self.rssiMin)
+            np.maximum(self.suffixMax[position+1], self.prefixMax, out=self.rssiMax)
+        np.divide(self.rssiSum, min(self.count, self.windowSweeps), out=self.rssiAvg)
+    
+class TimeWindow():
+    '''
+    Min, average and max of the sweeps of the last windowTime seconds. The window is split
+    in amtBuckets buckets of windowTime/amtBuckets seconds aligned to multiples of their length,
+    each one with the min, max, sum and count of its sweeps. The buckets before the current one
+    are combined once when a bucket starts and a new sweep only updates the current bucket,
+    so the window covers between windowTime*(1-1/amtBuckets) and windowTime seconds
+    '''
+    
+    def __init__(self, windowTime, amtRssiValues, amtBuckets=10):
+        '''
+        Constructor
+        :param windowTime: Length of the window in seconds
+        :param amtRssiValues: Amount of RSSI values of each sweep
+        :param amtBuckets: Amount of buckets the window is split in
+        '''
+        self.bucketTime=float(windowTime)/amtBuckets
+        self.amtBuckets=amtBuckets
+        #Ring of buckets, the bucket number n is stored in the position n%amtBuckets
+        self.bucketNumber=np.empty(amtBuckets, np.int64)
+        self.bucketNumber.fill(-1)
+        self.bucketCount=np.zeros(amtBuckets, np.int64)
+        self.bucketMin=np.empty((amtBuckets, amtRssiValues), np.float32)
+        self.bucketMax=np.empty((amtBuckets, amtRssiValues), np.float32)
+        self.bucketSum=np.zeros((amtBuckets, amtRssiValues), np.float64)
+        self.currentNumber=None
+        #Statistics of the buckets of the window before the current one
+        self.closedCount=0
+        self.closedMin=np.empty(amtRssiValues, np.float32)
+        self.closedMax=np.empty(amtRssiValues, np.float32)
+        self.closedSum=np.zeros(amtRssiValues, np.float64)
+        self.rssiMin=np.empty(amtRssiValues, np.float32)
+        self.rssiAvg=np.empty(amtRssiValues, np.float32)
+        self.rssiMax=np.empty(amtRssiValues, np.float32)
+    
+    def start_bucket(self, number):
+        '''
+        Make a bucket the current one, replacing the one that leaves the window,
+        and combine the buckets of the window before it
+        :param number: Number of the bucket, its start time divided by the bucket length
+        '''
+        self.currentNumber=number
+        position=number%self.amtBuckets
+        self.bucketNumber[position]=number
+        self.bucketCount[position]=0
+        closedList=np.flatnonzero((self.bucketNumber>number-self.amtBuckets)&(self.bucketNumber<number)
+                                  &(self.bucketCount>0))
+        self.closedCount=int(self.bucketCount[closedList].sum())
+        if self.closedCount>0:
+            self.bucketMin[closedList].min(axis=0, out=self.closedMin)
+            self.bucketMax[closedList].max(axis=0, out=self.closedMax)
+            self.bucketSum[closedList].sum(axis=0, out=self.closedSum)
+    
+    def update(self, timestamp, rssiData):
+        '''
+        Add a new sweep to the window
+        :param timestamp: Timestamp of the sweep
+        :param rssiData: Array with the RSSI values of the sweep in dBm
+        '''
+        number=int(math.floor(timestamp/self.bucketTime))
+        if number!=self.currentNumber:
+            self.start_bucket(number)
+        position=number%self.amtBuckets
+        if self.bucketCount[position]==0:
+            self.bucketMin[position]=rssiData
+            self.bucketMax[position]=rssiData
+            self.bucketSum[position]=rssiData
+        else:
+            np.minimum(self.bucketMin[position], rssiData, out=self.bucketMin[position])
+            np.maximum(self.bucketMax[position], rssiData, out=self.bucketMax[position])
+            self.bucketSum[position]+=rssiData
+        self.bucketCount[position]+=1
+        
+        if self.closedCount>0:
+            np.minimum(self.closedMin, self.bucketMin[position], out=self.rssiMin)
+            np.maximum(self.closedMax, self.bucketMax[position], out=self.rssiMax)
+            np.add(self.closedSum, self.bucketSum[position], out=self.rssiAvg, casting='unsafe')
+        else:
+            self.rssiMin[:]=self.bucketMin[position]
+            self.rssiMax[:]=self.bucketMax[position]
+            self.rssiAvg[:]=self.bucketSum[position]
+        self.rssiAvg/=self.closedCount+self.bucketCount[position]
+    
+class EwmaStats():
+    '''
+    Exponentially weighted moving average of the sweeps. The weight of a sweep halves
+    every halfLife seconds, using the time between the sweeps, so the average reacts
+    the same regardless of the sweep rate
+    '''
+    
+    def __init__(self, halfLife, amtRssiValues):
+        '''
+        Constructor
+        :param halfLife: Time in seconds after which the weight of a sweep halves
+        :param amtRssiValues: Amount of RSSI values of each sweep
+        '''
+        self.halfLife=float(halfLife)
+        self.rssiAvg=np.empty(amtRssiValues, np.float32)
+        #Scratch array for the update
+        self.rssiDelta=np.empty(amtRssiValues, np.float32)
+        self.lastTime=None
+    
+    def update(self, timestamp, rssiData):
+        '''
+        Add a new sweep to the average
+        :param timestamp: Timestamp of the sweep
+        :param rssiData: Array with the RSSI values of the sweep in dBm
+        '''
+        if self.lastTime==None:
+            self.rssiAvg[:]=rssiData
+        else:
+            #avg+=(1-0.5**(dt/halfLife))*(rssiData-avg)
+            weight=1.0-0.5**(max(0.0, timestamp-self.lastTime)/self.halfLife)
+            np.subtract(rssiData, self.rssiAvg, out=self.rssiDelta)
+            self.rssiDelta*=np.float32(weight)
+            self.rssiAvg+=self.rssiDelta
+        self.lastTime=timestamp
+    
+class SpectrumWindows():
+    '''
+    Window statistics of the sweeps of a board, as opposed to the running statistics of
+    RssiAccumulator that cover the whole session and stop reacting after a while: the
+    last windowSweeps sweeps, the last windowTime seconds and an exponential average
+    '''
+    
+    def __init__(self, amtRssiValues, windowSweeps=DFLT_WINDOW_SWEEPS, windowTime=DFLT_WINDOW_TIME, windowBuckets=10,
+                 ewmaHalfLife=DFLT_EWMA_HALF_LIFE):
+        '''
+        Constructor
+        :param amtRssiValues: Amount of RSSI values of each sweep
+        :param windowSweeps: Amount of sweeps of the SweepWindow, None to disable it
+        :param windowTime: Length in seconds of the TimeWindow, None to disable it
+        :param windowBuckets: Amount of buckets of the TimeWindow
+        :param ewmaHalfLife: Half-life in seconds of the EwmaStats, None to disable it
+        '''
+        self.sweepWindow=SweepWindow(windowSweeps, amtRssiValues) if windowSweeps else None
+        self.timeWindow=TimeWindow(windowTime, amtRssiValues, windowBuckets) if windowTime else None
+        self.ewma=EwmaStats(ewmaHalfLife, amtRssiValues) if ewmaHalfLife else None
+    
+    def update(self, timestamp, rssiData):
+        '''
+        Add a new sweep to every window
+        :param timestamp: Timestamp of the sweep
+        :param rssiData: Array with the RSSI values of the sweep in dBm
+        '''
+        if self.sweepWindow!=None:
+            self.sweepWindow.update(rssiData)
+        if self.timeWindow!=None:
+            self.timeWindow.update(timestamp, rssiData)
+        if self.ewma!=None:
+            self.ewma.update(timestamp, rssiData)
+    
+    def snapshot(self):
+        '''
+        Return a dictionary with a copy of the WindowStats of every window,
+        indexed by 'sweeps', 'time' and 'ewma'
+        '''
+        statsDict={}
+        for windowName, window in (('sweeps', self.sweepWindow), ('time', self.timeWindow)):
+            if window!=None:
+                statsDict[windowName]=WindowStats(window.rssiMin.copy(), window.rssiAvg.copy(), window.rssiMax.copy())
+        if self.ewma!=None:
+            statsDict['ewma']=WindowStats(None, self.ewma.rssiAvg.copy(), None)
+        return statsDict
@@ -0,0 +1,94 @@
+#!/usr/bin/python
+
+import unittest
+from collections import namedtuple
+import numpy as np
+from scannerFusion import SpectrumFusion
+
+#Only the fields read by the fusion
+FakeOpt=namedtuple('FakeOpt', 'freqStartMhz freqStartKhz freqRes')
+FakeResults=namedtuple('FakeResults', 'macAddr recvOpt rssiData')
+
+#Overlapping ranges over a grid from 100 to 110 MHz in steps of 0.2 MHz: coarser, equal and finer than the grid
+BOARD_SETTINGS={'A':[(FakeOpt(100, 0, 406.0), 12), (FakeOpt(103, 0, 812.0), 8)],
+                'B':[(FakeOpt(102, 0, 203.0), 30), (FakeOpt(100, 400, 203.0), 20)],
+                'C':[(FakeOpt(104, 0, 100.0), 40), (FakeOpt(101, 0, 58.0), 60)],
+                'D':[(FakeOpt(108, 0, 406.0), 10)]}
+
+class SpectrumFusionTest(unittest.TestCase):
+    '''
+    The incremental statistics match a recompute over the latest resampled sweep of every board
+    '''
+    
+    def setUp(self):
+        self.fusion=SpectrumFusion(gridStart=100.0, gridStop=110.0, gridRes=0.2, maxBoards=2)
+        #Latest sweep of each board resampled to the whole grid, NaN where it isn't covered
+        self.expectedDict={}
+    
+    def send(self, macAddr, scanOpt, rssiData):
+        self.fusion.update(FakeResults(macAddr, scanOpt, rssiData))
+        if rssiData is None:
+            self.expectedDict.pop(macAddr, None)
+            return
+        gridMap=self.fusion.get_grid_map(scanOpt, len(rssiData))
+        gridSweep=np.empty(len(self.fusion.gridFreqs), np.float32)
+        gridSweep.fill(np.nan)
+        gridSweep[gridMap.gridStart:gridMap.gridStop]=gridMap.resample(rssiData)
+        self.expectedDict[macAddr]=gridSweep
+    
+    def check_fused(self):
+        fusedSpectrum=self.fusion.snapshot()
+        if len(self.expectedDict)==0:
+            self.assertTrue((fusedSpectrum.count==0).all())
+            self.assertTrue(np.isnan(fusedSpectrum.rssiMax).all())
+            return
+        boardSweeps=np.array(self.expectedDict.values())
+        covered=~np.isnan(boardSweeps)
+        np.testing.assert_array_equal(fusedSpectrum.count, covered.sum(axis=0))
+        with np.errstate(invalid='ignore'), np.warnings.catch_warnings():
+            #The frequencies no board covers are NaN, as in the fused spectrum
+            np.warnings.simplefilter('ignore', RuntimeWarning)
+            np.testing.assert_array_equal(fusedSpectrum.rssiMax, np.nanmax(boardSweeps, axis=0))
+            np.testing.assert_array_equal(fusedSpectrum.rssiMin, np.nanmin(boardSweeps, axis=0))
+            np.testing.assert_allclose(fusedSpectrum.rssiAvg, np.nanmean(boardSweeps.astype(np.float64), axis=0),
+                                       rtol=0, atol=1e-3)
+    
+    def test_grid_maps_overlap(self):
+        #Every board shares part of its range with another one, so the statistics combine several sweeps
+        for macAddr, settingList in BOARD_SETTINGS.items():
+            scanOpt, amtRssiValues=settingList[0]
+            self.send(macAddr, scanOpt, np.zeros(amtRssiValues, np.float32))
+        self.assertGreater(self.fusion.snapshot().count.max(), 2)
+    
+    def test_matches_recompute(self):
+        randomGen=np.random.RandomState(7)
+        macList=sorted(BOARD_SETTINGS)
+        boardSettings=dict((macAddr, BOARD_SETTINGS[macAddr][0]) for macAddr in macList)
+        for updateNumber in range(600):
+            macAddr=macList[randomGen.randint(len(macList))]
+            action=randomGen.rand()
+            if action<0.05:
+                #The board times out
+                self.send(macAddr, None, None)
+            else:
+                if action<0.1:
+                    #The board changes its frequency setting
+                    settingList=BOARD_SETTINGS[macAddr]
+                    boardSettings[macAddr]=settingList[randomGen.randint(len(settingList))]
+                scanOpt, amtRssiValues=boardSettings[macAddr]
+                #Rounded values so the maximum and the minimum are often shared by several boards
+                rssiData=np.round(randomGen.uniform(-110, -40, amtRssiValues)/5)*5
+                self.send(macAddr, scanOpt, rssiData.astype(np.float32))
+            self.check_fused()
+    
+    def test_board_rows_grow(self):
+        #More boards than the initial rows of the matrix
+        for boardNumber in range(5):
+            self.send('M%d' % boardNumber, FakeOpt(100, 0, 203.0), np.full(50, -100.0+boardNumber, np.float32))
+        self.check_fused()
+        for boardNumber in range(5):
+            self.send('M%d' % boardNumber, None, None)
+        self.check_fused()
+    
+if __name__=='__main__':
+    unittest.main()
@@ -0,0 +1,120 @@
+#!/usr/bin/python
+
+import Queue
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+import numpy as np
+import tables as tb
+from scannerUdpBackend import UdpScanProt, ScanResults
+from scannerH5Backend import H5ScannerThread, blosc_codecs
+from scannerLiveData import LiveDataChannel
+from scannerQuery import ScanArchive
+
+def sweep(macAddr):
+    '''
+    Return the ScanResults of a sweep of a board with the default options
+    '''
+    rssiCodes=np.zeros(733, np.uint8)
+    return ScanResults(macAddr, '127.0.0.1', UdpScanProt.defaultOpt, UdpScanProt.rssiDbmLut.take(rssiCodes), rssiCodes, None)
+
+class SegmentRolloverTest(unittest.TestCase):
+    '''
+    The boards carried over to a new segment keep their status and session
+    '''
+    
+    def setUp(self):
+        self.h5Dir=tempfile.mkdtemp()
+        self.scanQueue=Queue.Queue()
+        self.liveChannel=LiveDataChannel()
+        self.h5Thread=H5ScannerThread(self.scanQueue, threading.Lock(), h5Dir=self.h5Dir, flushLatency=0.05,
+                                      segmentTime=0.3, liveChannel=self.liveChannel)
+    
+    def tearDown(self):
+        self.scanQueue.put('exit')
+        while self.h5Thread.isAlive():
+            time.sleep(0.01)
+        shutil.rmtree(self.h5Dir)
+    
+    def wait_queue(self):
+        while self.scanQueue.qsize()>0:
+            time.sleep(0.01)
+        time.sleep(0.1)
+    
+    def test_timeout_before_first_sweep_of_segment(self):
+        self.scanQueue.put(sweep('A'))
+        self.wait_queue()
+        firstJoin=self.liveChannel.get('A').joinTime
+        #A sweep of another board after the segment time rolls the segment over
+        time.sleep(0.4)
+        self.scanQueue.put(sweep('B'))
+        self.wait_queue()
+        self.assertIn('A', self.h5Thread.carryDict)
+        
+        self.scanQueue.put(ScanResults('A', '127.0.0.1', None, None, None, None))
+        self.wait_queue()
+        self.assertFalse(self.liveChannel.get('A').isAlive)
+        self.assertNotIn('A', self.h5Thread.carryDict)
+        #The board starts a new session when it comes back
+        self.scanQueue.put(sweep('A'))
+        self.wait_queue()
+        self.assertTrue(self.liveChannel.get('A').isAlive)
+        self.assertGreater(self.liveChannel.get('A').joinTime, firstJoin)
+    
+class HistoryLevelsTest(unittest.TestCase):
+    '''
+    Validation of the history levels and names of their tables
+    '''
+    
+    def setUp(self):
+        self.h5Dir=tempfile.mkdtemp()
+    
+    def tearDown(self):
+        shutil.rmtree(self.h5Dir)
+    
+    def test_invalid_levels(self):
+        for historyLevels in ((0.0,), (-10.0,), (float('nan'),), (10.0, 15.0), (60.0, 10.0)):
+            self.assertRaises(ValueError, H5ScannerThread, Queue.Queue(), threading.Lock(),
+                              h5Dir=self.h5Dir, historyLevels=historyLevels)
+    
+    def test_table_names(self):
+        scanQueue=Queue.Queue()
+        h5Thread=H5ScannerThread(scanQueue, threading.Lock(), h5Dir=self.h5Dir, historyLevels=(0.1, 0.5))
+        scanQueue.put(sweep('A'))
+        scanQueue.put('exit')
+        while h5Thread.isAlive():
+            time.sleep(0.01)
+        for h5FilePath in ScanArchive(self.h5Dir).find_files('A', None, None):
+            h5File=tb.openFile(h5FilePath, mode="r")
+            try:
+                table=h5File.root.scannerNodes.node1.session1
+                self.assertEqual(list(table.attrs.historyTables), ['history1_0', 'history1_1'])
+                #The tables can be reached with natural naming
+                self.assertEqual(h5File.root.scannerNodes.node1.history1_1.nrows, 1)
+            finally:
+                h5File.close()
+    
+class CompressionTest(unittest.TestCase):
+    '''
+    The compression settings are checked when the thread is created
+    '''
+    
+    def setUp(self):
+        self.h5Dir=tempfile.mkdtemp()
+    
+    def tearDown(self):
+        shutil.rmtree(self.h5Dir)
+    
+    def test_unknown_library(self):
+        self.assertRaises(ValueError, H5ScannerThread, Queue.Queue(), threading.Lock(), h5Dir=self.h5Dir, complib="gzip")
+    
+    def test_unknown_blosc_codec(self):
+        if tb.whichLibVersion("blosc")==None:
+            self.skipTest("blosc not available")
+        self.assertNotIn("nocodec", blosc_codecs())
+        self.assertRaises(ValueError, H5ScannerThread, Queue.Queue(), threading.Lock(), h5Dir=self.h5Dir, complib="blosc:nocodec")
+    
+if __name__=='__main__':
+    unittest.main()
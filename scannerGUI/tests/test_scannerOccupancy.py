@@ -0,0 +1,77 @@
+#!/usr/bin/python
+
+import unittest
+from collections import namedtuple
+import numpy as np
+from scannerOccupancy import OccupancyEngine
+
+#Only the fields read by the engine
+FakeOpt=namedtuple('FakeOpt', 'freqStartMhz freqStartKhz freqRes')
+FakeResults=namedtuple('FakeResults', 'macAddr recvOpt rssiData')
+
+#Two channels of 0.5 MHz in band A and one of 1 MHz in band B, swept from 100 to 101.9 MHz in steps of 100 KHz
+BAND_PLAN=[("A", 100.0, 101.0, 0.5), ("B", 101.0, 102.0, 1.0)]
+SCAN_OPT=FakeOpt(100, 0, 100.0)
+AMT_BINS=20
+NOISE_FLOOR=-100.0
+
+class OccupancyEngineTest(unittest.TestCase):
+    '''
+    Classification of the channels of a single board with a flat noise floor
+    '''
+    
+    def setUp(self):
+        self.engine=OccupancyEngine(BAND_PLAN, onMargin=10.0, offMargin=6.0, occupiedFraction=0.2)
+        self.sweep(NOISE_FLOOR)
+    
+    def sweep(self, channelLevel):
+        '''
+        Feed a sweep with the first channel of band A at channelLevel dBm and the rest at the noise floor,
+        return the changes published
+        '''
+        rssiData=np.empty(AMT_BINS, np.float32)
+        rssiData.fill(NOISE_FLOOR)
+        rssiData[0:5]=channelLevel
+        self.engine.update(FakeResults('M', SCAN_OPT, rssiData), now=0.0)
+        return self.engine.poll()
+    
+    def test_new_board_starts_free(self):
+        self.assertEqual(self.engine.poll(), [])
+        self.assertEqual(self.engine.free_channels('M', 'A'), [("A", 100.0, 100.5), ("A", 100.5, 101.0)])
+        self.assertEqual(self.engine.free_channels('M', 'B'), [("B", 101.0, 102.0)])
+    
+    def test_hysteresis(self):
+        #Under the on margin, a free channel stays free
+        self.assertEqual(self.sweep(NOISE_FLOOR+8), [])
+        changeList=self.sweep(NOISE_FLOOR+15)
+        self.assertEqual([(change.bandName, change.lowFreq, change.isFree) for change in changeList], [("A", 100.0, False)])
+        #Over the off margin, an occupied channel stays occupied
+        self.assertEqual(self.sweep(NOISE_FLOOR+8), [])
+        changeList=self.sweep(NOISE_FLOOR+3)
+        self.assertEqual([(change.bandName, change.lowFreq, change.isFree) for change in changeList], [("A", 100.0, True)])
+    
+    def test_change_published_once(self):
+        self.assertEqual(len(self.sweep(NOISE_FLOOR+15)), 1)
+        for sweepNumber in range(5):
+            self.assertEqual(self.sweep(NOISE_FLOOR+15), [])
+    
+    def test_free_sets_per_band(self):
+        self.sweep(NOISE_FLOOR+15)
+        self.assertEqual(self.engine.free_channels('M', 'A'), [("A", 100.5, 101.0)])
+        self.assertEqual(self.engine.free_channels('M', 'B'), [("B", 101.0, 102.0)])
+        self.assertEqual(self.engine.free_channels('M'), [("A", 100.5, 101.0), ("B", 101.0, 102.0)])
+        self.sweep(NOISE_FLOOR)
+        self.assertEqual(len(self.engine.free_channels('M', 'A')), 2)
+    
+    def test_timeout_publishes_unknown(self):
+        self.engine.update(FakeResults('M', None, None), now=1.0)
+        changeList=self.engine.poll()
+        self.assertEqual(len(changeList), 3)
+        self.assertTrue(all(change.isFree==None for change in changeList))
+        self.assertEqual(self.engine.free_channels('M'), [])
+        #A board that isn't known publishes nothing
+        self.engine.update(FakeResults('N', None, None), now=1.0)
+        self.assertEqual(self.engine.poll(), [])
+    
+if __name__=='__main__':
+    unittest.main()
@@ -0,0 +1,104 @@
+#!/usr/bin/python
+
+import math
+import Queue
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+import numpy as np
+import tables as tb
+from scannerUdpBackend import UdpScanProt, ScanResults
+from scannerH5Backend import H5ScannerThread
+from scannerQuery import ScanArchive
+
+#Short history levels so a second of sweeps fills several buckets
+HISTORY_LEVELS=(0.1, 0.2)
+
+def write_sweeps(h5Dir, historyLevels, amtSweeps=100, sweepPeriod=0.01):
+    '''
+    Write the sweeps of the board 'A' with the H5 backend, return the amount written
+    '''
+    scanOpt=UdpScanProt.defaultOpt
+    amtRssiValues=int(round((scanOpt.freqStopMhz+scanOpt.freqStopKhz/1000.0-scanOpt.freqStartMhz-scanOpt.freqStartKhz/1000.0)
+                            /(scanOpt.freqRes/1000.0)))
+    scanQueue=Queue.Queue()
+    h5Thread=H5ScannerThread(scanQueue, threading.Lock(), h5Dir=h5Dir, flushLatency=0.05, historyLevels=historyLevels)
+    for sweepNumber in range(amtSweeps):
+        rssiCodes=np.random.randint(0, 256, amtRssiValues).astype(np.uint8)
+        scanQueue.put(ScanResults('A', '127.0.0.1', scanOpt, UdpScanProt.rssiDbmLut.take(rssiCodes), rssiCodes, None))
+        time.sleep(sweepPeriod)
+    scanQueue.put('exit')
+    #The segment is complete once the thread ends
+    while h5Thread.isAlive():
+        time.sleep(0.01)
+    return amtSweeps
+
+class QueryHistoryTest(unittest.TestCase):
+    '''
+    The buckets read from the history hold every sweep of the time window
+    '''
+    
+    @classmethod
+    def setUpClass(cls):
+        cls.h5Dir=tempfile.mkdtemp()
+        cls.amtSweeps=write_sweeps(cls.h5Dir, HISTORY_LEVELS)
+        cls.archive=ScanArchive(cls.h5Dir)
+        cls.timestamps=cls.archive.query('A')[0].timestamps
+    
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.h5Dir)
+    
+    def test_session_counts(self):
+        self.assertEqual(len(self.timestamps), self.amtSweeps)
+        blockList=self.archive.query_history('A', self.timestamps[0], self.timestamps[-1], maxRows=2)
+        self.assertEqual(len(blockList), 1)
+        self.assertEqual(blockList[0].bucketTime, HISTORY_LEVELS[-1])
+        #The first sweep isn't at the start of its bucket
+        self.assertLess(blockList[0].timestamps[0], self.timestamps[0])
+        self.assertEqual(int(blockList[0].count.sum()), self.amtSweeps)
+    
+    def test_window_counts(self):
+        #A window that starts and ends in the middle of a bucket
+        for bucketTime in HISTORY_LEVELS:
+            startTime=self.timestamps[0]+0.35
+            endTime=self.timestamps[-1]-0.25
+            blockList=self.archive.query_history('A', startTime, endTime, maxRows=int((endTime-startTime)/bucketTime))
+            self.assertEqual(blockList[0].bucketTime, bucketTime)
+            bucketStarts=np.array([math.floor(timestamp/bucketTime)*bucketTime for timestamp in self.timestamps])
+            amtExpected=int(((bucketStarts>startTime-bucketTime)&(bucketStarts<=endTime)).sum())
+            self.assertEqual(int(blockList[0].count.sum()), amtExpected)
+    
+class QueryWithoutHistoryTest(unittest.TestCase):
+    '''
+    The sessions written before the history was added are read sweep by sweep
+    '''
+    
+    def setUp(self):
+        self.h5Dir=tempfile.mkdtemp()
+        self.amtSweeps=write_sweeps(self.h5Dir, HISTORY_LEVELS, amtSweeps=20)
+        self.archive=ScanArchive(self.h5Dir)
+        for h5FilePath in self.archive.find_files('A', None, None):
+            h5File=tb.openFile(h5FilePath, mode="a")
+            try:
+                for table in h5File.walkNodes(h5File.root.scannerNodes, classname='Table'):
+                    if 'historyLevels' in table.attrs:
+                        del table.attrs.historyLevels
+                        del table.attrs.historyTables
+            finally:
+                h5File.close()
+    
+    def tearDown(self):
+        shutil.rmtree(self.h5Dir)
+    
+    def test_raw_sweeps(self):
+        timestamps=self.archive.query('A')[0].timestamps
+        blockList=self.archive.query_history('A', timestamps[0], timestamps[-1], maxRows=2)
+        self.assertEqual(len(blockList), 1)
+        self.assertEqual(blockList[0].bucketTime, 0.0)
+        self.assertEqual(int(blockList[0].count.sum()), self.amtSweeps)
+    
+if __name__=='__main__':
+    unittest.main()
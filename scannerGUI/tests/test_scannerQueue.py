@@ -0,0 +1,56 @@
+#!/usr/bin/python
+
+import threading
+import time
+import unittest
+from collections import namedtuple
+from scannerQueue import ScanQueue
+
+#Only the fields read by the queue
+FakeResults=namedtuple('FakeResults', 'macAddr rssiData')
+
+class ScanQueueCloseTest(unittest.TestCase):
+    '''
+    Closing the queue gives the exit message to the reader ahead of the pending sweeps unless they are drained
+    '''
+    
+    def fill_queue(self, amtItems):
+        scanQueue=ScanQueue(16, 'block')
+        for itemNumber in range(amtItems):
+            scanQueue.put(FakeResults('A', itemNumber))
+        return scanQueue
+    
+    def test_close_jumps_backlog(self):
+        scanQueue=self.fill_queue(5)
+        scanQueue.close()
+        self.assertEqual(scanQueue.get(timeout=0.1), ScanQueue.exitMessage)
+        self.assertEqual(scanQueue.qsize(), 0)
+        self.assertEqual(scanQueue.stats()['discardedOnExit'], 5)
+    
+    def test_close_drains_pending(self):
+        scanQueue=self.fill_queue(5)
+        scanQueue.close(drain=True)
+        itemList=[scanQueue.get(timeout=0.1).rssiData for itemNumber in range(5)]
+        self.assertEqual(itemList, range(5))
+        self.assertEqual(scanQueue.get(timeout=0.1), ScanQueue.exitMessage)
+        self.assertEqual(scanQueue.stats()['discardedOnExit'], 0)
+    
+    def test_put_after_close_is_discarded(self):
+        scanQueue=self.fill_queue(2)
+        scanQueue.close(drain=True)
+        scanQueue.put(FakeResults('A', 99))
+        self.assertEqual(scanQueue.qsize(), 2)
+        self.assertEqual(scanQueue.stats()['discardedOnExit'], 1)
+    
+    def test_close_wakes_waiting_reader(self):
+        scanQueue=ScanQueue(16, 'block')
+        resultList=[]
+        reader=threading.Thread(target=lambda: resultList.append(scanQueue.get(timeout=5.0)))
+        reader.start()
+        time.sleep(0.05)
+        scanQueue.close()
+        reader.join(1.0)
+        self.assertEqual(resultList, [ScanQueue.exitMessage])
+    
+if __name__=='__main__':
+    unittest.main()